@@ -3,14 +3,31 @@
 """Common functions not specifically related to batchuploads or wiki."""
 from __future__ import unicode_literals
 from builtins import dict, open
+import gzip  # needed by open_text_file()
+import hashlib  # needed by file_sha1() and json_hash()
+import io  # needed by open_text_file()
 import json
+import math  # needed by percentile()
 import os
 import operator  # needed by sorted_dict
+import sqlite3  # needed by PersistentCache
 import sys  # needed by convert_from_commandline()
+import time  # needed by PersistentCache
 import locale  # needed by convert_from_commandline()
+import threading  # needed by LogFile
 from datetime import datetime  # needed for LogFile.write()
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
 from pywikibot.tools import deprecated
 
+SHARD_INDEX_SUFFIX = '.index.jsonl'  # see write_json_shards()
+
+# supported compression formats and their magic numbers
+COMPRESSIONS = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd'}
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
 
 # avoid having to use from past.builtins import basestring
 try:
@@ -51,39 +68,362 @@ def is_pos_int(value):
     return False
 
 
+def is_pos_number(value):
+    """Check if the given value is a positive, finite, number.
+
+    @param value: The value to check
+    @type value: str, int or float
+    @return bool
+    """
+    try:
+        number = float(value)
+    except (ValueError, TypeError):
+        return False
+    return 0 < number < float('inf')
+
+
+def detect_compression(filename):
+    """
+    Detect the compression of a file from its first bytes.
+
+    @param filename: the file to check
+    @return: one of the COMPRESSIONS, or None if the file is uncompressed
+    """
+    with open(filename, 'rb') as f:
+        start = f.read(4)
+    for compression, magic in COMPRESSIONS.items():
+        if start.startswith(magic):
+            return compression
+
+
+def open_text_file(filename, mode='r', codec='utf-8', compression=None):
+    """
+    Open a, possibly compressed, text file using the provided codec.
+
+    When reading, any compression is detected automatically. zstd support
+    requires the optional zstandard package.
+
+    @param filename: the file to open
+    @param mode: "r", "w" or "a"
+    @param codec: the used encoding (defaults to "utf-8")
+    @param compression: one of the COMPRESSIONS, or None for an uncompressed
+        file (ignored when reading)
+    @return: file object
+    """
+    if mode == 'r':
+        compression = detect_compression(filename)
+    if not compression:
+        return open(filename, mode, encoding=codec)
+    elif compression == 'gzip':
+        raw = gzip.open(filename, mode + 'b')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise MyError(
+                'zstd compression requires the zstandard package')
+        raw = zstandard.open(filename, mode + 'b')
+    else:
+        raise MyError('Unknown compression: {0}'.format(compression))
+    return io.TextIOWrapper(raw, encoding=codec)
+
+
 def open_and_read_file(filename, codec='utf-8', as_json=False):
     """
     Open and read a file using the provided codec.
 
-    Automatically closes the file on return.
+    Automatically closes the file on return. Compressed files are
+    decompressed (see open_text_file()).
 
     @param filename: the file to open
     @param codec: the used encoding (defaults to "utf-8")
     @param json: load as json instead of reading
     """
-    with open(filename, 'r', encoding=codec) as f:
+    with open_text_file(filename, 'r', codec=codec) as f:
         if as_json:
             return json.load(f)
         return f.read()
 
 
-def open_and_write_file(filename, text, codec='utf-8', as_json=False):
+def open_and_write_file(filename, text, codec='utf-8', as_json=False,
+                        compact=False, compression=None):
     """
     Open and write to a file using the provided codec.
 
     Automatically closes the file on return.
 
+    A dict dumped as json is written one entry at a time, rather than first
+    serialising all of it, and the output is pretty-printed unless compact.
+
     @param filename: the file to open
     @param text: the text to output to the file
     @param codec: the used encoding (defaults to "utf-8")
     @param json: if text is an object which should be dumped as json
+    @param compact: whether to dump json without any indentation or spaces
+    @param compression: one of the COMPRESSIONS to compress the file with
+        (defaults to no compression)
     """
-    with open(filename, 'w', encoding=codec) as f:
-        if as_json:
-            f.write(
-                json.dumps(text, indent=4, ensure_ascii=False, sort_keys=True))
-        else:
+    indent = None if compact else 4
+    with open_text_file(filename, 'w', codec=codec,
+                        compression=compression) as f:
+        if not as_json:
             f.write(text)
+        elif isinstance(text, dict) and all(is_str(key) for key in text):
+            f.write('{')
+            for i, key in enumerate(sorted(text.keys())):
+                f.write(format_json_entry(
+                    key, text[key], indent, first=i == 0))
+            f.write('}' if compact or not text else '\n}')
+        else:
+            f.write(json.dumps(
+                text, indent=indent, ensure_ascii=False, sort_keys=True,
+                separators=(',', ':') if compact else None))
+
+
+def format_json_entry(key, value, indent=4, first=False):
+    """
+    Format a single entry of a json object as json.dumps() would.
+
+    @param key: the key of the entry
+    @param value: a json serialisable value
+    @param indent: number of spaces to indent each level by, or None for
+        compact output
+    @param first: whether this is the first entry of the object
+    @return: str, including any separator from the preceding entry
+    """
+    separator = '' if first else ','
+    key = json.dumps(key, ensure_ascii=False)
+    if indent is None:
+        return '{0}{1}:{2}'.format(separator, key, json.dumps(
+            value, ensure_ascii=False, sort_keys=True,
+            separators=(',', ':')))
+    padding = ' ' * indent
+    text = json.dumps(value, indent=indent, ensure_ascii=False,
+                      sort_keys=True)
+    return '{0}\n{1}{2}: {3}'.format(
+        separator, padding, key, text.replace('\n', '\n' + padding))
+
+
+def iter_json_object(filename, codec='utf-8', block_size=65536):
+    """
+    Iterate over the entries of a json file containing a single object.
+
+    The file is parsed incrementally, one entry at a time, so that only the
+    current entry (and a block of the file) is kept in memory. Entries are
+    yielded in file order. Unlike json.load() duplicate keys are all
+    yielded.
+
+    @param filename: the json file to read
+    @param codec: the encoding of the file
+    @param block_size: number of characters to read at a time
+    @return: generator of (key, value) tuples
+    @raises: ValueError if the file is not a json object
+    """
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+    with open_text_file(filename, 'r', codec=codec) as f:
+        state = {'buffer': '', 'pos': 0, 'eof': False}
+
+        def read_more():
+            """Extend the buffer, dropping what has already been parsed."""
+            if state['eof']:
+                raise ValueError(
+                    'Unexpected end of json object in {0}'.format(filename))
+            # grow geometrically so that huge entries are not re-parsed often
+            unparsed = state['buffer'][state['pos']:]
+            block = f.read(max(block_size, len(unparsed)))
+            state['buffer'] = unparsed + block
+            state['pos'] = 0
+            state['eof'] = not block
+
+        def next_char():
+            """Skip any whitespace and return the next character."""
+            while True:
+                buff, pos = state['buffer'], state['pos']
+                while pos < len(buff) and buff[pos] in whitespace:
+                    pos += 1
+                state['pos'] = pos
+                if pos < len(buff):
+                    return buff[pos]
+                read_more()
+
+        def expect(chars):
+            """Consume the next character, which must be one of chars."""
+            char = next_char()
+            if char not in chars:
+                raise ValueError(
+                    'Expected one of "{0}" but found "{1}" in {2}'.format(
+                        chars, char, filename))
+            state['pos'] += 1
+            return char
+
+        def decode():
+            """Decode the next json value, reading more data if needed."""
+            next_char()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(
+                        state['buffer'], state['pos'])
+                except ValueError:
+                    read_more()
+                    continue
+                # a number at the end of the buffer may be truncated
+                if end == len(state['buffer']) and not state['eof']:
+                    read_more()
+                    continue
+                state['pos'] = end
+                return value
+
+        read_more()
+        expect('{')
+        if next_char() == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            value = decode()
+            yield key, value
+            if expect(',}') == '}':
+                return
+
+
+def write_json_shards(base_name, data, shard_size=10000, codec='utf-8'):
+    """
+    Write a json object as a set of json lines shards with an index.
+
+    The entries are written in sorted key order, see JsonShardsWriter for
+    details on the format. The shards can be read back using JsonShards.
+
+    @param base_name: base name (including path) of the output files
+    @param data: the dict to write
+    @param shard_size: maximum number of entries per shard
+    @param codec: the used encoding (defaults to "utf-8")
+    @return: the filename of the index
+    """
+    writer = JsonShardsWriter(base_name, shard_size=shard_size, codec=codec)
+    for key in sorted(data.keys()):
+        writer.write(key, data[key])
+    writer.close_and_confirm()
+    return writer.file_name
+
+
+def replace_file(source, target):
+    """Move a file into place, replacing any existing file."""
+    if hasattr(os, 'replace'):
+        os.replace(source, target)
+    else:  # python 2
+        if os.path.exists(target):
+            os.remove(target)
+        os.rename(source, target)
+
+
+def is_json_shards(filename):
+    """Determine if a filename is the index of a set of json shards."""
+    return filename.endswith(SHARD_INDEX_SUFFIX)
+
+
+def open_json_object(filename, codec='utf-8'):
+    """
+    Open a json file, or set of json shards, containing a single object.
+
+    A plain json file is loaded in full whereas json shards are only read
+    as entries are requested.
+
+    @param filename: the json file or the index of a set of json shards
+    @param codec: the used encoding (defaults to "utf-8")
+    @return: dict or JsonShards
+    """
+    if is_json_shards(filename):
+        return JsonShards(filename, codec=codec)
+    return open_and_read_file(filename, codec=codec, as_json=True)
+
+
+def iter_json_entries(filename, codec='utf-8'):
+    """
+    Iterate over the entries of a json file, or set of json shards.
+
+    Neither format is loaded into memory in full.
+
+    @param filename: the json file or the index of a set of json shards
+    @param codec: the used encoding (defaults to "utf-8")
+    @return: generator of (key, value) tuples
+    """
+    if is_json_shards(filename):
+        return JsonShards(filename, codec=codec).items()
+    return iter_json_object(filename, codec=codec)
+
+
+def json_hash(obj):
+    """
+    Calculate a stable SHA1 hash of a json serialisable object.
+
+    Dicts are hashed independently of their key order. Sets and objects
+    which are not json serialisable are represented by their sorted values
+    and their attributes (or repr) respectively.
+
+    @param obj: the object to hash
+    @return: str, the hexadecimal digest
+    """
+    def default(o):
+        """Represent an object which json cannot serialise."""
+        if isinstance(o, (set, frozenset)):
+            return sorted(o, key=repr)
+        if hasattr(o, '__dict__'):
+            return vars(o)
+        return repr(o)
+
+    text = json.dumps(obj, ensure_ascii=False, sort_keys=True,
+                      default=default)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def iter_batches(iterable, size):
+    """
+    Split an iterable into lists of (at most) a given size.
+
+    @param iterable: the iterable to split
+    @param size: the size of each batch, if None all values end up in a
+        single batch
+    @return: generator of lists
+    """
+    batch = []
+    for value in iterable:
+        batch.append(value)
+        if size and len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def file_sha1(filename, block_size=1048576):
+    """
+    Calculate the SHA1 hash of a file, reading it in blocks.
+
+    @param filename: the file to hash
+    @param block_size: number of bytes to read at a time (defaults to 1 MB)
+    @return: str, the hexadecimal digest
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def percentile(values, percent):
+    """
+    Return the given percentile of a list of values (nearest-rank method).
+
+    @param values: list of numbers
+    @param percent: the percentile to return (0-100)
+    @return: the value, or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent * len(values) / 100.0))
+    return values[max(1, min(rank, len(values))) - 1]
 
 
 def sorted_dict(ddict):
@@ -338,7 +678,7 @@ class MyError(Exception):
 
 
 class LogFile(object):
-    """A simple object for doing logging."""
+    """A simple, thread safe, object for doing logging."""
 
     def __init__(self, output_dir, name):
         """
@@ -349,6 +689,7 @@ class LogFile(object):
         """
         self.file_name = os.path.join(output_dir, name)
         self.file = open(self.file_name, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
 
     def write(self, text):
         """
@@ -359,8 +700,9 @@ class LogFile(object):
 
         @param text: text to output
         """
-        self.file.write('{0}\n'.format(text))
-        self.file.flush()
+        with self.lock:
+            self.file.write('{0}\n'.format(text))
+            self.file.flush()
 
     def write_w_timestamp(self, text):
         """
@@ -375,3 +717,404 @@ class LogFile(object):
         """Close the log file and return a confirmation."""
         self.file.close()
         return 'Created {0}'.format(self.file_name)
+
+
+class JsonShards(object):
+    """
+    Read only, dict like, access to json shards written by write_json_shards.
+
+    Only the header of the index is read on initialisation. The rest of the
+    index is loaded on the first look-up, after which each entry is read
+    from its shard on demand. Iterating over items() streams the shards
+    without loading the index.
+    """
+
+    def __init__(self, index_file, codec='utf-8'):
+        """
+        Initialise the JsonShards.
+
+        @param index_file: the index written by write_json_shards()
+        @param codec: the used encoding (defaults to "utf-8")
+        """
+        self.index_file = index_file
+        self.codec = codec
+        with open(index_file, 'r', encoding=codec) as f:
+            header = json.loads(f.readline())
+        if header.get('version') != 1:
+            raise MyError('Unsupported json shards index: {0}'.format(
+                index_file))
+        self.count = header['count']
+        shard_dir = os.path.dirname(index_file)
+        self.shards = [os.path.join(shard_dir, shard)
+                       for shard in header['shards']]
+        self.index = None
+        self.files = {}  # open shard file handles
+        self.lock = threading.Lock()
+
+    def load_index(self):
+        """Load the key to (shard, offset) index, unless already loaded."""
+        if self.index is not None:
+            return
+        index = dict()
+        with open(self.index_file, 'r', encoding=self.codec) as f:
+            f.readline()  # skip header
+            for line in f:
+                key, shard, offset = json.loads(line)
+                index[key] = (shard, offset)
+        self.index = index
+
+    def __len__(self):
+        """Return the number of entries."""
+        return self.count
+
+    def __contains__(self, key):
+        """Determine if there is an entry for the key."""
+        self.load_index()
+        return key in self.index
+
+    def __iter__(self):
+        """Iterate over the keys."""
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        """Read the value of a single entry from its shard."""
+        self.load_index()
+        shard, offset = self.index[key]
+        with self.lock:
+            if shard not in self.files:
+                self.files[shard] = open(self.shards[shard], 'rb')
+            f = self.files[shard]
+            f.seek(offset)
+            line = f.readline()
+        return json.loads(line.decode(self.codec))[1]
+
+    def get(self, key, default=None):
+        """Return the value for the key if present, else default."""
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        """Return the keys in sorted order."""
+        self.load_index()
+        return sorted(self.index.keys())
+
+    def items(self):
+        """Iterate over the (key, value) entries, one shard at a time."""
+        for shard in self.shards:
+            with open(shard, 'r', encoding=self.codec) as f:
+                for line in f:
+                    key, value = json.loads(line)
+                    yield key, value
+
+    def close(self):
+        """Close any open shard files."""
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+    def __enter__(self):
+        """Use as a context manager, closing any open files on exit."""
+        return self
+
+    def __exit__(self, *args):
+        """Close any open shard files."""
+        self.close()
+
+
+class JsonObjectWriter(object):
+    """
+    Write a json object to a file one entry at a time.
+
+    The output is formatted as by open_and_write_file() except that the
+    entries are kept in the order in which they were written. It is written
+    to a temporary file which replaces the target file once closed.
+    """
+
+    def __init__(self, filename, codec='utf-8', indent=4, compression=None):
+        """
+        Initialise the JsonObjectWriter.
+
+        @param filename: the file to write
+        @param codec: the used encoding (defaults to "utf-8")
+        @param indent: number of spaces to indent each level by, or None for
+            compact output
+        @param compression: one of the COMPRESSIONS to compress the file with
+            (defaults to no compression)
+        """
+        self.file_name = filename
+        self.temp_name = '{0}.tmp'.format(filename)
+        self.file = open_text_file(self.temp_name, 'w', codec=codec,
+                                   compression=compression)
+        self.indent = indent
+        self.count = 0
+        self.file.write('{')
+
+    def write(self, key, value):
+        """
+        Write a single entry.
+
+        @param key: the key of the entry
+        @param value: a json serialisable value
+        """
+        self.file.write(format_json_entry(
+            key, value, self.indent, first=not self.count))
+        self.count += 1
+
+    def close_and_confirm(self):
+        """Close the file, moving it into place, and return a confirmation."""
+        self.file.write('}' if self.indent is None or not self.count
+                        else '\n}')
+        self.file.close()
+        replace_file(self.temp_name, self.file_name)
+        return 'Created {0}'.format(self.file_name)
+
+
+class JsonShardsWriter(object):
+    """
+    Write a json object as a set of json lines shards, one entry at a time.
+
+    Each shard (<base_name>.shard-NNNNN.jsonl) holds up to shard_size
+    entries, one [key, value] list per line, in the order written. The index
+    (<base_name>.index.jsonl) starts with a header line listing the shards,
+    followed by one [key, shard number, byte offset] line per entry. All
+    files are written to temporary files which replace the target files once
+    closed.
+    """
+
+    def __init__(self, base_name, shard_size=10000, codec='utf-8'):
+        """
+        Initialise the JsonShardsWriter.
+
+        @param base_name: base name (including path) of the output files
+        @param shard_size: maximum number of entries per shard
+        @param codec: the used encoding (defaults to "utf-8")
+        """
+        if not is_pos_int(shard_size):
+            raise MyError('shard_size must be a positive integer')
+        self.base_name = base_name
+        self.shard_size = shard_size
+        self.codec = codec
+        self.file_name = '{0}{1}'.format(base_name, SHARD_INDEX_SUFFIX)
+        self.index = open('{0}.entries.tmp'.format(self.file_name), 'w',
+                          encoding=codec)
+        self.shards = []
+        self.shard = None
+        self.count = 0
+
+    def shard_name(self, number):
+        """Return the filename of a shard."""
+        return '{0}.shard-{1:05d}.jsonl'.format(self.base_name, number)
+
+    def write(self, key, value):
+        """
+        Write a single entry, starting a new shard if needed.
+
+        @param key: the key of the entry
+        @param value: a json serialisable value
+        """
+        if self.count % self.shard_size == 0:
+            if self.shard:
+                self.shard.close()
+            self.shards.append(self.shard_name(len(self.shards)))
+            self.shard = open('{0}.tmp'.format(self.shards[-1]), 'wb')
+        self.index.write('{0}\n'.format(json.dumps(
+            [key, len(self.shards) - 1, self.shard.tell()],
+            ensure_ascii=False)))
+        line = json.dumps([key, value], ensure_ascii=False, sort_keys=True)
+        self.shard.write('{0}\n'.format(line).encode(self.codec))
+        self.count += 1
+
+    def close_and_confirm(self):
+        """Write the index, move all files into place and confirm."""
+        if self.shard:
+            self.shard.close()
+        self.index.close()
+        entries_name = self.index.name
+        temp_name = '{0}.tmp'.format(self.file_name)
+        with open(temp_name, 'w', encoding=self.codec) as f:
+            header = {'version': 1, 'count': self.count,
+                      'shards': [os.path.basename(s) for s in self.shards]}
+            f.write('{0}\n'.format(json.dumps(header, ensure_ascii=False)))
+            with open(entries_name, 'r', encoding=self.codec) as entries:
+                for line in entries:
+                    f.write(line)
+        os.remove(entries_name)
+        for shard in self.shards:
+            replace_file('{0}.tmp'.format(shard), shard)
+        replace_file(temp_name, self.file_name)
+        return 'Created {0}'.format(self.file_name)
+
+
+class PersistentCache(MutableMapping):
+    """
+    Dict like cache stored in an SQLite database, to be reused between runs.
+
+    Can be passed as the cache to e.g. helpers.category_exists(),
+    helpers.categories_exist() and listscraper.get_wikidata_info(). Values
+    must be json serialisable.
+
+    Several caches, each with its own namespace, may share the same file.
+    Entries older than the ttl are discarded when the database is first
+    accessed, so that anything found during a run remains available
+    throughout it.
+
+    Each change is committed immediately (the connection is in autocommit
+    mode) so that no write lock is held in between. Several processes may
+    therefore use the same file at once. Use update() and invalidate() to
+    store or invalidate many entries in a single transaction. The
+    connection is not pickled, a copy (e.g. in a worker process) instead
+    opens its own connection when first used and should be closed when no
+    longer needed.
+    """
+
+    def __init__(self, filename, namespace='default', ttl=None):
+        """
+        Initialise the PersistentCache.
+
+        @param filename: the SQLite database file, created if needed
+        @param namespace: the name under which to store the entries
+        @param ttl: number of seconds after which entries expire, or None
+            for entries never to expire
+        """
+        self.filename = filename
+        self.namespace = namespace
+        self.ttl = ttl
+        self._connection = None
+
+    @property
+    def connection(self):
+        """The database connection, opened (and expired) on first use."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.filename, timeout=60, isolation_level=None)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'namespace TEXT, key TEXT, value TEXT, stored REAL, '
+                'PRIMARY KEY (namespace, key))')
+            if self.ttl is not None:
+                self.expire(self.ttl)
+        return self._connection
+
+    def __getitem__(self, key):
+        """Return the value of key, raising KeyError if not found."""
+        row = self.connection.execute(
+            'SELECT value FROM cache WHERE namespace = ? AND key = ?',
+            (self.namespace, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        """Store a value under key."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+            (self.namespace, key, json.dumps(value, ensure_ascii=False),
+             time.time()))
+
+    def __delitem__(self, key):
+        """Invalidate a single entry, raising KeyError if not found."""
+        cursor = self.connection.execute(
+            'DELETE FROM cache WHERE namespace = ? AND key = ?',
+            (self.namespace, key))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def update(self, *args, **kwargs):
+        """Store several values, as dict.update(), in a single transaction."""
+        stored = time.time()
+        rows = [(self.namespace, key, json.dumps(value, ensure_ascii=False),
+                 stored)
+                for key, value in dict(*args, **kwargs).items()]
+        self._execute_many(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows)
+
+    def invalidate(self, keys):
+        """
+        Invalidate several entries in a single transaction.
+
+        Unlike del, keys which are not found are ignored.
+
+        @param keys: iterable of keys
+        @return: the number of invalidated entries
+        """
+        return self._execute_many(
+            'DELETE FROM cache WHERE namespace = ? AND key = ?',
+            [(self.namespace, key) for key in keys])
+
+    def _execute_many(self, sql, rows):
+        """
+        Execute a statement once per row, in a single transaction.
+
+        @param sql: the statement to execute
+        @param rows: list of parameter tuples
+        @return: the number of modified rows
+        """
+        if not rows:
+            return 0
+        connection = self.connection
+        connection.execute('BEGIN')
+        try:
+            cursor = connection.executemany(sql, rows)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return cursor.rowcount
+
+    def __contains__(self, key):
+        """Check whether there is an entry for key."""
+        return self.connection.execute(
+            'SELECT 1 FROM cache WHERE namespace = ? AND key = ?',
+            (self.namespace, key)).fetchone() is not None
+
+    def __iter__(self):
+        """Iterate over the keys."""
+        rows = self.connection.execute(
+            'SELECT key FROM cache WHERE namespace = ?',
+            (self.namespace, )).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        """Return the number of entries."""
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM cache WHERE namespace = ?',
+            (self.namespace, )).fetchone()[0]
+
+    def clear(self):
+        """Invalidate all entries."""
+        self.connection.execute(
+            'DELETE FROM cache WHERE namespace = ?', (self.namespace, ))
+
+    def expire(self, max_age):
+        """
+        Invalidate all entries older than max_age.
+
+        @param max_age: age in seconds
+        @return: the number of invalidated entries
+        """
+        cursor = self.connection.execute(
+            'DELETE FROM cache WHERE namespace = ? AND stored < ?',
+            (self.namespace, time.time() - max_age))
+        return cursor.rowcount
+
+    def close(self):
+        """Close the database connection."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getstate__(self):
+        """Return the state to pickle, excluding the connection."""
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def __enter__(self):
+        """Enter the runtime context."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the database connection."""
+        self.close()
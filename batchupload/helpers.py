@@ -3,8 +3,11 @@
 """Helper tools related to wiki specific formatting or restrictions."""
 from __future__ import unicode_literals
 from builtins import range  # ,dict
+from collections import OrderedDict
+import re
 from pywikibot.tools import deprecated
 import pywikibot.textlib
+import pywikibot.data.api
 import batchupload.common as common
 
 # limitations on namelength
@@ -15,6 +18,16 @@ MAXLENGTH = 128
 # black-lists
 bad_dates = ('n.d', 'odaterad')
 
+# max number of standardised dates to memoize
+DATE_MEMO_SIZE = 10000
+
+# max number of titles per query allowed by the API (for non-bots)
+TITLES_PER_QUERY = 50
+
+# cache key of existence checks following redirects, "|" is not allowed in
+# page titles so these cannot clash with the plain titles used otherwise
+REDIRECT_CACHE_KEY = '%s|redirect'
+
 
 def flip_name(name):
     """
@@ -108,15 +121,134 @@ def format_filename(descr, institution, idno, delimiter=None):
     return filename.replace(' ', '_')
 
 
+def format_filenames(descrs, institutions, idnos, delimiter=None):
+    """
+    Given columns of the three components of filenames return all of them.
+
+    Equivalent to calling format_filename() for each row, but each distinct
+    description, institution and idno is only cleaned once, which adds up
+    for large batches where e.g. the institution is the same for all files.
+
+    A single string can be given in place of a column, in which case it is
+    used for every row.
+
+    @param descrs: list of short descriptions of the file contents
+    @param institutions: list of institution names or abbreviations
+    @param idnos: list of unique identifiers
+    @param delimiter: the delimiter to use between the parts
+    @return: list of filenames (without file extension) and a dict of
+        collisions, where each filename used for more than one row (as it
+        was first generated) gives the indexes of all of those rows. See
+        normalise_filename().
+    """
+    delimiter = delimiter or ' - '
+    columns = [descrs, institutions, idnos]
+    lengths = set(len(column) for column in columns
+                  if not common.is_str(column))
+    if len(lengths) > 1:
+        raise common.MyError(
+            'The columns have different lengths: %s' % sorted(lengths))
+    num = lengths.pop() if lengths else 1
+    columns = [[column] * num if common.is_str(column) else column
+               for column in columns]
+
+    cleaned_descrs = dict()
+    cleaned = dict()  # institutions and idnos
+    filenames = []
+    first_use = dict()  # normalised filename: (filename, row)
+    collisions = dict()
+    for row, (descr, institution, idno) in enumerate(zip(*columns)):
+        if descr not in cleaned_descrs:
+            cleaned_descrs[descr] = desc_cleanup_routine(descr, delimiter)
+        for value in (institution, idno):
+            if value not in cleaned:
+                cleaned[value] = cleanString(value)
+        filename = delimiter.join((
+            cleaned_descrs[descr], cleaned[institution], cleaned[idno]
+        )).replace(' ', '_')
+        filenames.append(filename)
+
+        key = normalise_filename(filename)
+        if key in first_use:
+            first_filename, first_row = first_use[key]
+            collisions.setdefault(first_filename, [first_row]).append(row)
+        else:
+            first_use[key] = (filename, row)
+    return filenames, collisions
+
+
+def normalise_filename(filename):
+    """
+    Return a key under which filenames which would collide are identical.
+
+    Underscores and spaces are treated as the same and the comparison is
+    case insensitive.
+
+    @param filename: the filename (without file extension)
+    @return: str
+    """
+    return ' '.join(filename.replace('_', ' ').split()).lower()
+
+
+class StringCleaner(object):
+    """
+    Precompiled sequence of replacements to perform on strings.
+
+    Equivalent to calling str.replace() for each replacement in turn, but
+    skipping any replacement whose pattern is not present, which avoids
+    most of the work for the typical string containing few, if any, of the
+    patterns.
+
+    A single str.translate() table and regex for the longer patterns was
+    also considered, but both are slower on CPython for (the common case
+    of) non-ascii strings, see benchmarks/clean_string_benchmark.py.
+    """
+
+    def __init__(self, replacements):
+        """
+        Initialise a StringCleaner.
+
+        @param replacements: iterable of (old, new) string pairs, in the
+            order in which they should be performed
+        """
+        self.replacements = tuple(
+            (old, new) for old, new in replacements if old != new)
+
+    def __call__(self, text):
+        """
+        Perform the replacements on a string.
+
+        @param text: the string to clean
+        @return: str
+        """
+        for old, new in self.replacements:
+            if old in text:
+                text = text.replace(old, new)
+        return text
+
+
+# bad characters in filenames - extend as more are identified
+# Note that ":" is complicated as it has several different interpretations.
+# Current approach:
+# * replacing possessive case then
+# * sentence break then
+# * stand-alone colons
+bad_filename_chars = (
+    ('\\', '-'), ('/', '-'), ('|', '-'), ('#', '-'),
+    ('[', '('), (']', ')'), ('{', '('), ('}', ')'),
+    (':s', 's'), (': ', ', '),
+    ('e´', 'é'),
+    ('”', ' '), ('"', ' '), ('“', ' '),
+    ('\x8f', ' '),  # whitespace characters not handled by .split()
+    (':', '-'))
+filename_cleaner = StringCleaner(bad_filename_chars)
+
+
 def cleanString(text):
     """
     Remove characters which are forbidden/undesired in filenames.
 
-    Note that ":" is complicated as it has several different interpretations.
-    Current approach:
-    * replacing possessive case then
-    * sentence break then
-    * stand-alone colons
+    See bad_filename_chars for the replacements made.
 
     @todo: consider blacklisting ? and '
 
@@ -124,27 +256,10 @@ def cleanString(text):
     @type text: str
     @return: str
     """
-    # bad characters  - extend as more are identified
-    bad_char = {'\\': '-', '/': '-', '|': '-', '#': '-',
-                '[': '(', ']': ')', '{': '(', '}': ')',
-                ':s': 's', ': ': ', ',
-                'e´': 'é',
-                '”': ' ', '"': ' ', '“': ' '}
-
-    # whitespace characters not handled by .split()
-    unusual_whitespace = ['\x8f', ]
-    for w in unusual_whitespace:
-        bad_char[w] = ' '  # replace by normal space
-
     # replace all normal white space characters by space
     text = ' '.join(text.split())
 
-    for k, v in bad_char.items():
-        text = text.replace(k, v)
-
-    # replace any remaining colons
-    if ':' in text:
-        text = text.replace(':', '-')
+    text = filename_cleaner(text)
 
     # replace double space by single space
     text = text.replace('  ', ' ')
@@ -193,6 +308,9 @@ def shortenString(text):
     """
     Shorten strings longer than GOODLENGTH.
 
+    Any trailing bracket is first removed, after which the string is cut at
+    the last ".", failing that " - ", ";" or "," until it is short enough.
+
     @param text: the text to shorten
     @return string
     """
@@ -202,26 +320,41 @@ def shortenString(text):
     # is ok?
     if len(text) < GOODLENGTH:
         return text
-    # attempt fixing
-    # remove trailing brackets
-    if text.endswith(')'):
-        pos = text.rfind('(')
-        if pos > 0:
-            return shortenString(text[:pos].strip(badchar))
-    # split string at certain character
-    pos = text.rfind('.')
-    if pos < 0:
-        pos = text.rfind(' - ')
-        if pos < 0:
-            pos = text.rfind(';')
-            if pos < 0:
-                pos = text.rfind(',')
+
+    # the text is only ever shortened, so work on text[start:end] and search
+    # for each cut point from where the previous one was found. Any cut point
+    # which is missing will then remain so.
+    start = 0
+    end = len(text)
+    missing = set()
+    while end - start >= GOODLENGTH:
+        # attempt fixing
+        # remove trailing brackets
+        pos = -1
+        if text[end - 1] == ')':
+            pos = text.rfind('(', start, end)
+            if pos <= start:
+                pos = -1
+        # split string at certain character
+        for char in ('.', ' - ', ';', ','):
+            if pos >= 0:
+                break
+            if char not in missing:
+                pos = text.rfind(char, start, end)
                 if pos < 0:
-                    # try something else
-                    if len(text) > MAXLENGTH:
-                        text = '%s...' % text[:MAXLENGTH - 3]
-                    return text
-    return shortenString(text[:pos].strip(badchar))
+                    missing.add(char)
+        if pos < 0:
+            # try something else
+            if end - start > MAXLENGTH:
+                return '%s...' % text[start:start + MAXLENGTH - 3]
+            break
+        # equivalent to text = text[:pos].strip(badchar)
+        end = pos
+        while end > start and text[end - 1] in badchar:
+            end -= 1
+        while start < end and text[start] in badchar:
+            start += 1
+    return text[start:end]
 
 
 def desc_cleanup_routine(text, delimiter=None, delimiter_replacement=None):
@@ -248,6 +381,133 @@ def desc_cleanup_routine(text, delimiter=None, delimiter_replacement=None):
 
 
 # methods for handling dates
+class AffixRules(object):
+    """
+    Ordered prefix (or suffix) rules compiled into a single regex.
+
+    The alternatives of a regex are tried in order, so the first matching
+    rule wins just as when testing each rule in turn with str.startswith()
+    (or str.endswith()). Suffixes are matched against the reversed string.
+    """
+
+    def __init__(self, rules, suffix=False):
+        """
+        Initialise an AffixRules.
+
+        @param rules: iterable of (affix, value) pairs in order of precedence
+        @param suffix: whether the affixes are suffixes rather than prefixes
+        """
+        self.rules = OrderedDict(rules)
+        self.suffix = suffix
+        affixes = (k[::-1] if suffix else k for k in self.rules)
+        self.pattern = re.compile(
+            '|'.join(re.escape(affix) for affix in affixes))
+
+    def match(self, text):
+        """
+        Find the first rule matching a string.
+
+        @param text: the (lower case) string to match
+        @return: (affix, value) tuple or None
+        """
+        if self.suffix:
+            text = text[::-1]
+        hit = self.pattern.match(text)
+        if not hit:
+            return None
+        affix = hit.group()
+        if self.suffix:
+            affix = affix[::-1]
+        return affix, self.rules[affix]
+
+
+class LRUMemo(object):
+    """
+    Memoize a single argument function, keeping only the latest results.
+
+    A minimal stand-in for functools.lru_cache, which is not available on
+    Python 2.
+    """
+
+    def __init__(self, function, maxsize):
+        """
+        Initialise an LRUMemo.
+
+        @param function: the function to memoize
+        @param maxsize: the maximum number of results to keep
+        """
+        self.function = function
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+
+    def __call__(self, arg):
+        """Return the (possibly memoized) result of the function for arg."""
+        try:
+            value = self.cache.pop(arg)
+        except KeyError:
+            value = self.function(arg)
+            if len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+        self.cache[arg] = value
+        return value
+
+    def clear(self):
+        """Forget all memoized results."""
+        self.cache.clear()
+
+
+# prefixes and suffixes of dates in order of precedence
+date_endings = (
+    ('?', '?'),
+    ('(?)', '?'),
+    ('c', 'ca'),
+    ('ca', 'ca'),
+    ('cirka', 'ca'),
+    ('andra hälft', '2half'),
+    ('första hälft', '1half'),
+    ('början', 'early'),
+    ('slut', 'end'),
+    ('slutet', 'end'),
+    ('mitt', 'mid'),
+    ('första fjärdedel', '1quarter'),
+    ('andra fjärdedel', '2quarter'),
+    ('tredje fjärdedel', '3quarter'),
+    ('fjärde fjärdedel', '4quarter'),
+    ('sista fjärdedel', '4quarter'),
+    ('före', '<'),
+    ('efter', '>'),
+    ('-', '>'))
+date_starts = (
+    ('tidigt', 'early'),
+    ('br av', 'early'),
+    ('början av', 'early'),
+    ('tid ', 'early'),
+    ('sent', 'late'),
+    ('sl av', 'late'),
+    ('slutet av', 'end'),
+    ('andra hälften av', '2half'),
+    ('första hälften av', '1half'),
+    ('mitten av', 'mid'),
+    ('första fjärdedel av', '1quarter'),
+    ('andra fjärdedel av', '2quarter'),
+    ('tredje fjärdedel av', '3quarter'),
+    ('fjärde fjärdedel av', '4quarter'),
+    ('sista fjärdedel av', '4quarter'),
+    ('ca', 'ca'),
+    ('våren', 'spring'),
+    ('sommaren', 'summer'),
+    ('hösten', 'fall'),
+    ('vintern', 'winter'),
+    ('sekelskiftet', 'turn of the century'),
+    ('före', '<'),
+    ('efter', '>'),
+    ('-', '<'))
+date_tal_endings = ('-talets', '-tal', '-talet', ' talets')
+date_modality = ('troligen', 'sannolikt', 'trol.')
+date_start_rules = AffixRules(date_starts)
+date_ending_rules = AffixRules(date_endings, suffix=True)
+
+
 def std_date_range(date, range_delimiter=' - '):
     """
     Given a date, which could be a range, return a standardised Commons date.
@@ -291,84 +551,57 @@ def stdDate(date):
     Note that care must be taken so that ranges are separated prior to
     this since YYYY-MM and YYYY-YY are otherwise indistinguisable.
 
+    The results are memoized (see date_memo) since the same few dates tend
+    to be repeated throughout a batch.
+
+    @param date: the string to be parsed as a date
+    @return string|None
+    """
+    return date_memo(date.strip('.  '))
+
+
+def _std_date(date):
+    """
+    Standardise a single date which has already been stripped.
+
+    Main logic of stdDate(), which should be called instead so that the
+    result is memoized.
+
     @param date: the string to be parsed as a date
     @return string|None
     """
     # No date
-    date = date.strip('.  ')
-    if len(date) == 0 or date.lower() in bad_dates:
+    lower = date.lower()
+    if len(date) == 0 or lower in bad_dates:
         return ''  # this is equivalent to '{{other date|unknown}}'
-    date = date.replace(' - ', '-')
+    if ' - ' in date:
+        date = date.replace(' - ', '-')
+        lower = date.lower()
 
     # A single date
-    endings = {
-        '?': '?',
-        '(?)': '?',
-        'c': 'ca',
-        'ca': 'ca',
-        'cirka': 'ca',
-        'andra hälft': '2half',
-        'första hälft': '1half',
-        'början': 'early',
-        'slut': 'end',
-        'slutet': 'end',
-        'mitt': 'mid',
-        'första fjärdedel': '1quarter',
-        'andra fjärdedel': '2quarter',
-        'tredje fjärdedel': '3quarter',
-        'fjärde fjärdedel': '4quarter',
-        'sista fjärdedel': '4quarter',
-        'före': '<',
-        'efter': '>',
-        '-': '>'}
-    starts = {
-        'tidigt': 'early',
-        'br av': 'early',
-        'början av': 'early',
-        'tid ': 'early',
-        'sent': 'late',
-        'sl av': 'late',
-        'slutet av': 'end',
-        'andra hälften av': '2half',
-        'första hälften av': '1half',
-        'mitten av': 'mid',
-        'första fjärdedel av': '1quarter',
-        'andra fjärdedel av': '2quarter',
-        'tredje fjärdedel av': '3quarter',
-        'fjärde fjärdedel av': '4quarter',
-        'sista fjärdedel av': '4quarter',
-        'ca': 'ca',
-        'våren': 'spring',
-        'sommaren': 'summer',
-        'hösten': 'fall',
-        'vintern': 'winter',
-        'sekelskiftet': 'turn of the century',
-        'före': '<',
-        'efter': '>',
-        '-': '<'}
-    tal_endings = ('-talets', '-tal', '-talet', ' talets')
-    modality = ('troligen', 'sannolikt', 'trol.')
-    for k, v in starts.items():
-        if date.lower().startswith(k):
-            again = stdDate(date[len(k):])
-            if again:
-                return '{{other date|%s|%s}}' % (v, again)
-            else:
-                return None
-    for k, v in endings.items():
-        if date.lower().endswith(k):
-            again = stdDate(date[:-len(k)])
-            if again:
-                return '{{other date|%s|%s}}' % (v, again)
-            else:
-                return None
-    for k in modality:
+    match = date_start_rules.match(lower)
+    if match:
+        k, v = match
+        again = stdDate(date[len(k):])
+        if again:
+            return '{{other date|%s|%s}}' % (v, again)
+        else:
+            return None
+    match = date_ending_rules.match(lower)
+    if match:
+        k, v = match
+        again = stdDate(date[:-len(k)])
+        if again:
+            return '{{other date|%s|%s}}' % (v, again)
+        else:
+            return None
+    for k in date_modality:
         found = False
-        if date.lower().endswith(k):
-            date = date[:-len(k)].strip('.,  ')
+        if lower.endswith(k):
+            date = date[:-len(k)].strip('.,  ')
             found = True
-        elif date.lower().startswith(k):
-            date = date[len(k):].strip('.,  ')
+        elif lower.startswith(k):
+            date = date[len(k):].strip('.,  ')
             found = True
         if found:
             again = stdDate(date)
@@ -376,9 +609,9 @@ def stdDate(date):
                 return '%s {{Probably}}' % again
             else:
                 return None
-    for k in tal_endings:
-        if date.lower().endswith(k):
-            date = date[:-len(k)].strip('.  ')
+    for k in date_tal_endings:
+        if lower.endswith(k):
+            date = date[:-len(k)].strip('.  ')
             if date[-2:] == '00':
                 v = 'century'
                 if len(date) == 4:
@@ -397,6 +630,9 @@ def stdDate(date):
     return isoDate(date)
 
 
+date_memo = LRUMemo(_std_date, DATE_MEMO_SIZE)
+
+
 def isoDate(date):
     """Given a string this returns an iso date (if possible)."""
     item = date[:len('YYYY-MM-DD')].split('-')
@@ -429,6 +665,61 @@ def bolden(s):
     return "'''{}'''".format(s)
 
 
+class BlockTemplateRenderer(object):
+    """
+    Renderer of block adjusted templates with a fixed set of parameters.
+
+    The padding and the format of each row are determined once, making this
+    preferable to output_block_template() when rendering the same template
+    for many entries, e.g. in a make_info_template() implementation.
+    """
+
+    def __init__(self, name, keys, padding=None):
+        """
+        Initialise a BlockTemplateRenderer.
+
+        @param name: The template name (without "Template:"-prefix)
+        @param keys: The parameter names, in the order they should be output.
+            Any repeated name is only output once, at its first position.
+        @param padding: The number of characters from | to = on each row. Set
+            to 0, to disable or to None to automatically determine minimum
+            padding.
+        @type padding: int or None
+        """
+        self.name = name
+        self.keys = tuple(OrderedDict.fromkeys(keys))
+        if padding is None:
+            if not self.keys:
+                padding = 0
+            else:
+                padding = max(len(key) for key in self.keys) + 2
+        self.padding = padding
+        self.head = '{{{{{:s}\n'.format(name)
+        self.rows = tuple(
+            (key, '| {param} = {{}}\n'.format(
+                param=key.ljust(padding - 2).replace(
+                    '{', '{{').replace('}', '}}')))
+            for key in self.keys)
+
+    def render(self, data):
+        """
+        Render the template for one entry.
+
+        @param data: A dict where each key is a parameter name. Entries where
+            the value is None, or which are not among the keys of the
+            renderer, are omitted. Entries where the value is an empty string
+            are outputted.
+        @return basestring
+        """
+        parts = [self.head]
+        for key, row in self.rows:
+            value = data.get(key)
+            if value is not None:
+                parts.append(row.format(value))
+        parts.append('}}')
+        return ''.join(parts)
+
+
 def output_block_template(name, data, padding=None):
     """
     Given a dict output a block adjusted template using keys as parameters.
@@ -438,6 +729,9 @@ def output_block_template(name, data, padding=None):
 
     Omitted entries are still considered when determining automatic padding.
 
+    When outputting the same template for many entries, use a
+    BlockTemplateRenderer instead.
+
     @param name: The template name (without "Template:"-prefix)
     @param data: A dict where each key is a parameter name. Entries where the
         value is None are omitted, entries where the value is an empty string
@@ -447,20 +741,7 @@ def output_block_template(name, data, padding=None):
     @type adjust: int or None
     @return basestring
     """
-    if padding is None:
-        if not data:
-            padding = 0
-        else:
-            padding = max(len(key) for key in data.keys()) + 2
-
-    template = '{{{{{:s}\n'.format(name)
-    for k, v in data.items():
-        if v is not None:
-            template += '| {param} = {val}\n'.format(
-                param=k.ljust(padding - 2), val=v)
-    template += '}}'
-
-    return template
+    return BlockTemplateRenderer(name, data.keys(), padding).render(data)
 
 
 @deprecated('common.convert_from_commandline')
@@ -479,11 +760,12 @@ def category_exists(cat, site=None, cache=None):
     Ensure a given category really exists on Commons.
 
     If a cache is provided this is used to reduce the number
-    of lookups.
+    of lookups. Redirects are not followed, see categories_exist() for
+    that.
 
     @param cat: category name (with or without "Category" prefix)
     @param site: pywikibot.Site object for Wikidata
-    @param cache: dict to use for caching
+    @param cache: dict, or common.PersistentCache, to use for caching
     @return: bool
     """
     commons = site or pywikibot.Site('commons', 'commons')
@@ -491,8 +773,7 @@ def category_exists(cat, site=None, cache=None):
     if cache is None:
         cache = {}
 
-    if not cat.lower().startswith('category:'):
-        cat = 'Category:{0}'.format(cat)
+    cat = category_title(cat)
 
     if cat in cache:
         return cache[cat]
@@ -501,3 +782,106 @@ def category_exists(cat, site=None, cache=None):
     cache[cat] = exists
 
     return cache[cat]
+
+
+def categories_exist(cats, site=None, cache=None, follow_redirects=True):
+    """
+    Ensure a number of categories really exist on Commons.
+
+    The bulk equivalent of category_exists(). Any categories not found in the
+    cache are looked up many at a time using pages_exist() and the results
+    are added to the cache.
+
+    By default any (hard) redirects are followed. Since category_exists()
+    does not follow redirects these results are cached under a different
+    key (see REDIRECT_CACHE_KEY) so that the two can share a cache.
+
+    @param cats: iterable of category names (with or without "Category"
+        prefix)
+    @param site: pywikibot.Site object for Commons
+    @param cache: dict, or common.PersistentCache, to use for caching
+    @param follow_redirects: whether to report on the existence of the
+        target of a redirect instead of on the redirect itself
+    @return: dict of {category name (as provided): bool}
+    """
+    # cannot use cache = cache or {} as this also discards an empty cache
+    if cache is None:
+        cache = {}
+
+    titles = OrderedDict((cat, category_title(cat)) for cat in cats)
+    keys = OrderedDict(
+        (title, REDIRECT_CACHE_KEY % title if follow_redirects else title)
+        for title in titles.values())
+    uncached = [title for title, key in keys.items() if key not in cache]
+    if uncached:
+        exists = pages_exist(
+            uncached, site=site, follow_redirects=follow_redirects)
+        cache.update((keys[title], value) for title, value in exists.items())
+
+    return dict((cat, cache[keys[title]]) for cat, title in titles.items())
+
+
+def category_title(cat):
+    """
+    Return the normalised category name with a "Category" prefix.
+
+    As on the wiki, underscores are treated as spaces, surrounding and
+    repeated whitespace is dropped and the first letter is capitalised, so
+    that any spelling of a category results in the same title.
+
+    @param cat: category name (with or without "Category" prefix)
+    @return: str
+    """
+    prefix, sep, name = cat.partition(':')
+    if not (sep and prefix.replace('_', ' ').strip().lower() == 'category'):
+        name = cat
+    name = ' '.join(name.replace('_', ' ').split())
+    return 'Category:{0}{1}'.format(name[:1].upper(), name[1:])
+
+
+def pages_exist(titles, site=None, follow_redirects=False,
+                batch_size=TITLES_PER_QUERY):
+    """
+    Check whether a number of pages exist, querying many titles at a time.
+
+    Any normalisation of the titles done by the API (e.g. "_" to " ") is
+    taken into account so that the results are keyed by the provided titles.
+
+    @param titles: iterable of page titles (including any namespace prefix)
+    @param site: pywikibot.Site object (defaults to Commons)
+    @param follow_redirects: whether to report on the existence of the target
+        of a redirect instead of on the redirect itself
+    @param batch_size: the number of titles to look up per query
+    @return: dict of {title: bool}
+    """
+    site = site or pywikibot.Site('commons', 'commons')
+    titles = list(OrderedDict.fromkeys(titles))  # de-duplicate, keep order
+
+    exists = {}
+    for i in range(0, len(titles), batch_size):
+        batch = titles[i:i + batch_size]
+        parameters = {'action': 'query', 'titles': batch}
+        if follow_redirects:
+            parameters['redirects'] = True
+        data = pywikibot.data.api.Request(
+            site=site, parameters=parameters).submit()
+        query = data.get('query', {})
+
+        # map each title to the one used in the response
+        renamed = {}
+        for key in ('normalized', 'redirects'):
+            for entry in query.get(key, []):
+                renamed[entry['from']] = entry['to']
+        found = set(
+            page['title'] for page in query.get('pages', {}).values()
+            if 'missing' not in page and 'invalid' not in page)
+
+        for title in batch:
+            target = title
+            seen = set()
+            while target in renamed and target not in seen:
+                seen.add(target)
+                target = renamed[target]
+            exists[title] = target in found
+
+    return exists
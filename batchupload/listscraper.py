@@ -75,6 +75,7 @@ class MappingList(object):
             self.parameters = OrderedDict([(k, k) for k in parameters])
         else:
             self.parameters = parameters
+        self._row_renderer = None
 
         # create out_paths if they don't exist
         common.create_dir(self.mapping_dir)
@@ -489,7 +490,25 @@ class MappingList(object):
             elif data_val is None:
                 data_val = ''
             template_data[template_key] = data_val
-        return helpers.output_block_template(template, template_data, 0)
+        return self.get_row_renderer(template).render(template_data)
+
+    def get_row_renderer(self, template):
+        """
+        Return a renderer for list rows using the given template.
+
+        The renderer is reused for as long as the template and parameters
+        remain the same.
+
+        @param template: the row template to use
+        @return: helpers.BlockTemplateRenderer
+        """
+        # several data keys may map to the same template parameter
+        keys = tuple(OrderedDict.fromkeys(self.parameters.values()))
+        renderer = self._row_renderer
+        if not renderer or renderer.name != template or renderer.keys != keys:
+            renderer = helpers.BlockTemplateRenderer(template, keys, 0)
+            self._row_renderer = renderer
+        return renderer
 
     def consume_entries(self, units, key_val, require=None, only=None):
         """
@@ -565,7 +584,7 @@ def get_wikidata_info(qid, site=None, cache=None):
 
     @param qid: Qid for the Wikidata item
     @param site: pywikibot.Site object for Wikidata
-    @param cache: dict to use for caching
+    @param cache: dict, or common.PersistentCache, to use for caching
     @return: bool
     """
     wikidata = site or pywikibot.Site('wikidata', 'wikidata')
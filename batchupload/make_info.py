@@ -2,11 +2,18 @@
 # -*- coding: utf-8  -*-
 """Abstract class for producing mapping tables and file description pages."""
 from __future__ import unicode_literals
-from builtins import dict, object
+from builtins import dict, object, open
 import batchupload.common as common
+import batchupload.helpers as helpers
+import copy
+import json
+import math
+import multiprocessing
+import multiprocessing.util
 import os
 import pywikibot
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from future.utils import with_metaclass
 
 
@@ -54,6 +61,110 @@ def make_info_page(data, preview=False):
     return text.strip()
 
 
+COLLISION_POLICIES = ('fail', 'report', 'disambiguate')
+STREAM_BATCH = 1000  # number of items processed at a time in streaming mode
+CACHE_FILE = 'lookup_cache.sqlite'  # see MakeBaseInfo.open_cache()
+CACHE_TTL = 7 * 24 * 60 * 60  # seconds after which cached lookups expire
+_worker_info = None  # the MakeBaseInfo instance used by a worker process
+
+
+def _init_worker(info):
+    """
+    Store the MakeBaseInfo instance to be used by a worker process.
+
+    Any persistent caches it opens are closed when the worker exits.
+    """
+    global _worker_info
+    _worker_info = info
+    multiprocessing.util.Finalize(None, info.close_caches, exitpriority=10)
+
+
+def _make_info_chunk(items):
+    """Process a chunk of items in a worker process."""
+    return [_worker_info.make_info_entry(item) for item in items]
+
+
+def json_output_name(base_name, compression=None):
+    """
+    Return the filename of the (non-sharded) json output.
+
+    @param base_name: base name used for the output
+    @param compression: one of common.COMPRESSIONS, or None
+    @return: str
+    """
+    return '%s.json%s' % (
+        base_name, common.COMPRESSION_EXTENSIONS.get(compression, ''))
+
+
+class FilenameIndex(object):
+    """
+    Index of generated filenames, used to detect any collisions.
+
+    Filenames are compared using helpers.normalise_filename().
+    """
+
+    def __init__(self, policy='report', disambiguate=None):
+        """
+        Initialise the FilenameIndex.
+
+        @param policy: one of COLLISION_POLICIES
+        @param disambiguate: function producing a new filename given the
+            colliding filename and the key (idno) of the file
+        """
+        if policy not in COLLISION_POLICIES:
+            raise common.MyError(
+                'Unknown filename collision policy: %s' % policy)
+        self.policy = policy
+        self.disambiguate = disambiguate
+        self.index = dict()  # normalised filename: (original, filename)
+        self.collisions = dict()
+
+    def add(self, original_filename, entry, idno=None):
+        """
+        Add the filename of an entry, disambiguating it if needed and allowed.
+
+        @param original_filename: the original filename of the media file
+        @param entry: the make_info entry of the media file
+        @param idno: the key of the item in the data, used when
+            disambiguating (defaults to the original filename)
+        @return: whether the filename of the entry was changed
+        """
+        key = helpers.normalise_filename(entry['filename'])
+        if key not in self.index or \
+                self.index[key][0] == original_filename:
+            self.index[key] = (original_filename, entry['filename'])
+            return False
+
+        first_original, first_filename = self.index[key]
+        self.collisions.setdefault(
+            first_filename, [first_original]).append(original_filename)
+        if self.policy == 'disambiguate':
+            if idno is None:
+                idno = original_filename
+            filename = self.disambiguate(entry['filename'], idno)
+            new_filename = filename
+            counter = 2
+            while helpers.normalise_filename(new_filename) in self.index:
+                new_filename = '%s_%d' % (filename, counter)
+                counter += 1
+            entry['filename'] = new_filename
+            self.index[helpers.normalise_filename(new_filename)] = (
+                original_filename, new_filename)
+            return True
+        return False
+
+    def report(self):
+        """Raise (if the policy is "fail") or output any collisions."""
+        if not self.collisions:
+            return
+        message = 'Filenames used by several files:\n%s' % '\n'.join(
+            '%s: %s' % (filename, ', '.join(originals))
+            for filename, originals in sorted(self.collisions.items()))
+        if self.policy == 'fail':
+            raise common.MyError(message)
+        pywikibot.warning(message)
+
+
 class MakeBaseInfo(with_metaclass(ABCMeta, object)):
     """Abstract class for generating descriptions and filenames for a batch."""
 
@@ -66,7 +177,10 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         """
         self.data = dict()  # the processed metadata
         self.mappings = dict()  # any loaded mappings
+        self.fingerprints = dict()  # fingerprints of the processed data
         self.cwd_path = ''  # path to directory in which to work
+        self.caches = dict()  # any opened persistent caches, by namespace
+        self.refresh_caches = False  # if opened caches should be cleared
         self.base_meta_cat = base_meta_cat
         self.batch_cat = self.make_maintenance_cat(batch_label)
 
@@ -77,7 +191,8 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
 
         The provided data can be in any format and include more than one file.
         The output format can likewise be anything which is accepted by
-        process_data().
+        process_data(), or by iter_process_data() in streaming mode where it
+        may be a generator of raw records.
 
         @param in_file: the path to the metadata file or list of such paths
         """
@@ -96,6 +211,34 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         # improve docstring
         pass
 
+    def open_cache(self, namespace, ttl=CACHE_TTL):
+        """
+        Open a persistent cache of lookups, shared between runs.
+
+        The cache is stored in CACHE_FILE in the batch directory and can be
+        passed as the cache to e.g. helpers.categories_exist() or
+        listscraper.get_wikidata_info(), typically in load_mappings(). Any
+        cache opened while refresh_caches is set is first cleared.
+
+        @param namespace: name of the cache, e.g. "categories"
+        @param ttl: number of seconds after which entries expire, or None
+            for entries never to expire
+        @return: common.PersistentCache
+        """
+        if namespace not in self.caches:
+            cache = common.PersistentCache(
+                os.path.join(self.cwd_path, CACHE_FILE), namespace, ttl=ttl)
+            if self.refresh_caches:
+                cache.clear()
+            self.caches[namespace] = cache
+        return self.caches[namespace]
+
+    def close_caches(self):
+        """Close any opened persistent caches."""
+        for cache in self.caches.values():
+            cache.close()
+        self.caches = dict()
+
     @abstractmethod
     def process_data(self, raw_data):
         """
@@ -107,13 +250,29 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         """
         pass
 
+    def iter_process_data(self, raw_data):
+        """
+        Process the output of load_data one item at a time.
+
+        Used in streaming mode. Defaults to running process_data() and then
+        yielding the items in self.data. Override this, and let load_data()
+        yield the raw records, to never hold all of the data in memory.
+
+        @param raw_data: output from load_data()
+        @return: generator of (key, item) tuples
+        """
+        self.process_data(raw_data)
+        for key, item in self.data.items():
+            yield key, item
+
     @abstractmethod
     def make_info_template(self, item):
         """
         Make a filled in Information (or similar) template for a single file.
 
         It is recommended to make use of the helpers.output_block_template() to
-        produce the final result.
+        produce the final result, or of a helpers.BlockTemplateRenderer
+        (created once) if the template parameters are the same for all files.
 
         @param item: the metadata for the media file in question
         @return: str
@@ -138,6 +297,10 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         """
         Produce categories related to the media file contents.
 
+        To validate the categories use helpers.categories_exist(), with a
+        shared cache, rather than checking them one at a time, e.g. by
+        looking up all candidate categories of the batch in load_mappings().
+
         @param item: the metadata for the media file in question
         @return: list of categories (without "Category:" prefix)
         """
@@ -176,7 +339,106 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         """
         return '%s: %s' % (self.base_meta_cat, cat)
 
-    def make_info(self):
+    def make_info_entry(self, item):
+        """
+        Make the processed info related to a single media file.
+
+        @param item: the metadata for the media file in question
+        @return: tuple of the original filename and a dict with the keys
+            {info, filename, cats, meta_cats}
+        """
+        original_filename = self.get_original_filename(item)
+        info = self.make_info_template(item)
+        filename = self.generate_filename(item)
+        cats = self.generate_content_cats(item)
+        meta_cats = self.generate_meta_cats(item, cats)
+        return original_filename, {
+            'info': info, 'filename': filename,
+            'cats': cats, 'meta_cats': meta_cats}
+
+    def fingerprint(self, item):
+        """
+        Produce a fingerprint of the metadata for a single media file.
+
+        Used to determine whether the item has changed since a previous run.
+        Override this if the item contains values which should be ignored or
+        which cannot be represented as json. An item which cannot be
+        fingerprinted is always treated as changed.
+
+        @param item: the metadata for the media file in question
+        @return: str
+        """
+        return common.json_hash(item)
+
+    def mappings_fingerprint(self):
+        """
+        Produce a fingerprint of the loaded mappings and batch settings.
+
+        Any change to this invalidates the fingerprint of every item. Override
+        this to only include the mappings which affect the output. The base
+        and batch maintenance categories are included as these are typically
+        output by generate_meta_cats().
+
+        @return: str
+        """
+        return common.json_hash(
+            [self.mappings, self.base_meta_cat, self.batch_cat])
+
+    def item_fingerprint(self, item, mappings_hash):
+        """
+        Produce the fingerprint of an item combined with that of the mappings.
+
+        @param item: the metadata for the media file in question
+        @param mappings_hash: the output of mappings_fingerprint(), or None
+        @return: str, or None if either could not be fingerprinted
+        """
+        if mappings_hash is None:
+            return None
+        try:
+            return common.json_hash([self.fingerprint(item), mappings_hash])
+        except (TypeError, ValueError):
+            return None
+
+    def disambiguate_filename(self, filename, idno):
+        """
+        Produce a new filename for a file whose filename is already in use.
+
+        Defaults to suffixing the filename with the idno.
+
+        @param filename: the generated filename (without file extension)
+        @param idno: the key of the item in the data
+        @return: str
+        """
+        suffix = helpers.cleanString('%s' % idno).replace(' ', '_')
+        return '%s_(%s)' % (filename, suffix)
+
+    def check_filename_collisions(self, out_data, policy='report',
+                                  idnos=None):
+        """
+        Find any generated filenames which are used by more than one file.
+
+        Filenames are compared using helpers.normalise_filename(). Depending
+        on the policy any collisions are either raised as an error, reported
+        as a warning or reported and resolved by renaming all but the first
+        of the colliding files using disambiguate_filename().
+
+        @param out_data: the output of make_info
+        @param policy: one of COLLISION_POLICIES
+        @param idnos: dict of the keys of the items in the data, by original
+            filename, passed to disambiguate_filename() (defaults to the
+            original filenames)
+        @return: dict of colliding filenames (as first used) and the original
+            filenames of the files using them
+        """
+        idnos = idnos or dict()
+        index = FilenameIndex(policy, self.disambiguate_filename)
+        for original_filename, entry in out_data.items():
+            index.add(original_filename, entry, idnos.get(original_filename))
+        index.report()
+        return index.collisions
+
+    def make_info(self, processes=None, chunk_size=None, previous=None,
+                  collisions='report', fingerprint=False):
         """
         Make an object containing the processed info related to a media file.
 
@@ -187,30 +449,343 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         cats: a list of content categories (without "Category" prefix)
         meta_cats: a list of meta categories (without "Category" prefix)
 
+        If more than one process is requested the items are split into
+        consecutive chunks which are processed by a pool of worker processes.
+        Each worker receives a copy of this object (including the mappings,
+        but not the data) once, so it and its mappings must be picklable.
+        The results are merged in the original order of self.data, making
+        the output identical to that of a serial run.
+
+        If the output and fingerprints of a previous run are provided then
+        only items whose fingerprint (see item_fingerprint()) has changed are
+        processed, the previous output being reused for the rest. The
+        fingerprints are only calculated, and stored in self.fingerprints,
+        if a previous run is provided or they are requested.
+
+        @param processes: number of worker processes to use (defaults to
+            processing all items in the current process)
+        @param chunk_size: number of items sent to a worker at a time
+            (defaults to splitting the items into four chunks per process)
+        @param previous: tuple of the output (or JsonShards) and the
+            fingerprints of a previous run (optional)
+        @param collisions: how to handle generated filenames used by more
+            than one file, see check_filename_collisions()
+        @param fingerprint: whether to store the fingerprints even if no
+            previous run is provided
         @return dict:
         """
-        out_data = dict()
-        for k, v in self.data.items():
-            original_filename = self.get_original_filename(v)
-            info = self.make_info_template(v)
-            filename = self.generate_filename(v)
-            cats = self.generate_content_cats(v)
-            meta_cats = self.generate_meta_cats(v, cats)
-            out_data[original_filename] = {
-                'info': info, 'filename': filename,
-                'cats': cats, 'meta_cats': meta_cats}
+        fingerprint = fingerprint or bool(previous)
+        entries, reused = self.make_info_entries(
+            self.data.items(), processes, chunk_size, previous,
+            self._mappings_hash() if fingerprint else None)
+        if previous:
+            pywikibot.output('Reused %d and processed %d of %d entries' % (
+                reused, len(entries) - reused, len(entries)))
+
+        out_data = dict(entry for key, item_hash, entry in entries)
+        idnos = dict((entry[0], key) for key, item_hash, entry in entries)
+        renamed = set()
+        for originals in self.check_filename_collisions(
+                out_data, policy=collisions, idnos=idnos).values():
+            if collisions == 'disambiguate':
+                renamed.update(originals[1:])
+
+        self.fingerprints = dict()
+        if fingerprint:
+            for key, item_hash, entry in entries:
+                # reprocess renamed entries in case the collision is gone
+                if entry[0] in renamed:
+                    item_hash = None
+                self.fingerprints[key] = {
+                    'fingerprint': item_hash, 'original_filename': entry[0]}
         return out_data
 
-    def run(self, in_file, base_name, update_mappings):
+    def _mappings_hash(self):
+        """
+        Run mappings_fingerprint(), warning if it fails.
+
+        @return: str, or None if the mappings could not be fingerprinted
+        """
+        try:
+            return self.mappings_fingerprint()
+        except (TypeError, ValueError):
+            pywikibot.warning(
+                'The mappings could not be fingerprinted, so all entries '
+                'are treated as changed')
+            return None
+
+    def make_info_entries(self, items, processes=None, chunk_size=None,
+                          previous=None, mappings_hash=None, pool=None):
+        """
+        Make the entries for the given items, reusing any unchanged entries.
+
+        @param items: iterable of (key, item) tuples
+        @param processes: number of worker processes to use
+        @param chunk_size: number of items sent to a worker at a time
+        @param previous: tuple of the output (or JsonShards) and the
+            fingerprints of a previous run (optional)
+        @param mappings_hash: the fingerprint of the mappings, the items are
+            only fingerprinted if this is provided
+        @param pool: pool of worker processes to use, see worker_pool()
+            (defaults to creating one if needed)
+        @return: list of (key, fingerprint, (original filename, entry))
+            tuples, in the same order as items, and the number of reused
+            entries
+        """
+        previous_data, previous_fingerprints = previous or ({}, {})
+        keys = []
+        hashes = []
+        entries = []
+        todo = []  # the items which must be processed
+        positions = []  # ...and their positions
+        for key, item in items:
+            item_hash = self.item_fingerprint(item, mappings_hash)
+            old = previous_fingerprints.get(key)
+            entry = None
+            if item_hash and old and old['fingerprint'] == item_hash:
+                original_filename = old['original_filename']
+                if original_filename in previous_data:
+                    entry = (original_filename,
+                             previous_data[original_filename])
+            if entry is None:
+                todo.append(item)
+                positions.append(len(entries))
+            keys.append(key)
+            hashes.append(item_hash)
+            entries.append(entry)
+
+        processed = self.process_items(todo, processes, chunk_size, pool)
+        for i, entry in zip(positions, processed):
+            entries[i] = entry
+        return (list(zip(keys, hashes, entries)),
+                len(entries) - len(todo))
+
+    def process_items(self, items, processes=None, chunk_size=None,
+                      pool=None):
+        """
+        Run make_info_entry() for each item, possibly using worker processes.
+
+        @param items: list of items to process
+        @param processes: number of worker processes to use
+        @param chunk_size: number of items sent to a worker at a time
+        @param pool: pool of worker processes to use, see worker_pool()
+            (defaults to creating one if needed)
+        @return: list of (original filename, entry) tuples, in the same
+            order as items
+        """
+        if not processes or processes < 2 or len(items) < 2:
+            return [self.make_info_entry(item) for item in items]
+        if pool is None:
+            with self.worker_pool(processes) as pool:
+                return self.process_items(items, processes, chunk_size, pool)
+
+        chunk_size = chunk_size or max(
+            1, int(math.ceil(len(items) / float(processes * 4))))
+        chunks = [items[i:i + chunk_size]
+                  for i in range(0, len(items), chunk_size)]
+        processed = []
+        for entries in pool.imap(_make_info_chunk, chunks):
+            processed.extend(entries)
+        return processed
+
+    @contextmanager
+    def worker_pool(self, processes):
+        """
+        Create a pool of worker processes to be used by process_items().
+
+        Each worker receives a copy of this object, excluding the data.
+
+        @param processes: number of worker processes to use
+        @return: context manager yielding a multiprocessing.Pool, or None if
+            fewer than two processes are requested
+        """
+        if not processes or processes < 2:
+            yield None
+            return
+
+        # an open sqlite connection must not be carried across fork(), so
+        # let the workers (and later this process) open their own
+        for cache in self.caches.values():
+            cache.close()
+
+        # avoid sending all of the data to each worker
+        worker_info = copy.copy(self)
+        worker_info.data = dict()
+
+        pool = multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=(worker_info, ))
+        try:
+            yield pool
+        finally:
+            pool.close()
+            pool.join()
+
+    def load_previous(self, base_name, sharded=False):
+        """
+        Load the output and fingerprints of a previous run, if any.
+
+        @param base_name: base name used for the output of the previous run
+        @param sharded: whether to prefer previous sharded output over a
+            previous json file
+        @return: tuple of the output (dict or JsonShards) and fingerprints,
+            or None if either is missing
+        """
+        fingerprint_file = '%s.fingerprints.json' % base_name
+        out_files = [json_output_name(base_name, compression)
+                     for compression in [None] + sorted(common.COMPRESSIONS)]
+        sharded_file = '%s%s' % (base_name, common.SHARD_INDEX_SUFFIX)
+        if sharded:
+            out_files.insert(0, sharded_file)
+        else:
+            out_files.append(sharded_file)
+        out_files = [f for f in out_files if os.path.isfile(f)]
+        if not out_files or not os.path.isfile(fingerprint_file):
+            pywikibot.warning(
+                'No previous output found for %s, processing all entries'
+                % base_name)
+            return None
+        return (common.open_json_object(out_files[0]),
+                common.open_and_read_file(fingerprint_file, as_json=True))
+
+    def stream_info(self, items, base_name, shard_size=None, processes=None,
+                    previous=None, collisions='report', compact=False,
+                    compression=None, fingerprint=False):
+        """
+        Make and write the info for the given items, one batch at a time.
+
+        The items are processed in batches of STREAM_BATCH, sharing a single
+        pool of any worker processes, so that only the current batch is held
+        in memory. The entries are spooled to a temporary file and written
+        to the output once all of the items have been processed. As with
+        make_info() later entries then replace earlier ones with the same
+        original filename. The entries are kept in the order of the items.
+
+        Collisions are only reported once all of the entries have been
+        written, so with the "fail" policy the error is raised after the
+        output has been created.
+
+        @param items: iterable of (key, item) tuples
+        @param base_name: base name to use for output
+        @param shard_size: number of entries per shard if the output should be
+            sharded (optional)
+        @param processes: number of worker processes to use (optional)
+        @param previous: tuple of the output (or JsonShards) and the
+            fingerprints of a previous run (optional)
+        @param collisions: how to handle generated filenames used by more
+            than one file, one of COLLISION_POLICIES
+        @param compact: whether to write the json without indentation
+        @param compression: one of common.COMPRESSIONS to compress the json
+            output with (not applicable to sharded output)
+        @param fingerprint: whether to write the fingerprints even if no
+            previous run is provided
+        """
+        fingerprint = fingerprint or bool(previous)
+        mappings_hash = self._mappings_hash() if fingerprint else None
+        spool_file = '%s.entries.tmp' % base_name
+        last = dict()  # original filename: number of its last entry
+        total = reused = 0
+        with open(spool_file, 'w', encoding='utf-8') as spool, \
+                self.worker_pool(processes) as pool:
+            for batch in common.iter_batches(items, STREAM_BATCH):
+                entries, batch_reused = self.make_info_entries(
+                    batch, processes, previous=previous,
+                    mappings_hash=mappings_hash, pool=pool)
+                reused += batch_reused
+                for key, item_hash, (original_filename, entry) in entries:
+                    last[original_filename] = total
+                    spool.write('%s\n' % json.dumps(
+                        [key, item_hash, original_filename, entry],
+                        ensure_ascii=False))
+                    total += 1
+        if previous:
+            pywikibot.output('Reused %d and processed %d of %d entries' % (
+                reused, total - reused, total))
+            if isinstance(previous[0], common.JsonShards):
+                previous[0].close()
+
+        index = FilenameIndex(collisions, self.disambiguate_filename)
+        indent = None if compact else 4
+        if shard_size:
+            writer = common.JsonShardsWriter(base_name, shard_size=shard_size)
+        else:
+            writer = common.JsonObjectWriter(
+                json_output_name(base_name, compression), indent=indent,
+                compression=compression)
+        fingerprints = None
+        if fingerprint:
+            fingerprints = common.JsonObjectWriter(
+                '%s.fingerprints.json' % base_name, indent=indent)
+        filenames_file = '%s.filenames.txt' % base_name
+        filenames = open('%s.tmp' % filenames_file, 'w', encoding='utf-8')
+
+        with open(spool_file, 'r', encoding='utf-8') as spool:
+            for number, line in enumerate(spool):
+                key, item_hash, original_filename, entry = json.loads(line)
+                if last[original_filename] == number:
+                    if index.add(original_filename, entry, key):
+                        # reprocess renamed entries in case the collision
+                        # is gone
+                        item_hash = None
+                    writer.write(original_filename, entry)
+                    filenames.write('%s|%s\n' % (original_filename,
+                                                 entry['filename']))
+                if fingerprints:
+                    fingerprints.write(key, {
+                        'fingerprint': item_hash,
+                        'original_filename': original_filename})
+        os.remove(spool_file)
+
+        pywikibot.output(writer.close_and_confirm())
+        if fingerprints:
+            pywikibot.output(fingerprints.close_and_confirm())
+        filenames.close()
+        common.replace_file('%s.tmp' % filenames_file, filenames_file)
+        pywikibot.output('Created %s' % filenames_file)
+        index.report()
+
+    def run(self, in_file, base_name, update_mappings, shard_size=None,
+            processes=None, incremental=False, collisions='report',
+            stream=False, compact=False, compression=None,
+            refresh_caches=False):
         """
         Entry point for outputting info data.
 
         Loads indata and any mappings to produce a make_info json file.
 
+        If a shard_size is given the output is instead written as json lines
+        shards with an index (see common.write_json_shards()), allowing
+        consumers to look up or stream entries without loading the whole
+        output.
+
+        In incremental mode a fingerprint of each item is stored in
+        <base_name>.fingerprints.json. These are compared to those of the
+        previous (incremental) run so that only changed items are processed
+        (see make_info()). Note that changes to the processing code itself
+        are not detected.
+
+        In streaming mode the items are processed and written in batches
+        (see stream_info()) rather than all at once, the output entries
+        then being in the order of the data rather than sorted.
+
         @param in_file: filename (or tuple of such) containing the metadata
         @param base_name: base name to use for output
             (defaults to same as in_file)
         @update_mappings: if mappings should be updated against online sources
+        @param shard_size: number of entries per shard if the output should be
+            sharded (optional)
+        @param processes: number of worker processes to use in make_info()
+            (optional)
+        @param incremental: whether to reuse the output of a previous run for
+            unchanged items, and store the fingerprints needed for the next
+        @param collisions: how to handle generated filenames used by more
+            than one file, one of COLLISION_POLICIES (defaults to "report")
+        @param stream: whether to process and write the data in batches
+        @param compact: whether to write the json output without indentation
+        @param compression: one of common.COMPRESSIONS to compress the json
+            output with, adding the matching extension to the filename (not
+            applicable to sharded output)
+        @param refresh_caches: whether to clear any persistent caches opened
+            with open_cache()
         """
         if not base_name:
             if common.is_str(in_file):
@@ -221,16 +796,56 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
                     'are provided')
 
         self.cwd_path = os.path.split(base_name)[0]
+        self.refresh_caches = refresh_caches
+        try:
+            self._run(in_file, base_name, update_mappings, shard_size,
+                      processes, incremental, collisions, stream, compact,
+                      compression)
+        finally:
+            self.close_caches()
+
+    def _run(self, in_file, base_name, update_mappings, shard_size,
+             processes, incremental, collisions, stream, compact,
+             compression):
+        """Load, process and output the data. See run()."""
         raw_data = self.load_data(in_file)
         self.load_mappings(update_mappings)
+        previous = None
+        if incremental:
+            previous = self.load_previous(base_name, sharded=bool(shard_size))
+        if stream:
+            self.stream_info(
+                self.iter_process_data(raw_data), base_name,
+                shard_size=shard_size, processes=processes,
+                previous=previous, collisions=collisions, compact=compact,
+                compression=compression, fingerprint=incremental)
+            return
+
         self.process_data(raw_data)
-        out_data = self.make_info()
+        out_data = self.make_info(processes=processes, previous=previous,
+                                  collisions=collisions,
+                                  fingerprint=incremental)
+        if previous and isinstance(previous[0], common.JsonShards):
+            previous[0].close()
 
         # store output
-        out_file = '%s.json' % base_name
-        common.open_and_write_file(out_file, out_data, as_json=True)
+        if shard_size:
+            out_file = common.write_json_shards(
+                base_name, out_data, shard_size=shard_size)
+        else:
+            out_file = json_output_name(base_name, compression)
+            common.open_and_write_file(out_file, out_data, as_json=True,
+                                       compact=compact,
+                                       compression=compression)
         pywikibot.output('Created %s' % out_file)
 
+        # store fingerprints
+        if incremental:
+            out_file = '%s.fingerprints.json' % base_name
+            common.open_and_write_file(out_file, self.fingerprints,
+                                       as_json=True, compact=compact)
+            pywikibot.output('Created %s' % out_file)
+
         # store filenames
         out_file = '%s.filenames.txt' % base_name
         out = ''
@@ -249,13 +864,22 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         @type args: list of strings
         @return: list of options
         @rtype: dict
+        @raises common.MyError: if an option has an invalid value
         """
         options = {
             'in_file': None,
             'base_name': None,
             'update_mappings': True,
             'base_meta_cat': None,
-            'batch_label': None
+            'batch_label': None,
+            'shard_size': None,
+            'processes': None,
+            'incremental': False,
+            'collisions': 'report',
+            'stream': False,
+            'compact': False,
+            'compression': None,
+            'refresh_caches': False
         }
 
         for arg in pywikibot.handle_args(args):
@@ -271,6 +895,37 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
                     value)
             elif option == '-batch_label':
                 options['batch_label'] = common.convert_from_commandline(value)
+            elif option == '-shard_size':
+                if not common.is_pos_int(value):
+                    raise common.MyError(
+                        '-shard_size must be a positive integer')
+                options['shard_size'] = int(value)
+            elif option == '-processes':
+                if not common.is_pos_int(value):
+                    raise common.MyError(
+                        '-processes must be a positive integer')
+                options['processes'] = int(value)
+            elif option == '-incremental':
+                options['incremental'] = (
+                    common.interpret_bool(value) if value else True)
+            elif option == '-collisions':
+                if value not in COLLISION_POLICIES:
+                    raise common.MyError(
+                        '-collisions must be one of: %s' % ', '.join(
+                            COLLISION_POLICIES))
+                options['collisions'] = value
+            elif option == '-stream':
+                options['stream'] = True
+            elif option == '-compact':
+                options['compact'] = True
+            elif option == '-compress':
+                if value not in common.COMPRESSIONS:
+                    raise common.MyError(
+                        '-compress must be one of: %s' % ', '.join(
+                            sorted(common.COMPRESSIONS)))
+                options['compression'] = value
+            elif option == '-refresh_caches':
+                options['refresh_caches'] = True
 
         return options
 
@@ -296,6 +951,25 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
             'batch (optional)\n'
             '\t-batch_label:STRING label used for the batch specific '
             'category (optional)\n'
+            '\t-shard_size:INT write the output as json lines shards, with an '
+            'index, of this many entries each (optional)\n'
+            '\t-processes:INT number of worker processes to use when '
+            'generating the info (optional)\n'
+            '\t-incremental:BOOL if only entries which changed since the '
+            'previous incremental run should be processed (defaults to '
+            'False)\n'
+            '\t-collisions:STRING how to handle generated filenames used by '
+            'several files. Must be either "fail", "report" or '
+            '"disambiguate" (defaults to report)\n'
+            '\t-stream process and write the data in batches rather than '
+            'all at once (optional)\n'
+            '\t-compact write the json output without indentation '
+            '(optional)\n'
+            '\t-compress:STRING compress the json output. Must be either '
+            '"gzip" or "zstd", the latter requiring the zstandard package '
+            '(optional)\n'
+            '\t-refresh_caches clear any cached lookups (e.g. of categories) '
+            'from previous runs (optional)\n'
             '\t-dir:PATH specifies the path to the directory containing a '
             'user_config.py file (optional)\n'
             '\tExample:\n'
@@ -303,12 +977,25 @@ class MakeBaseInfo(with_metaclass(ABCMeta, object)):
         )
 
         # Load pywikibot args and handle local args
-        options = cls.handle_args(args)
+        try:
+            options = cls.handle_args(args)
+        except common.MyError as e:
+            pywikibot.warning(e)
+            pywikibot.output(usage)
+            return
 
         if options['in_file']:
             info = cls(**options)
             info.run(options['in_file'], options['base_name'],
-                     options['update_mappings'])
+                     options['update_mappings'],
+                     shard_size=options['shard_size'],
+                     processes=options['processes'],
+                     incremental=options['incremental'],
+                     collisions=options['collisions'],
+                     stream=options['stream'],
+                     compact=options['compact'],
+                     compression=options['compression'],
+                     refresh_caches=options['refresh_caches'])
             return info
         else:
             pywikibot.output(usage)
@@ -0,0 +1,699 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+A local stand-in for the parts of the MediaWiki API used when uploading.
+
+Implements enough of the API for pywikibot to log in and to upload files,
+either in chunks through the upload stash or by url, including the exists,
+duplicate and bad-prefix warnings. A fixed latency can be added to each
+request and failures can be injected either randomly or on demand.
+
+Files uploaded by url are never fetched, instead the url itself is used as
+the file contents.
+
+This is only intended for benchmarks and tests, never expose it to a network.
+
+To run it stand-alone:
+    python -m batchupload.mock_api -port:8765 -latency:0.1
+and point pywikibot at it by registering the mockwiki family with
+register_family().
+"""
+from __future__ import unicode_literals
+from builtins import dict
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, urlparse
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl, urlparse
+
+FAMILY_NAME = 'mockwiki'
+DEFAULT_PORT = 8765
+MW_VERSION = '1.35.0'
+BAD_PREFIXES = ('DSC', 'IMG', 'P100', 'CIMG')
+
+NAMESPACES = {
+    -2: 'Media', -1: 'Special', 0: '', 1: 'Talk', 2: 'User',
+    3: 'User talk', 4: 'Project', 5: 'Project talk', 6: 'File',
+    7: 'File talk', 8: 'MediaWiki', 9: 'MediaWiki talk', 10: 'Template',
+    11: 'Template talk', 12: 'Help', 13: 'Help talk', 14: 'Category',
+    15: 'Category talk'}
+ACTIONS = ('clientlogin', 'login', 'logout', 'paraminfo', 'query', 'tokens',
+           'upload')
+QUERY_MODULES = {  # name: (group, prefix)
+    'info': ('prop', 'in'), 'imageinfo': ('prop', 'ii'),
+    'templates': ('prop', 'tl'), 'allimages': ('list', 'ai'),
+    'siteinfo': ('meta', 'si'), 'tokens': ('meta', ''),
+    'userinfo': ('meta', 'ui')}
+TOKEN_TYPES = ['csrf', 'login', 'patrol', 'rollback', 'userrights', 'watch']
+MODULE_PARAMETERS = {  # path: [(name, type)] for the few checked by clients
+    'tokens': [('type', TOKEN_TYPES)],
+    'query+tokens': [('type', TOKEN_TYPES)],
+    'query+info': [('prop', ['protection', 'url']),
+                   ('token', ['edit', 'move'])],
+    'upload': [('filename', 'string'), ('filekey', 'string'),
+               ('url', 'string'), ('chunk', 'upload'),
+               ('offset', 'integer'), ('filesize', 'integer')]}
+
+
+def timestamp():
+    """Return the current time as a MediaWiki timestamp."""
+    return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def submodule_param(name, submodules):
+    """Return the paraminfo description of a parameter taking submodules."""
+    return {'name': name, 'type': sorted(submodules),
+            'submodules': submodules}
+
+
+class MockApiError(Exception):
+    """An error to be returned as a MediaWiki API error response."""
+
+    def __init__(self, code, info, **other):
+        """
+        Initialise the error.
+
+        @param code: the API error code
+        @param info: a human readable description of the error
+        @param other: any additional data to include in the error response
+        """
+        super(MockApiError, self).__init__(code)
+        self.code = code
+        self.info = info
+        self.other = other
+
+    def response(self):
+        """Return the API response for the error."""
+        error = {'code': self.code, 'info': self.info}
+        error.update(self.other)
+        return {'error': error}
+
+
+class MockWiki(object):
+    """The state of the mock wiki and the implementation of its API."""
+
+    def __init__(self, latency=0, failure_rate=0,
+                 failure_code='stashedfilenotfound', seed=None):
+        """
+        Initialise a MockWiki.
+
+        @param latency: seconds to wait before answering each request
+        @param failure_rate: probability (0-1) that an upload request fails
+            with failure_code
+        @param failure_code: the API error code used for random failures
+        @param seed: seed for the random failures
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = dict()  # title: wikitext
+        self.files = dict()  # title (without namespace): file info
+        self.stash = dict()  # filekey: {'data': bytearray, 'size': int}
+        self.injected_failures = []  # error codes to raise on next uploads
+        self.request_counts = dict()  # action: number of requests
+        self.user = 'Mock user'  # the most recently logged in user
+
+    @property
+    def port(self):
+        """Return the port of the server (set by MockServer)."""
+        return getattr(self, '_port', DEFAULT_PORT)
+
+    def inject_failure(self, code='stashedfilenotfound', count=1):
+        """
+        Make the next upload request(s) fail with a given error code.
+
+        @param code: the API error code to return
+        @param count: the number of upload requests which should fail
+        """
+        with self.lock:
+            self.injected_failures.extend([code] * count)
+
+    def add_file(self, title, data=b'', text=''):
+        """
+        Add a pre-existing file to the wiki.
+
+        @param title: the filename (without namespace prefix)
+        @param data: the file contents (bytes)
+        @param text: the wikitext of the file description page
+        """
+        with self.lock:
+            self._store_file(title, bytes(data), text, self.user)
+
+    def _store_file(self, title, data, text, user):
+        """Store a file and its description page (lock must be held)."""
+        self.files[title] = {
+            'timestamp': timestamp(),
+            'user': user,
+            'size': len(data),
+            'sha1': hashlib.sha1(data).hexdigest(),
+            'comment': text,
+            'url': 'http://localhost:{0}/images/{1}'.format(
+                self.port, title.replace(' ', '_')),
+            'descriptionurl': 'http://localhost:{0}/wiki/File:{1}'.format(
+                self.port, title.replace(' ', '_')),
+        }
+        self.pages['File:{0}'.format(title)] = text
+
+    @staticmethod
+    def normalize(title):
+        """Normalise a page title the way MediaWiki does."""
+        title = title.replace('_', ' ').strip()
+        namespace, sep, rest = title.partition(':')
+        if sep and namespace.capitalize() in NAMESPACES.values():
+            return '{0}:{1}'.format(
+                namespace.capitalize(), MockWiki.normalize(rest))
+        return title[:1].upper() + title[1:]
+
+    def handle(self, params, files):
+        """
+        Process a single API request.
+
+        @param params: dict of the request parameters
+        @param files: dict of any uploaded (multipart) files as bytes
+        @return: the response as a dict
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        action = params.get('action', 'help')
+        with self.lock:
+            self.request_counts[action] = \
+                self.request_counts.get(action, 0) + 1
+        handler = getattr(self, 'action_{0}'.format(action), None)
+        try:
+            if handler is None:
+                raise MockApiError(
+                    'badvalue',
+                    'Unrecognized value for parameter "action": {0}.'.format(
+                        action))
+            return handler(params, files)
+        except MockApiError as error:
+            return error.response()
+
+    # actions
+    def action_login(self, params, files):
+        """Log in, accepting any username and password."""
+        if not params.get('lgtoken'):
+            return {'login': {'result': 'NeedToken', 'token': 'logintoken'}}
+        with self.lock:
+            self.user = params.get('lgname') or self.user
+        return {'login': {'result': 'Success', 'lguserid': 1,
+                          'lgusername': params.get('lgname')}}
+
+    def action_clientlogin(self, params, files):
+        """Log in, accepting any username and password."""
+        if not params.get('logintoken'):
+            raise MockApiError(
+                'missingparam', 'The "logintoken" parameter must be set.')
+        with self.lock:
+            self.user = params.get('username') or self.user
+        return {'clientlogin': {'status': 'PASS', 'username': self.user}}
+
+    def action_logout(self, params, files):
+        """Log out."""
+        return {}
+
+    def action_tokens(self, params, files):
+        """Return the requested tokens (deprecated stand-alone module)."""
+        return {'tokens': self.tokens(params)}
+
+    def action_paraminfo(self, params, files):
+        """Describe the API modules (only the bare minimum)."""
+        modules = []
+        for path in params.get('modules', '').split('|'):
+            if not path:
+                continue
+            name = path.rpartition('+')[2]
+            module = {'name': name, 'path': path, 'classname': 'ApiMock',
+                      'group': 'action', 'prefix': '', 'parameters': [
+                          {'name': param, 'type': param_type}
+                          for param, param_type in MODULE_PARAMETERS.get(
+                              path, [])]}
+            if path == 'main':
+                module['parameters'] = [
+                    submodule_param('action', dict(
+                        (action, action) for action in ACTIONS)),
+                    {'name': 'format', 'type': ['json']},
+                    {'name': 'maxlag', 'type': 'integer'},
+                    {'name': 'assert', 'type': ['anon', 'user', 'bot']},
+                    {'name': 'assertuser', 'type': 'user'}]
+            elif path == 'paraminfo':
+                module['parameters'] = [
+                    {'name': 'modules', 'type': 'string', 'multi': '',
+                     'limit': 50},
+                    {'name': 'querymodules', 'type': list(QUERY_MODULES),
+                     'multi': '', 'limit': 50}]
+            elif path == 'query':
+                module['parameters'] = [
+                    submodule_param(group, dict(
+                        (sub, 'query+' + sub)
+                        for sub, (sub_group, _) in QUERY_MODULES.items()
+                        if sub_group == group))
+                    for group in ('prop', 'list', 'meta')]
+                module['parameters'].append(
+                    {'name': 'generator', 'type': [], 'submodules': {}})
+            elif path.startswith('query+'):
+                module['group'], module['prefix'] = QUERY_MODULES.get(
+                    name, ('prop', ''))
+                module['limit'] = 500
+            modules.append(module)
+        return {'paraminfo': {'modules': modules}}
+
+    def action_query(self, params, files):
+        """Handle the supported query sub-modules."""
+        query = {}
+        metas = params.get('meta', '').split('|')
+        if 'siteinfo' in metas:
+            query.update(self.siteinfo(params))
+        if 'tokens' in metas:
+            query['tokens'] = self.tokens(params)
+        if 'userinfo' in metas:
+            query['userinfo'] = {
+                'id': 1, 'name': self.user, 'groups': ['*', 'user', 'bot'],
+                'rights': ['read', 'edit', 'upload', 'upload_by_url',
+                           'reupload', 'bot', 'apihighlimits'],
+                'ratelimits': {}, 'messages': False}
+        if params.get('list') == 'allimages':
+            query['allimages'] = self.allimages(params)
+        if params.get('titles'):
+            query.update(self.page_info(params))
+            # no page ever transcludes anything
+            if 'templates' in params.get('prop', '').split('|'):
+                for page in query['pages'].values():
+                    page.setdefault('templates', [])
+        return {'batchcomplete': '', 'query': query}
+
+    def siteinfo(self, params):
+        """Return the requested siteinfo properties."""
+        props = params.get('siprop', 'general').split('|')
+        server = 'http://localhost:{0}'.format(self.port)
+        info = {}
+        if 'general' in props:
+            info['general'] = {
+                'mainpage': 'Main Page', 'base': server + '/wiki/Main_Page',
+                'sitename': 'Mock wiki', 'generator': 'MediaWiki {0}'.format(
+                    MW_VERSION),
+                'case': 'first-letter', 'lang': 'en', 'fallback': [],
+                'wikiid': FAMILY_NAME, 'server': server,
+                'servername': 'localhost', 'articlepath': '/wiki/$1',
+                'scriptpath': '', 'script': '/index.php',
+                'time': timestamp(), 'timezone': 'UTC', 'timeoffset': 0,
+                'maxuploadsize': 4294967296, 'minuploadchunksize': 1024,
+                'uploadsenabled': '', 'legaltitlechars':
+                    " %!\"$&'()*,\\-.\\/0-9:;=?@A-Z\\\\^_`a-z~\\x80-\\xFF+",
+                'readonly': False, 'writeapi': ''}
+        if 'namespaces' in props:
+            info['namespaces'] = dict(
+                (str(ns), {'id': ns, 'case': 'first-letter', '*': name,
+                           'canonical': name, 'content': ns == 0,
+                           'subpages': ns not in (-2, -1, 0, 6, 14)})
+                for ns, name in NAMESPACES.items())
+            for ns in info['namespaces'].values():
+                if ns['id'] == 0:
+                    del ns['canonical']
+        if 'namespacealiases' in props:
+            info['namespacealiases'] = [{'id': 6, '*': 'Image'}]
+        for prop in ('extensions', 'magicwords', 'interwikimap',
+                     'specialpagealiases', 'fileextensions', 'restrictions',
+                     'libraries', 'skins', 'extensiontags', 'functionhooks',
+                     'showhooks', 'languages', 'protocols', 'usergroups'):
+            if prop in props:
+                info[prop] = []
+        if 'fileextensions' in props:
+            info['fileextensions'] = [
+                {'ext': ext} for ext in ('jpg', 'jpeg', 'png', 'tif', 'tiff',
+                                         'svg', 'wav')]
+        if 'restrictions' in props:
+            info['restrictions'] = {
+                'types': ['edit', 'move', 'upload'],
+                'levels': ['', 'autoconfirmed', 'sysop'],
+                'cascadinglevels': ['sysop'], 'semiprotectedlevels': []}
+        return info
+
+    def tokens(self, params):
+        """Return the requested tokens."""
+        tokens = {}
+        for token_type in params.get('type', 'csrf').split('|'):
+            tokens['{0}token'.format(token_type)] = '{0}+\\'.format(
+                token_type)
+        return tokens
+
+    def allimages(self, params):
+        """List the files matching a SHA1 (the only supported filter)."""
+        sha1 = params.get('aisha1')
+        with self.lock:
+            return [
+                {'name': title.replace(' ', '_'), 'ns': 6,
+                 'title': 'File:{0}'.format(title), 'timestamp':
+                     info['timestamp'], 'sha1': info['sha1']}
+                for title, info in sorted(self.files.items())
+                if sha1 is None or info['sha1'] == sha1]
+
+    def page_info(self, params):
+        """Report on the existence of the requested titles."""
+        result = {'pages': {}}
+        normalized = []
+        missing_id = 0
+        for title in params['titles'].split('|'):
+            norm_title = MockWiki.normalize(title)
+            if norm_title != title:
+                normalized.append({'from': title, 'to': norm_title})
+            namespace = norm_title.partition(':')[0]
+            ns = 0
+            for ns_id, name in NAMESPACES.items():
+                if name and name == namespace:
+                    ns = ns_id
+            with self.lock:
+                exists = norm_title in self.pages
+            if exists:
+                page_id = abs(hash(norm_title)) % 1000000 + 1
+                result['pages'][str(page_id)] = {
+                    'pageid': page_id, 'ns': ns, 'title': norm_title}
+            else:
+                missing_id -= 1
+                result['pages'][str(missing_id)] = {
+                    'ns': ns, 'title': norm_title, 'missing': ''}
+        if normalized:
+            result['normalized'] = normalized
+        return result
+
+    def action_upload(self, params, files):
+        """Upload a file, a chunk of a file or commit a stashed file."""
+        if not params.get('token'):
+            raise MockApiError(
+                'missingparam', 'The "token" parameter must be set.')
+        with self.lock:
+            injected = self.injected_failures.pop(0) \
+                if self.injected_failures else None
+        if injected is None and self.failure_rate and \
+                self.random.random() < self.failure_rate:
+            injected = self.failure_code
+        if injected:
+            raise MockApiError(injected, 'Injected failure.')
+
+        filename = MockWiki.normalize(params.get('filename', ''))
+        ignore_warnings = params.get('ignorewarnings') not in (
+            None, '', 'False', '0')
+
+        if 'chunk' in files:
+            return self.upload_chunk(params, files['chunk'], filename,
+                                     ignore_warnings)
+        elif params.get('filekey'):
+            with self.lock:
+                stashed = self.stash.get(params['filekey'])
+            if stashed is None:
+                raise MockApiError(
+                    'stashedfilenotfound',
+                    'Could not find the file in the stash.')
+            data = bytes(stashed['data'])
+        elif params.get('url'):
+            data = params['url'].encode('utf-8')
+        elif 'file' in files:
+            data = files['file']
+        else:
+            raise MockApiError(
+                'missingparam',
+                'One of the parameters "filekey", "file" and "url" is '
+                'required.')
+        return self.finalize_upload(params, filename, data, ignore_warnings)
+
+    def upload_chunk(self, params, chunk, filename, ignore_warnings):
+        """Store an uploaded chunk in the stash."""
+        offset = int(params.get('offset', 0))
+        filesize = int(params.get('filesize', 0))
+        with self.lock:
+            filekey = params.get('filekey')
+            if filekey:
+                if filekey not in self.stash:
+                    raise MockApiError(
+                        'stashedfilenotfound',
+                        'Could not find the file in the stash.')
+            else:
+                filekey = '{0}.stash'.format(uuid.uuid4().hex)
+                self.stash[filekey] = {'data': bytearray(), 'size': filesize}
+            stashed = self.stash[filekey]
+            if offset != len(stashed['data']):
+                raise MockApiError(
+                    'stashfailed', 'Offset mismatch.',
+                    offset=len(stashed['data']))
+            stashed['data'].extend(chunk)
+            new_offset = len(stashed['data'])
+
+        response = {'result': 'Continue', 'offset': new_offset,
+                    'filekey': filekey}
+        if offset == 0 and not ignore_warnings:
+            warnings = self.warnings(filename, None)
+            if warnings:
+                response['warnings'] = warnings
+        if new_offset >= filesize:
+            response['result'] = 'Success'
+        return {'upload': response}
+
+    def warnings(self, filename, data):
+        """Return any upload warnings triggered by a filename and content."""
+        warnings = {}
+        with self.lock:
+            if filename in self.files:
+                warnings['exists'] = filename.replace(' ', '_')
+            if data is not None:
+                sha1 = hashlib.sha1(data).hexdigest()
+                duplicates = [
+                    title.replace(' ', '_')
+                    for title, info in sorted(self.files.items())
+                    if info['sha1'] == sha1 and title != filename]
+                if duplicates:
+                    warnings['duplicate'] = duplicates
+        if filename.startswith(BAD_PREFIXES):
+            warnings['bad-prefix'] = filename.split(' ')[0]
+        return warnings
+
+    def finalize_upload(self, params, filename, data, ignore_warnings):
+        """Publish an uploaded (or stashed) file if there are no warnings."""
+        if not ignore_warnings:
+            warnings = self.warnings(filename, data)
+            if warnings:
+                with self.lock:
+                    filekey = params.get('filekey') or '{0}.stash'.format(
+                        uuid.uuid4().hex)
+                    self.stash[filekey] = {
+                        'data': bytearray(data), 'size': len(data)}
+                return {'upload': {'result': 'Warning', 'warnings': warnings,
+                                   'filekey': filekey,
+                                   'sessionkey': filekey}}
+        with self.lock:
+            self._store_file(filename, data, params.get('text') or
+                             params.get('comment', ''), self.user)
+            self.stash.pop(params.get('filekey'), None)
+            info = dict(self.files[filename])
+        return {'upload': {'result': 'Success', 'filename': filename,
+                           'imageinfo': info}}
+
+
+def parse_multipart(body, content_type):
+    """
+    Parse a multipart/form-data request body.
+
+    Both CRLF and LF line breaks are accepted.
+
+    @param body: the request body as bytes
+    @param content_type: the value of the Content-Type header
+    @return: tuple of a dict of the (str) form fields and a dict of the
+        (bytes) contents of any uploaded files
+    """
+    boundary = content_type.partition('boundary=')[2].split(';')[0]
+    boundary = boundary.strip().strip('"').encode('ascii')
+    fields = {}
+    files = {}
+    for part in body.split(b'--' + boundary)[1:]:
+        if part.startswith(b'--'):
+            break  # the closing boundary
+        part = part[2:] if part.startswith(b'\r\n') else part[1:]
+        head, sep, content = part.partition(b'\r\n\r\n')
+        if not sep:
+            head, sep, content = part.partition(b'\n\n')
+        if content.endswith(b'\r\n'):
+            content = content[:-2]
+        elif content.endswith(b'\n'):
+            content = content[:-1]
+
+        disposition = {}
+        for line in head.decode('utf-8').splitlines():
+            name, sep, value = line.partition(':')
+            if name.strip().lower() != 'content-disposition':
+                continue
+            for item in value.split(';')[1:]:
+                key, sep, val = item.strip().partition('=')
+                disposition[key] = val.strip('"')
+        if 'name' not in disposition:
+            continue
+        if 'filename' in disposition:
+            files[disposition['name']] = content
+        else:
+            fields[disposition['name']] = content.decode('utf-8')
+    return fields, files
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Pass api.php requests on to the MockWiki of the server."""
+
+    def log_message(self, format, *args):
+        """Silence the default logging of each request."""
+        pass
+
+    def do_GET(self):
+        """Handle a GET request."""
+        url = urlparse(self.path)
+        self.respond(url.path, dict(parse_qsl(url.query)), {})
+
+    def do_POST(self):
+        """Handle a POST request (urlencoded or multipart)."""
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        files = {}
+        length = int(self.headers.get('Content-Length', 0))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            fields, files = parse_multipart(
+                self.rfile.read(length), content_type)
+            params.update(fields)
+        else:
+            body = self.rfile.read(length).decode('utf-8')
+            params.update(parse_qsl(body, keep_blank_values=True))
+        self.respond(url.path, params, files)
+
+    def respond(self, path, params, files):
+        """Send the response to an API request."""
+        if not path.endswith('/api.php'):
+            self.send_error(404)
+            return
+        response = self.server.wiki.handle(params, files)
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if 'error' in response:
+            self.send_header('MediaWiki-API-Error', response['error']['code'])
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server serving a MockWiki."""
+
+    daemon_threads = True
+
+    def __init__(self, wiki=None, port=0):
+        """
+        Initialise the server.
+
+        @param wiki: the MockWiki to serve (defaults to a new one)
+        @param port: the port on localhost to listen to, 0 picks a free one
+        """
+        HTTPServer.__init__(self, ('localhost', port), MockRequestHandler)
+        self.wiki = wiki or MockWiki()
+        self.wiki._port = self.server_address[1]
+        self.thread = None
+
+    @property
+    def port(self):
+        """Return the port the server is listening to."""
+        return self.server_address[1]
+
+    @property
+    def api_url(self):
+        """Return the url of the api.php endpoint."""
+        return 'http://localhost:{0}/api.php'.format(self.port)
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and wait for the background thread to finish."""
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+
+
+def register_family(port):
+    """
+    Register the mockwiki family with pywikibot, pointing it to a port.
+
+    Must be called before the mockwiki Site is first created. Use
+    pywikibot.Site('mockwiki', 'mockwiki') to get the Site.
+
+    @param port: the port on localhost where the MockServer is listening
+    """
+    import pywikibot.config2 as config
+    os.environ['MOCKWIKI_PORT'] = str(port)
+    config.family_files[FAMILY_NAME] = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '{0}_family.py'.format(FAMILY_NAME))
+
+
+def main(*args):
+    """Command line entry-point."""
+    usage = (
+        'Usage:'
+        '\tpython -m batchupload.mock_api -port:NUM -latency:SECONDS\n'
+        '\t-port:NUM the port to listen to (defaults to {port})\n'
+        '\t-latency:SECONDS time to wait before answering each request '
+        '(optional)\n'
+        '\t-failure_rate:FLOAT probability, between 0 and 1, that an upload '
+        'request fails (optional)\n'
+        '\t-failure_code:STRING the error code of the random failures '
+        '(optional)\n'.format(port=DEFAULT_PORT))
+    import batchupload.common as common
+
+    port = DEFAULT_PORT
+    options = {}
+    try:
+        for arg in args:
+            option, sep, value = arg.partition(':')
+            if option == '-port' and common.is_pos_int(value):
+                port = int(value)
+            elif option == '-latency':
+                options['latency'] = float(value)
+                if options['latency'] < 0:
+                    raise ValueError('latency must not be negative')
+            elif option == '-failure_rate':
+                options['failure_rate'] = float(value)
+                if not 0 <= options['failure_rate'] <= 1:
+                    raise ValueError('failure_rate must be in [0, 1]')
+            elif option == '-failure_code':
+                options['failure_code'] = value
+            else:
+                print(usage)
+                return
+    except ValueError:
+        print(usage)
+        return
+
+    server = MockServer(MockWiki(**options), port)
+    print('Serving a mock MediaWiki API at {0}'.format(server.api_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import sys
+    main(*sys.argv[1:])
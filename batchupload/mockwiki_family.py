@@ -0,0 +1,25 @@
+# -*- coding: utf-8  -*-
+"""
+Pywikibot family file for the local mock wiki of batchupload.mock_api.
+
+The port is read from the MOCKWIKI_PORT environment variable. Register the
+family using batchupload.mock_api.register_family().
+"""
+from __future__ import unicode_literals
+import os
+from pywikibot import family
+
+
+class Family(family.SingleSiteFamily):
+    """Family class for a MockServer running on localhost."""
+
+    name = 'mockwiki'
+    domain = 'localhost:{0}'.format(os.environ.get('MOCKWIKI_PORT', 8765))
+
+    def scriptpath(self, code):
+        """Return the script path of the mock wiki."""
+        return ''
+
+    def protocol(self, code):
+        """Return the protocol of the mock wiki."""
+        return 'http'
@@ -24,11 +24,12 @@ def run(in_path, out_path, data_path, file_exts=None):
 
     @param in_path: path to directory where unprocessed files live
     @param out_path: path to directory where renamed files and info should live
-    @param data_path: path to .json containing makeInfo output data
+    @param data_path: path to .json containing makeInfo output data (or the
+        index of sharded such data)
     @param file_exts: tupple of allowed file extensions (case insensitive)
     """
     # Load data
-    data = common.open_and_read_file(data_path, codec='utf-8', as_json=True)
+    data = common.open_json_object(data_path, codec='utf-8')
 
     # set filExts
     file_exts = file_exts or FILE_EXTS
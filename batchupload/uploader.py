@@ -3,22 +3,72 @@
 """Tool for uploading a single or multiple files from disc or url."""
 from __future__ import unicode_literals
 import batchupload.common as common
+import batchupload.helpers as helpers
 import batchupload.prepUpload as prepUpload
 from batchupload.make_info import make_info_page
+from builtins import open
+from collections import deque
+from datetime import datetime
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import json
 import os
+import random
+import threading
+import time
 import pywikibot
+import requests
 
 FILE_EXTS = ('.tif', '.jpg', '.tiff', '.jpeg', '.wav', '.svg', '.png')
 URL_PROTOCOLS = ('http', 'https')  # @todo: extend with supported protocols
+PREFLIGHT_BATCH = 500  # filenames per pre-flight check when streaming
+
+# API error codes which are worth retrying, all others are seen as permanent
+TRANSIENT_ERRORS = (
+    'stashedfilenotfound', 'uploadstash-file-not-found',
+    'uploadstash-exception', 'backend-fail-internal', 'ratelimited',
+    'maxlag', 'readonly', 'http-curl-error', 'http-timed-out',
+    'internal_api_error_DBQueryError', 'internal_api_error_DBConnectionError')
+# exceptions, other than API errors, which are worth retrying
+TRANSIENT_EXCEPTIONS = (
+    pywikibot.exceptions.ServerError, pywikibot.exceptions.TimeoutError,
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# API error codes and exceptions signalling a failed transfer (timeouts or
+# lost connections), used to adapt the chunk size
+NETWORK_ERRORS = ('http-curl-error', 'http-timed-out')
+NETWORK_EXCEPTIONS = (
+    pywikibot.exceptions.TimeoutError, requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout)
+MAX_RETRIES = 3  # number of retries after a transient error
+RETRY_DELAY = 5  # base delay (in seconds) before a retry
+MAX_RETRY_DELAY = 300  # cap on the delay (in seconds) before a retry
+# API error codes signalling that the wiki wants us to slow down
+THROTTLE_ERRORS = ('maxlag', 'ratelimited')
+
+_worker = threading.local()  # per-thread state of upload workers
 
 
 def upload_single_file(file_name, media_file, text, target_site,
                        chunk_size=5, chunked=True, overwrite_page_exists=False,
                        upload_if_duplicate=False, upload_if_badprefix=False,
-                       ignore_all_warnings=False):
+                       ignore_all_warnings=False, max_retries=MAX_RETRIES,
+                       rate_limiter=None):
     """
     Upload a single file in chunks.
 
+    Uploads failing due to transient errors (see is_transient_error()) are
+    retried after a jittered exponential backoff. The number of attempts made
+    is recorded in the returned result.
+
+    If a RateLimiter is provided each attempt waits for its turn and the
+    outcome is reported back to it.
+
+    Structured metrics of the upload are recorded in result['metrics']: the
+    file size (bytes), chunk size (MB), number of attempts, the error or
+    warning code and the time (in seconds) spent waiting for the rate
+    limiter (wait), uploading (upload), waiting to retry (retry_wait) and in
+    total.
+
     @param file_name: sanitized filename to use for upload
     @param media_file: path or URL to media file to upload
     @param text: file description page
@@ -29,6 +79,10 @@ def upload_single_file(file_name, media_file, text, target_site,
     @param upload_if_duplicate: Ignore duplicate file warning
     @param upload_if_badprefix: Ignore bad-prefix warning
     @param ignore_all_warnings: Ignore all warnings
+    @param max_retries: number of times to retry after a transient error
+    @param rate_limiter: RateLimiter shared by all uploads (optional)
+    @return: dict with the keys {warning, error, log, attempts,
+        network_error, metrics}
     """
     def allow_warnings(warning_list):
         """Given a list of warnings determine if all are acceptable or not."""
@@ -38,7 +92,12 @@ def upload_single_file(file_name, media_file, text, target_site,
                 return False
         return True
 
-    result = {'warning': None, 'error': None, 'log': ''}
+    start = time.time()
+    metrics = {'file': file_name, 'bytes': 0, 'chunk_size': None,
+               'attempts': 0, 'code': None, 'wait': 0.0, 'upload': 0.0,
+               'retry_wait': 0.0, 'total': 0.0}
+    result = {'warning': None, 'error': None, 'log': '', 'attempts': 0,
+              'network_error': False, 'metrics': metrics}
 
     # handle warnings to ignore
     ignore_warnings = False
@@ -56,7 +115,7 @@ def upload_single_file(file_name, media_file, text, target_site,
 
     # convert chunksize to Mb
     if chunked:
-        chunk_size *= 1048576
+        chunk_size = int(chunk_size * 1048576)
     else:
         chunk_size = 0
 
@@ -71,41 +130,274 @@ def upload_single_file(file_name, media_file, text, target_site,
         source_url = media_file
     else:
         source_filename = media_file
+    num_bytes = 0
+    if source_filename and os.path.isfile(source_filename):
+        num_bytes = os.path.getsize(source_filename)
+    metrics['bytes'] = num_bytes
+    if source_filename and chunked:
+        metrics['chunk_size'] = chunk_size / 1048576.0
+
+    while True:
+        result.update(warning=None, error=None, log='', network_error=False)
+        result['attempts'] += 1
+        metrics['code'] = None
+        transient = False
+        if rate_limiter:
+            metrics['wait'] += rate_limiter.acquire(num_bytes)
+        upload_start = time.time()
+        try:
+            success = target_site.upload(
+                file_page,
+                source_filename=source_filename,
+                source_url=source_url,
+                ignore_warnings=ignore_warnings,
+                report_success=False,
+                chunk_size=chunk_size)
+        except pywikibot.data.api.APIError as error:
+            result['error'] = error
+            result['log'] = 'Error: %s: %s' % (file_page.title(), error)
+            metrics['code'] = error.code
+            transient = is_transient_error(error)
+            result['network_error'] = is_network_error(error)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            result['error'] = '%r' % e
+            result['log'] = 'Error: %s: Unhandled error: %s' % (
+                            file_page.title(), e)
+            metrics['code'] = type(e).__name__
+            transient = is_transient_error(e)
+            result['network_error'] = is_network_error(e)
+        else:
+            if result.get('warning'):
+                result['log'] = 'Warning: %s: %s' % (file_page.title(),
+                                                     result['warning'])
+                metrics['code'] = getattr(result['warning'], 'code', None)
+            elif success:
+                result['log'] = '%s: success' % file_page.title()
+            else:
+                result['error'] = \
+                    "No warning/error but '%s' didn't upload?" % \
+                    file_page.title()
+                result['log'] = 'Error: %s: %s' % (file_page.title(),
+                                                   result['error'])
+                metrics['code'] = 'not-uploaded'
+        metrics['upload'] += time.time() - upload_start
+        if rate_limiter:
+            rate_limiter.update(result['error'])
+
+        if not transient or result['attempts'] > max_retries:
+            metrics['attempts'] = result['attempts']
+            metrics['total'] = time.time() - start
+            return result
+
+        delay = retry_delay(result['attempts'])
+        pywikibot.warning('%s (retrying in %.1f s)' % (result['log'], delay))
+        time.sleep(delay)
+        metrics['retry_wait'] += delay
+
+
+def is_transient_error(error):
+    """
+    Determine if an upload error is transient, and thus worth retrying.
+
+    @param error: the exception raised during the upload
+    @return: bool
+    """
+    if isinstance(error, pywikibot.data.api.APIError):
+        return error.code in TRANSIENT_ERRORS
+    return isinstance(error, TRANSIENT_EXCEPTIONS)
+
+
+def is_network_error(error):
+    """
+    Determine if an upload error is due to a timeout or lost connection.
+
+    @param error: the exception raised during the upload
+    @return: bool
+    """
+    if isinstance(error, pywikibot.data.api.APIError):
+        return error.code in NETWORK_ERRORS
+    return isinstance(error, NETWORK_EXCEPTIONS)
+
+
+def retry_delay(attempt, base=RETRY_DELAY, cap=MAX_RETRY_DELAY):
+    """
+    Return the jittered exponential backoff delay before a retry.
 
+    The delay lies between half and the full exponential value to avoid
+    parallel workers retrying in lockstep.
+
+    @param attempt: the number of the failed attempt (starting at 1)
+    @param base: the base delay in seconds
+    @param cap: the maximum delay in seconds
+    @return: float
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+def make_worker_site(site):
+    """
+    Create a new, logged in, Site object mirroring the provided one.
+
+    pywikibot.Site() returns a shared object so a new instance is needed for a
+    worker to get its own session and throttle.
+
+    @param site: the pywikibot.Site object to mirror
+    @return: pywikibot.Site
+    """
+    worker_site = site.__class__(
+        site.code, fam=site.family, user=site.username())
+    worker_site.login()
+    return worker_site
+
+
+def get_worker_site(site, workers=1):
+    """
+    Return the Site object to upload to from the current thread.
+
+    When uploading with multiple workers each thread gets its own Site object,
+    created the first time the thread asks for one.
+
+    @param site: the pywikibot.Site object to which files are uploaded
+    @param workers: the number of upload workers in use
+    @return: pywikibot.Site
+    """
+    if workers <= 1:
+        return site
+    if getattr(_worker, 'site', None) is None:
+        _worker.site = make_worker_site(site)
+    return _worker.site
+
+
+def run_jobs(func, jobs, workers=1):
+    """
+    Apply a function to each job, optionally using a pool of threads.
+
+    Jobs are consumed lazily and at most twice the number of workers are in
+    flight at any time. The results are yielded in the same order as the jobs
+    so that any post-processing (logging, moving files) can be done serially
+    by the caller.
+
+    @param func: function taking a single job as its argument
+    @param jobs: iterable of jobs
+    @param workers: number of worker threads, 1 (default) disables threading
+    @return: generator of (job, result) tuples
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield job, func(job)
+        return
+
+    pool = ThreadPool(workers)
+    pending = deque()
     try:
-        success = target_site.upload(
-            file_page,
-            source_filename=source_filename,
-            source_url=source_url,
-            ignore_warnings=ignore_warnings,
-            report_success=False,
-            chunk_size=chunk_size)
-    except pywikibot.data.api.APIError as error:
-        result['error'] = error
-        result['log'] = 'Error: %s: %s' % (file_page.title(), error)
-    except KeyboardInterrupt:
+        for job in jobs:
+            pending.append((job, pool.apply_async(func, (job, ))))
+            if len(pending) >= 2 * workers:
+                job, async_result = pending.popleft()
+                yield job, async_result.get()
+        while pending:
+            job, async_result = pending.popleft()
+            yield job, async_result.get()
+    except BaseException:
+        pool.terminate()
         raise
-    except Exception as e:
-        result['error'] = '%r' % e
-        result['log'] = 'Error: %s: Unhandled error: %s' % (
-                        file_page.title(), e)
     else:
-        if result.get('warning'):
-            result['log'] = 'Warning: %s: %s' % (file_page.title(),
-                                                 result['warning'])
-        elif success:
-            result['log'] = '%s: success' % file_page.title()
-        else:
-            result['error'] = "No warning/error but '%s' didn't upload?" % \
-                              file_page.title()
-            result['log'] = 'Error: %s: %s' % (file_page.title(),
-                                               result['error'])
+        pool.close()
     finally:
-        return result
+        pool.join()
+
+
+def skipped_upload_result(file_name, warning, code=None):
+    """
+    Return the result of an upload skipped due to a pre-flight check.
+
+    The result has the same format as the output of upload_single_file().
+
+    @param file_name: the filename which would have been used for the upload
+    @param warning: the reason for not uploading the file
+    @param code: the upload warning code corresponding to the reason
+    @return: dict
+    """
+    return {'warning': warning, 'error': None, 'attempts': 0,
+            'log': 'Warning: %s: %s' % (file_name, warning),
+            'metrics': {'file': file_name, 'attempts': 0, 'code': code,
+                        'skipped': True}}
+
+
+def find_existing(file_names, site):
+    """
+    Identify which of the target filenames are already in use on the wiki.
+
+    The File pages are looked up in batches (see helpers.pages_exist()).
+
+    @param file_names: list of filenames (without namespace prefix)
+    @param site: pywikibot.Site object on which to look for the File pages
+    @return: set of filenames already in use
+    """
+    exists = helpers.pages_exist(
+        ['File:%s' % name for name in file_names], site=site)
+    return set(name for name in file_names if exists['File:%s' % name])
+
+
+def report_existing(existing, flog):
+    """
+    Output a report on any target filenames already in use on the wiki.
+
+    @param existing: set of filenames already in use
+    @param flog: the LogFile to which the report should be written
+    """
+    for name in sorted(existing):
+        flog.write_w_timestamp(
+            '{0}: Found filename already in use on the wiki'.format(name))
+    flog.write_w_timestamp(
+        '{0} filenames found to already be in use on the wiki'.format(
+            len(existing)))
+    pywikibot.output(
+        '{0} filenames are already in use on the wiki'.format(len(existing)))
+
+
+def find_duplicates(files, site, processes=None, workers=1):
+    """
+    Identify any local files which already exist on the wiki.
+
+    The SHA1 hashes of the files are calculated in a pool of processes. Each
+    hash is then looked up on the wiki using a light allimages query (the API
+    only accepts a single hash per query) without transferring the file.
+
+    @param files: list of paths to local media files
+    @param site: pywikibot.Site object on which to look for duplicates
+    @param processes: number of processes used for hashing (defaults to the
+        number of cpus)
+    @param workers: number of lookups to have in flight at the same time
+    @return: dict of {path: list of titles of existing duplicates}
+    """
+    pool = Pool(processes)
+    try:
+        hashes = dict(zip(files, pool.imap(common.file_sha1, files)))
+    finally:
+        pool.close()
+        pool.join()
+
+    def lookup(path):
+        """Return the titles of all files on the wiki with the same hash."""
+        return [page.title()
+                for page in site.allimages(sha1=hashes[path])]
+
+    duplicates = {}
+    for path, titles in run_jobs(lookup, files, workers):
+        if titles:
+            duplicates[path] = titles
+    return duplicates
 
 
 def up_all(in_path, cutoff=None, target='Uploaded', file_exts=None,
-           verbose=False, test=False, target_site=None, chunked=True):
+           verbose=False, test=False, target_site=None, chunked=True,
+           workers=1, max_retries=MAX_RETRIES, skip_duplicates=False,
+           check_existing=None, adaptive_chunks=False, chunk_size=5,
+           rate_limiter=None):
     """
     Upload all matched media files in the supplied directory.
 
@@ -124,11 +416,30 @@ def up_all(in_path, cutoff=None, target='Uploaded', file_exts=None,
     @param target_site: pywikibot.Site to which file should be uploaded,
         defaults to Commons.
     @param chunked: Whether to do chunked uploading or not.
+    @param workers: number of files to upload in parallel (defaults to 1)
+    @param max_retries: number of times to retry an upload after a transient
+        error (defaults to MAX_RETRIES)
+    @param skip_duplicates: whether to check the hashes of the files against
+        the wiki before uploading, treating any duplicates as warnings
+        without uploading them
+    @param check_existing: whether to check if the filenames are already in
+        use on the wiki before uploading. Set to "report" to only log these
+        or to "skip" to also treat them as warnings without uploading them.
+    @param adaptive_chunks: whether to adapt the chunk size of each upload to
+        the measured throughput (see AdaptiveChunkSize)
+    @param chunk_size: size of chunks (in MB) in which to upload files, the
+        initial size if adaptive_chunks is used (defaults to 5)
+    @param rate_limiter: RateLimiter pacing the uploads (defaults to one
+        which only backs off when the wiki asks us to slow down)
     """
     # set defaults unless overridden
     file_exts = file_exts or FILE_EXTS
     target_site = target_site or pywikibot.Site('commons', 'commons')
     target_site.login()
+    rate_limiter = rate_limiter or RateLimiter()
+    chunk_sizer = None
+    if adaptive_chunks and chunked:
+        chunk_sizer = AdaptiveChunkSize(initial=chunk_size)
 
     # Verify in_path
     if not os.path.isdir(in_path):
@@ -146,36 +457,98 @@ def up_all(in_path, cutoff=None, target='Uploaded', file_exts=None,
 
     # logfile
     flog = common.LogFile(in_path, '¤uploader.log')
+    metrics = UploadMetrics(in_path, '¤metrics.jsonl')
 
     # find all content files
     found_files = prepUpload.find_files(path=in_path, file_exts=file_exts,
                                         subdir=False)
-    counter = 1
-    for f in found_files:
-        if cutoff and counter > cutoff:
-            break
-        # verify that there is a matching info file
-        info_file = '%s.info' % os.path.splitext(f)[0]
-        base_name = os.path.basename(f)
-        base_info_name = os.path.basename(info_file)
-        if not os.path.exists(info_file):
-            flog.write_w_timestamp(
-                '{0}: Found multimedia file without info'.format(base_name))
-            continue
-
-        # prepare upload
-        txt = common.open_and_read_file(info_file)
 
-        if test:
-            pywikibot.output('Test upload "%s" with the following '
-                             'description:\n%s\n' % (base_name, txt))
+    # pre-flight checks against the wiki
+    candidates = [
+        f for f in found_files
+        if os.path.exists('%s.info' % os.path.splitext(f)[0])][:cutoff]
+    duplicates = {}
+    if skip_duplicates and not test:
+        duplicates = find_duplicates(candidates, target_site, workers=workers)
+        flog.write_w_timestamp(
+            '{0} files found to already exist on the wiki'.format(
+                len(duplicates)))
+    existing = set()
+    if check_existing:
+        existing = find_existing(
+            [os.path.basename(f) for f in candidates], target_site)
+        report_existing(existing, flog)
+
+    def upload_jobs():
+        """Yield the (media file, info file) pairs which should be uploaded."""
+        counter = 1
+        for f in found_files:
+            if cutoff and counter > cutoff:
+                break
+            # verify that there is a matching info file
+            info_file = '%s.info' % os.path.splitext(f)[0]
+            base_name = os.path.basename(f)
+            if not os.path.exists(info_file):
+                flog.write_w_timestamp(
+                    '{0}: Found multimedia file without info'.format(
+                        base_name))
+                continue
+
+            # stop here if testing
+            if test:
+                txt = common.open_and_read_file(info_file)
+                pywikibot.output('Test upload "%s" with the following '
+                                 'description:\n%s\n' % (base_name, txt))
+                counter += 1
+                continue
+
+            yield f, info_file
             counter += 1
-            continue
-        # stop here if testing
 
-        result = upload_single_file(base_name, f, txt, target_site,
-                                    upload_if_badprefix=True, chunked=chunked)
+    def upload(job):
+        """Upload a single media file described by its info file."""
+        f, info_file = job
+        if f in duplicates:
+            return skipped_upload_result(
+                os.path.basename(f),
+                'duplicate of %s (found before upload)' % ', '.join(
+                    duplicates[f]), 'duplicate')
+        if check_existing == 'skip' and os.path.basename(f) in existing:
+            return skipped_upload_result(
+                os.path.basename(f),
+                'filename already in use (found before upload)', 'exists')
+        start = time.time()
+        txt = common.open_and_read_file(info_file)
+        read_time = time.time() - start
+        if not chunk_sizer:
+            result = upload_single_file(
+                os.path.basename(f), f, txt,
+                get_worker_site(target_site, workers),
+                upload_if_badprefix=True, chunk_size=chunk_size,
+                chunked=chunked, max_retries=max_retries,
+                rate_limiter=rate_limiter)
+            result.setdefault('metrics', {})['read'] = read_time
+            return result
+
+        file_size = os.path.getsize(f)
+        file_chunk_size = chunk_sizer.for_file(file_size)
+        result = upload_single_file(
+            os.path.basename(f), f, txt,
+            get_worker_site(target_site, workers),
+            upload_if_badprefix=True, chunk_size=file_chunk_size,
+            max_retries=max_retries, rate_limiter=rate_limiter)
+        # only the transfer, not the waits for the rate limiter, is timed
+        upload_time = result.get('metrics', {}).get('upload', 0)
+        if result.get('network_error'):
+            chunk_sizer.update(file_size, upload_time, False)
+        elif not result.get('warning') and result.get('attempts') == 1:
+            chunk_sizer.update(file_size, upload_time, True)
+        result['log'] = '%s (chunk size: %.1f MB)' % (
+            result['log'], file_chunk_size)
+        result.setdefault('metrics', {})['read'] = read_time
+        return result
 
+    for (f, info_file), result in run_jobs(upload, upload_jobs(), workers):
         target_dir = None
         if result.get('error'):
             target_dir = error_dir
@@ -187,23 +560,36 @@ def up_all(in_path, cutoff=None, target='Uploaded', file_exts=None,
             pywikibot.output(result.get('log'))
 
         flog.write_w_timestamp(result.get('log'))
-        os.rename(f, os.path.join(target_dir, base_name))
-        os.rename(info_file, os.path.join(target_dir, base_info_name))
-        counter += 1
+        metrics.record(result)
+        os.rename(f, os.path.join(target_dir, os.path.basename(f)))
+        os.rename(info_file,
+                  os.path.join(target_dir, os.path.basename(info_file)))
 
     pywikibot.output(flog.close_and_confirm())
+    pywikibot.output(metrics.close_and_confirm())
 
 
 def up_all_from_url(info_path, cutoff=None, target='upload_logs',
                     file_exts=None, verbose=False, test=False,
-                    target_site=None, only=None, skip=None):
+                    target_site=None, only=None, skip=None, workers=1,
+                    resume=False, max_retries=MAX_RETRIES,
+                    check_existing=None, rate_limiter=None, stream=False):
     """
     Upload all media files provided as urls in a make_info json file.
 
     Outputs separate logfiles for files triggering errors, warnings (and
-    successful) so that these can be used in latter runs.
+    successful) so that these can be used in latter runs. The state of each
+    url is also recorded in an UploadJournal allowing an interrupted run to
+    be resumed.
+
+    In streaming mode the make_info file is parsed one entry at a time (see
+    common.iter_json_entries()) with only/skip/cutoff applied on the fly, so
+    that uploading starts immediately and memory use does not grow with the
+    size of the batch. Any pre-flight check is then done in batches of
+    PREFLIGHT_BATCH files.
 
-    @param info_path: path to the make_info json file
+    @param info_path: path to the make_info json file (or the index of
+        sharded make_info output)
     @param cutoff: number of files to upload (defaults to all)
     @param target: sub-directory for log files (defaults to "upload_logs")
     @param file_exts: tuple of allowed file extensions (defaults to FILE_EXTS)
@@ -213,14 +599,27 @@ def up_all_from_url(info_path, cutoff=None, target='upload_logs',
         defaults to Commons.
     @param only: list of urls to upload, if provided all others will be skipped
     @param skip: list of urls to skip, all others will be uploaded
+    @param workers: number of upload requests to have in flight at the same
+        time (defaults to 1)
+    @param resume: skip any urls which the journal of a previous run records
+        as successfully uploaded or triggering a warning
+    @param max_retries: number of times to retry an upload after a transient
+        error (defaults to MAX_RETRIES)
+    @param check_existing: whether to check if the filenames are already in
+        use on the wiki before uploading. Set to "report" to only log these
+        or to "skip" to also treat them as warnings without uploading them.
+    @param rate_limiter: RateLimiter pacing the uploads (defaults to one
+        which only backs off when the wiki asks us to slow down)
+    @param stream: whether to stream the make_info file instead of loading
+        it into memory
     """
     # set defaults unless overridden
     file_exts = file_exts or FILE_EXTS
     target_site = target_site or pywikibot.Site('commons', 'commons')
     target_site.login()
-
-    # load info file
-    info_datas = common.open_and_read_file(info_path, as_json=True)
+    rate_limiter = rate_limiter or RateLimiter()
+    only = set(only) if only else None
+    skip = set(skip) if skip else set()
 
     # create target directory if it doesn't exist
     output_dir = os.path.join(os.path.dirname(info_path), target)
@@ -237,70 +636,123 @@ def up_all_from_url(info_path, cutoff=None, target='upload_logs',
     # shortcut to the general/verbose logfile
     flog = logs['general']
 
-    # filtering based on entries in only/skip
-    kill_list = set()
-    if only:
-        kill_list |= set(info_datas.keys()) - set(only)  # difference
-    if skip:
-        kill_list |= set(info_datas.keys()) & set(skip)  # intersection
-    for key in kill_list:
-        del info_datas[key]
-    flog.write_w_timestamp('{} files remain to upload after filtering'.format(
-        len(info_datas)))
-
-    counter = 1
-    for url, data in info_datas.items():
-        if cutoff and counter > cutoff:
-            break
-
-        # verify that the file extension is ok
-        try:
-            ext = verify_url_file_extension(url, file_exts)
-        except common.MyError as e:
-            flog.write_w_timestamp(e)
-            continue
-
-        # verify that info and output filenames are provided
-        if not data['info']:
-            flog.write_w_timestamp(
-                '{url}: Found url missing the info field (at least)'.format(
-                    url=url))
-            continue
-        elif not data['filename']:
-            flog.write_w_timestamp(
-                '{url}: Found url missing the output filename'.format(
-                    url=url))
-            continue
-
-        # prepare upload
-        txt = make_info_page(data)
-        filename = '{filename}{ext}'.format(filename=data['filename'], ext=ext)
-
-        if test:
-            pywikibot.output(
-                'Test upload "{filename}" from "{url}" with the following '
-                'description:\n{txt}\n'.format(
-                    filename=filename, url=url, txt=txt))
+    journal = UploadJournal(output_dir)
+    metrics = UploadMetrics(output_dir)
+
+    # load info file, filtering based on entries in only/skip
+    def filtered(entries):
+        """Yield the (url, data) entries not removed by only/skip."""
+        for url, data in entries:
+            if (only is None or url in only) and url not in skip:
+                yield url, data
+
+    if stream:
+        info_datas = filtered(common.iter_json_entries(info_path))
+        flog.write_w_timestamp('Streaming files to upload from {}'.format(
+            info_path))
+    else:
+        info_datas = list(filtered(
+            common.open_json_object(info_path).items()))
+        flog.write_w_timestamp(
+            '{} files remain to upload after filtering'.format(
+                len(info_datas)))
+
+    def upload_jobs():
+        """Yield the (url, filename, description) of each file to upload."""
+        counter = 1
+        for url, data in info_datas:
+            if cutoff and counter > cutoff:
+                break
+            if resume and journal.is_completed(url):
+                continue
+
+            # verify that the file extension is ok
+            try:
+                ext = verify_url_file_extension(url, file_exts)
+            except common.MyError as e:
+                flog.write_w_timestamp(e)
+                continue
+
+            # verify that info and output filenames are provided
+            if not data['info']:
+                flog.write_w_timestamp(
+                    '{url}: Found url missing the info field '
+                    '(at least)'.format(url=url))
+                continue
+            elif not data['filename']:
+                flog.write_w_timestamp(
+                    '{url}: Found url missing the output filename'.format(
+                        url=url))
+                continue
+
+            # prepare upload
+            txt = make_info_page(data)
+            filename = '{filename}{ext}'.format(
+                filename=data['filename'], ext=ext)
+
+            # stop here if testing
+            if test:
+                pywikibot.output(
+                    'Test upload "{filename}" from "{url}" with the following '
+                    'description:\n{txt}\n'.format(
+                        filename=filename, url=url, txt=txt))
+                counter += 1
+                continue
+
+            journal.record(url, 'pending')
+            yield url, filename, txt
             counter += 1
-            continue
-        # stop here if testing
 
-        result = upload_single_file(
-            filename, url, txt, target_site, upload_if_badprefix=True)
+    # pre-flight check against the wiki, done lazily as the jobs are consumed
+    existing = set()
+
+    def checked_jobs(jobs):
+        """Check the jobs against the wiki in batches before yielding them."""
+        for batch in common.iter_batches(
+                jobs, PREFLIGHT_BATCH if stream else None):
+            found = find_existing([job[1] for job in batch], target_site)
+            report_existing(found, flog)
+            existing.update(found)
+            for job in batch:
+                yield job
+
+    jobs = upload_jobs()
+    if check_existing:
+        jobs = checked_jobs(jobs)
+
+    def upload(job):
+        """Upload a single file by url."""
+        url, filename, txt = job
+        if check_existing == 'skip' and filename in existing:
+            return skipped_upload_result(
+                filename, 'filename already in use (found before upload)',
+                'exists')
+        journal.record(url, 'in-flight')
+        return upload_single_file(
+            filename, url, txt, get_worker_site(target_site, workers),
+            upload_if_badprefix=True, max_retries=max_retries,
+            rate_limiter=rate_limiter)
+
+    for (url, filename, txt), result in run_jobs(upload, jobs, workers):
         if result.get('error'):
             logs['error'].write(url)
+            journal.record(url, 'error')
         elif result.get('warning'):
             logs['warning'].write(url)
+            journal.record(url, 'warning')
         else:
             logs['success'].write(url)
+            journal.record(url, 'done')
         if verbose:
             pywikibot.output(result.get('log'))
 
         flog.write_w_timestamp(result.get('log'))
-        counter += 1
+        metrics.record(result)
 
     for log in logs.values():
         pywikibot.output(log.close_and_confirm())
+    pywikibot.output(journal.close_and_confirm())
+    pywikibot.output(metrics.close_and_confirm())
 
 
 def verify_url_file_extension(url, file_exts, url_protocols=None):
@@ -340,6 +792,434 @@ def verify_url_file_extension(url, file_exts, url_protocols=None):
     return ext
 
 
+class AdaptiveChunkSize(object):
+    """
+    Pick the chunk size for each upload based on the measured throughput.
+
+    The transfer rate is measured over previous successful uploads and the
+    chunk size is set so that a chunk is expected to take target_time seconds
+    to transfer, at most doubling at a time. The chunk size is halved after an
+    upload failing due to a timeout or lost connection (see
+    is_network_error()), other errors being unrelated to the chunk size.
+    Very large files get larger chunks so as not to exceed max_chunks
+    chunks. All sizes are in MB and are kept within the bounds.
+
+    Pywikibot offers no way of observing the individual chunks so the
+    measurements are made per file.
+    """
+
+    def __init__(self, initial=5, minimum=1, maximum=50, target_time=10,
+                 max_chunks=100):
+        """
+        Initialise the AdaptiveChunkSize.
+
+        @param initial: the chunk size to use for the first upload
+        @param minimum: the smallest allowed chunk size
+        @param maximum: the largest allowed chunk size, must be well below
+            the max size of a non-chunked upload on the wiki
+        @param target_time: the desired transfer time (in seconds) per chunk
+        @param max_chunks: the desired maximum number of chunks per file
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_time = target_time
+        self.max_chunks = max_chunks
+        self.chunk_size = self.bound(initial)
+        self.rate = None  # the weighted average transfer rate in MB/s
+        self.lock = threading.Lock()
+
+    def bound(self, chunk_size):
+        """Return the chunk size adjusted to the allowed bounds."""
+        return max(self.minimum, min(self.maximum, chunk_size))
+
+    def for_file(self, file_size):
+        """
+        Return the chunk size to use for a file.
+
+        @param file_size: the size of the file in bytes
+        @return: float
+        """
+        with self.lock:
+            chunk_size = self.chunk_size
+        file_size = file_size / 1048576.0
+        return self.bound(max(chunk_size, file_size / self.max_chunks))
+
+    def update(self, file_size, seconds, success):
+        """
+        Adjust the chunk size based on the outcome of an upload.
+
+        @param file_size: the size of the uploaded file in bytes
+        @param seconds: the time the upload took
+        @param success: whether the upload succeeded
+        """
+        with self.lock:
+            if not success:
+                self.chunk_size = self.bound(self.chunk_size / 2.0)
+                return
+            if seconds <= 0:
+                return
+            rate = file_size / 1048576.0 / seconds
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate = 0.7 * self.rate + 0.3 * rate
+            self.chunk_size = self.bound(
+                min(self.rate * self.target_time, 2 * self.chunk_size))
+
+
+class TokenBucket(object):
+    """
+    A token bucket refilled at a constant rate.
+
+    A request for more tokens than the capacity is allowed once the bucket is
+    full, leaving it in debt, so that large requests are paced correctly on
+    average. Not thread safe, see RateLimiter.
+    """
+
+    def __init__(self, rate, capacity, now):
+        """
+        Initialise a full TokenBucket.
+
+        @param rate: the number of tokens added per second
+        @param capacity: the maximum number of tokens in the bucket
+        @param now: the current time
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now, factor=1.0):
+        """Add the tokens accumulated since the last refill."""
+        elapsed = max(0, now - self.updated)
+        self.tokens = min(
+            self.capacity, self.tokens + elapsed * self.rate * factor)
+        self.updated = now
+
+    def wait_time(self, amount, factor=1.0):
+        """Return the seconds to wait before amount tokens can be taken."""
+        missing = min(amount, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0
+        return missing / (self.rate * factor)
+
+
+class RateLimiter(object):
+    """
+    Pace the uploads of all workers to a sustainable rate.
+
+    Token buckets limit the number of uploads per minute and the number of
+    bytes sent per second. Whenever the wiki signals that it is overloaded
+    (see THROTTLE_ERRORS) all uploads are paused and the allowed rates are
+    halved, after which they are slowly restored with each successful
+    upload. Without any configured limits only the pausing applies.
+
+    A single RateLimiter is meant to be shared between all worker threads.
+    """
+
+    def __init__(self, uploads_per_minute=None, bytes_per_second=None,
+                 burst=1, pause=RETRY_DELAY, min_factor=1 / 16.0,
+                 recovery=0.1):
+        """
+        Initialise a RateLimiter.
+
+        @param uploads_per_minute: max number of uploads started per minute
+            (defaults to unlimited)
+        @param bytes_per_second: max number of bytes sent per second
+            (defaults to unlimited). Uploads by url count as 0 bytes.
+        @param burst: number of uploads which may be started back to back
+        @param pause: seconds to pause all uploads after being throttled,
+            unless the wiki reports how long to wait
+        @param min_factor: the lowest fraction of the configured rates to
+            back off to
+        @param recovery: fraction of the configured rates recovered after
+            each successful upload
+        """
+        now = time.time()
+        self.buckets = {}
+        if uploads_per_minute:
+            self.buckets['uploads'] = TokenBucket(
+                uploads_per_minute / 60.0, max(1, burst), now)
+        if bytes_per_second:
+            self.buckets['bytes'] = TokenBucket(
+                bytes_per_second, bytes_per_second, now)
+        self.pause = pause
+        self.min_factor = min_factor
+        self.recovery = recovery
+        self.factor = 1.0  # fraction of the configured rates currently used
+        self.paused_until = now
+        self.lock = threading.Lock()
+
+    def acquire(self, num_bytes=0):
+        """
+        Block until an upload of the given size may be started.
+
+        @param num_bytes: the size of the upload in bytes
+        @return: the number of seconds waited
+        """
+        requested = {'uploads': 1, 'bytes': num_bytes}
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.time()
+                wait = self.paused_until - now
+                for name, bucket in self.buckets.items():
+                    bucket.refill(now, self.factor)
+                    wait = max(wait, bucket.wait_time(
+                        requested[name], self.factor))
+                if wait <= 0:
+                    for name, bucket in self.buckets.items():
+                        bucket.tokens -= requested[name]
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self, delay=None):
+        """
+        Back off after the wiki asked us to slow down.
+
+        @param delay: seconds to pause all uploads (defaults to self.pause)
+        """
+        with self.lock:
+            self.factor = max(self.min_factor, self.factor / 2.0)
+            self.paused_until = max(
+                self.paused_until, time.time() + (delay or self.pause))
+
+    def reward(self):
+        """Speed up again after a successful upload."""
+        with self.lock:
+            self.factor = min(1.0, self.factor + self.recovery)
+
+    def update(self, error):
+        """
+        Adjust the pace based on the outcome of an upload.
+
+        @param error: the error (exception or str) of the upload, if any
+        """
+        if not error:
+            self.reward()
+        elif isinstance(error, pywikibot.data.api.APIError) and \
+                error.code in THROTTLE_ERRORS:
+            # maxlag errors report the current lag, in seconds
+            try:
+                delay = float(error.other.get('lag'))
+            except (TypeError, ValueError):
+                delay = None
+            self.penalize(delay)
+
+
+class UploadJournal(object):
+    """
+    An append-only journal of the upload state of each entry in a batch.
+
+    Each state change is stored as a json line and synced to disk before
+    returning, so that the journal survives a crash. When loading an existing
+    journal the last recorded state of each key wins and any partially written
+    line is ignored.
+    """
+
+    STATES = ('pending', 'in-flight', 'done', 'warning', 'error')
+    COMPLETED = ('done', 'warning')
+
+    def __init__(self, output_dir, name='journal.jsonl'):
+        """
+        Initialise the UploadJournal, loading any previously recorded states.
+
+        @param output_dir: directory in which to store the journal
+        @param name: the filename including extension
+        """
+        self.file_name = os.path.join(output_dir, name)
+        self.states = UploadJournal.load(self.file_name)
+        self.file = open(self.file_name, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+        # terminate any partially written line from an interrupted run
+        with open(self.file_name, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    @staticmethod
+    def load(file_name):
+        """
+        Load the last recorded state of each key in a journal file.
+
+        @param file_name: path to the journal file
+        @return: dict of {key: state}
+        """
+        states = {}
+        if not os.path.exists(file_name):
+            return states
+        with open(file_name, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    states[entry['key']] = entry['state']
+                except (ValueError, KeyError, TypeError):
+                    # partially written line from an interrupted run
+                    continue
+        return states
+
+    def record(self, key, state):
+        """
+        Record a new state for a key.
+
+        @param key: the key (e.g. url) of the entry
+        @param state: one of UploadJournal.STATES
+        """
+        if state not in UploadJournal.STATES:
+            raise common.MyError(
+                '{0} is not a recognised journal state'.format(state))
+        line = json.dumps(
+            {'key': key, 'state': state,
+             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')},
+            ensure_ascii=False)
+        with self.lock:
+            self.file.write('{0}\n'.format(line))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.states[key] = state
+
+    def is_completed(self, key):
+        """
+        Check whether a key has previously been uploaded (or warned about).
+
+        @param key: the key (e.g. url) of the entry
+        @return: bool
+        """
+        return self.states.get(key) in UploadJournal.COMPLETED
+
+    def close_and_confirm(self):
+        """Close the journal file and return a confirmation."""
+        self.file.close()
+        return 'Created {0}'.format(self.file_name)
+
+
+class UploadMetrics(object):
+    """
+    Collect the metrics of each upload in a run and summarise them.
+
+    The metrics of each upload (see upload_single_file()) are written as a
+    json line, tagged with "type": "upload", as soon as they are recorded.
+    When closing, a summary of the run (throughput, latency percentiles and
+    a histogram of the error/warning codes) is appended as a final line
+    tagged with "type": "summary".
+    """
+
+    OUTCOMES = ('success', 'warning', 'error', 'skipped')
+
+    def __init__(self, output_dir, name='metrics.jsonl'):
+        """
+        Initialise the UploadMetrics, starting the clock of the run.
+
+        @param output_dir: directory in which to store the metrics
+        @param name: the filename including extension
+        """
+        self.file_name = os.path.join(output_dir, name)
+        self.file = open(self.file_name, 'a', encoding='utf-8')
+        self.start = time.time()
+        self.outcomes = dict((outcome, 0) for outcome in self.OUTCOMES)
+        self.codes = {}
+        self.latencies = []
+        self.bytes = 0
+        self.retries = 0
+
+    def record(self, result):
+        """
+        Record the metrics of a single upload.
+
+        @param result: the output of upload_single_file()
+        """
+        metrics = dict(result.get('metrics') or {})
+        if metrics.get('skipped'):
+            outcome = 'skipped'
+        elif result.get('error'):
+            outcome = 'error'
+        elif result.get('warning'):
+            outcome = 'warning'
+        else:
+            outcome = 'success'
+        metrics.update(
+            type='upload', outcome=outcome,
+            timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self.write(metrics)
+
+        self.outcomes[outcome] += 1
+        if metrics.get('code'):
+            common.add_or_increment(self.codes, metrics['code'])
+        if outcome == 'skipped':
+            return
+        if metrics.get('total') is not None:
+            self.latencies.append(metrics['total'])
+        if outcome == 'success':
+            self.bytes += metrics.get('bytes') or 0
+        self.retries += max(0, (metrics.get('attempts') or 1) - 1)
+
+    def write(self, data):
+        """Write a dict as a json line."""
+        self.file.write('{0}\n'.format(
+            json.dumps(data, ensure_ascii=False, sort_keys=True)))
+        self.file.flush()
+
+    def summary(self):
+        """
+        Summarise the metrics recorded so far.
+
+        Throughput only counts files which were actually uploaded and
+        latencies only files which were attempted.
+
+        @return: dict
+        """
+        seconds = time.time() - self.start
+        uploaded = self.outcomes['success']
+        summary = {
+            'type': 'summary',
+            'files': sum(self.outcomes.values()),
+            'seconds': seconds,
+            'bytes': self.bytes,
+            'retries': self.retries,
+            'files_per_sec': uploaded / seconds if seconds else None,
+            'mb_per_sec': (self.bytes / 1048576.0 / seconds
+                           if seconds else None),
+            'latency_p50': common.percentile(self.latencies, 50),
+            'latency_p95': common.percentile(self.latencies, 95),
+            'latency_max': max(self.latencies) if self.latencies else None,
+            'codes': dict(self.codes),
+        }
+        summary.update(self.outcomes)
+        return summary
+
+    @staticmethod
+    def format_summary(summary):
+        """Return a human readable version of a summary."""
+        text = (
+            '{files} files processed in {seconds:.1f} s: {success} uploaded, '
+            '{warning} warnings, {error} errors, {skipped} skipped, '
+            '{retries} retries.'.format(**summary))
+        if summary['success']:
+            text += ' Throughput: {files_per_sec:.2f} files/s, ' \
+                    '{mb_per_sec:.2f} MB/s.'.format(**summary)
+        if summary['latency_p50'] is not None:
+            text += ' Latency: p50 {latency_p50:.2f} s, ' \
+                    'p95 {latency_p95:.2f} s, ' \
+                    'max {latency_max:.2f} s.'.format(**summary)
+        if summary['codes']:
+            text += ' Codes: {0}.'.format(', '.join(
+                '{0} ({1})'.format(code, num) for code, num in
+                common.sorted_dict(summary['codes'])))
+        return text
+
+    def close_and_confirm(self):
+        """Write the summary, close the file and return a confirmation."""
+        summary = self.summary()
+        self.write(summary)
+        self.file.close()
+        return '{0}\nCreated {1}'.format(
+            UploadMetrics.format_summary(summary), self.file_name)
+
+
 def main(*args):
     """Command line entry-point."""
     usage = (
@@ -357,8 +1237,32 @@ def main(*args):
         'attempt (optional)\n'
         '\t-test Whether to do mock upload, simply outputting to commandline. '
         '(optional)\n'
+        '\t-skip_duplicates Whether to compare the file hashes to those on '
+        'the wiki before uploading, skipping any duplicates '
+        '(optional, type:FILES only)\n'
+        '\t-check_existing:STRING Whether to check if the target filenames '
+        'are already in use on the wiki before uploading. Must be either '
+        '"report" (only log these) or "skip" (also skip these) (optional)\n'
+        '\t-adaptive_chunks Whether to adapt the chunk size to the measured '
+        'upload speed (optional, type:FILES only)\n'
+        '\t-chunk_size:MB size of the chunks in which to upload files. '
+        'Defaults to 5 (optional, type:FILES only)\n'
         '\t-nochunk Whether to turn off chunked uploading, this is slow '
         'and does not support files > 100Mb (optional, type:FILES only)\n'
+        '\t-workers:NUM number of files to upload in parallel, each worker '
+        'using its own session. Defaults to 1 (optional)\n'
+        '\t-uploads_per_minute:NUM max number of uploads to start per '
+        'minute, across all workers (optional)\n'
+        '\t-bytes_per_second:NUM max number of bytes to upload per second, '
+        'across all workers (optional, type:FILES only)\n'
+        '\t-retries:NUM number of times to retry an upload after a '
+        'transient error. Defaults to 3 (optional)\n'
+        '\t-resume Whether to skip any urls which were uploaded (or gave a '
+        'warning) in a previous run, as recorded in the upload journal '
+        '(optional, type:URL only)\n'
+        '\t-stream Whether to parse the make_info file one entry at a time '
+        'instead of loading it into memory, for very large batches '
+        '(optional, type:URL only)\n'
         '\t-only:PATH to file containing list of urls to upload, skipping all '
         'others. One entry per line. (optional, type:URL only)\n'
         '\t-skip:PATH to file containing list of urls to skip, uploading all '
@@ -373,9 +1277,19 @@ def main(*args):
     test = False
     confirm = False
     chunked = True
+    chunk_size = 5
+    adaptive_chunks = False
+    skip_duplicates = False
+    check_existing = None
+    workers = 1
+    max_retries = MAX_RETRIES
+    uploads_per_minute = None
+    bytes_per_second = None
     typ = 'files'
     only = None
     skip = None
+    resume = False
+    stream = False
 
     # Load pywikibot args and handle local args
     for arg in pywikibot.handle_args(args):
@@ -391,12 +1305,43 @@ def main(*args):
             confirm = True
         elif option == '-nochunk':
             chunked = False
+        elif option == '-chunk_size':
+            if not common.is_pos_number(value):
+                pywikibot.output(usage)
+                return
+            chunk_size = float(value)
+        elif option == '-adaptive_chunks':
+            adaptive_chunks = True
+        elif option == '-skip_duplicates':
+            skip_duplicates = True
+        elif option == '-check_existing':
+            if value.lower() in ('report', 'skip'):
+                check_existing = value.lower()
+            else:
+                pywikibot.output(usage)
+                return
+        elif option == '-workers':
+            if common.is_pos_int(value):
+                workers = int(value)
+        elif option == '-uploads_per_minute':
+            if common.is_pos_int(value):
+                uploads_per_minute = int(value)
+        elif option == '-bytes_per_second':
+            if common.is_pos_int(value):
+                bytes_per_second = int(value)
+        elif option == '-retries':
+            if common.is_int(value) and int(value) >= 0:
+                max_retries = int(value)
         elif option == '-type':
             if value.lower() == 'url':
                 typ = 'url'
             elif value.lower() not in ('url', 'files'):
                 pywikibot.output(usage)
                 return
+        elif option == '-resume':
+            resume = True
+        elif option == '-stream':
+            stream = True
         elif option == '-only':
             only = common.trim_list(
                 common.open_and_read_file(value).split('\n'))
@@ -408,12 +1353,21 @@ def main(*args):
             return
 
     if in_path:
+        rate_limiter = RateLimiter(uploads_per_minute=uploads_per_minute,
+                                   bytes_per_second=bytes_per_second)
         if typ == 'files':
             up_all(in_path, cutoff=cutoff, test=test, verbose=confirm,
-                   chunked=chunked)
+                   chunked=chunked, workers=workers, max_retries=max_retries,
+                   skip_duplicates=skip_duplicates,
+                   check_existing=check_existing,
+                   adaptive_chunks=adaptive_chunks, chunk_size=chunk_size,
+                   rate_limiter=rate_limiter)
         elif typ == 'url':
             up_all_from_url(in_path, cutoff=cutoff, only=only, skip=skip,
-                            test=test, verbose=confirm)
+                            test=test, verbose=confirm, workers=workers,
+                            resume=resume, max_retries=max_retries,
+                            check_existing=check_existing,
+                            rate_limiter=rate_limiter, stream=stream)
     else:
         pywikibot.output(usage)
 
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Micro-benchmark of helpers.cleanString.
+
+Compares the current cleanString (using the precompiled replacements of a
+helpers.StringCleaner) against the original implementation, which rebuilt
+its replacements and ran every str.replace on each call, on a synthetic set
+of strings resembling the descriptions, institutions and idnos of a batch.
+The output of the two is also verified to be identical.
+
+Usage:
+    python benchmarks/clean_string_benchmark.py -strings:1000000
+"""
+from __future__ import unicode_literals
+import random
+import sys
+import time
+
+from pywikibot_sandbox import pywikibot_sandbox
+
+WORDS = (
+    'Porträtt', 'av', 'okänd', 'man', 'Stockholm', 'SMM', 'SMVK-EM-0012',
+    '1920-tal', 'med', 'flagga', 'Ateljé', 'Vasa')
+BAD_WORDS = (
+    'e´', 'foto:s', 'Skepp: "Vasa"', '[kopia]', '{utkast}', 'a/b', 'nr#12',
+    'A|B', '“citat”', 'kl. 12:30', 'Ateljé\x8fNN', '\tmed\n')
+
+
+def make_strings(num, seed=0, bad_ratio=0.1):
+    """
+    Create a list of synthetic strings to clean.
+
+    @param num: number of strings
+    @param seed: seed for the random generator
+    @param bad_ratio: share of the words which contain characters which
+        must be replaced
+    @return: list of str
+    """
+    rand = random.Random(seed)
+
+    def word():
+        return rand.choice(BAD_WORDS if rand.random() < bad_ratio else WORDS)
+
+    return [' '.join(word() for i in range(rand.randint(1, 8)))
+            for j in range(num)]
+
+
+def time_function(function, strings):
+    """Return the seconds taken to run function on each of the strings."""
+    start = time.time()
+    for text in strings:
+        function(text)
+    return time.time() - start
+
+
+def main(*args):
+    """Command line entry-point."""
+    usage = (
+        'Usage:'
+        '\tpython benchmarks/clean_string_benchmark.py -strings:NUM\n'
+        '\t-strings:NUM number of strings to clean. Defaults to 1000000 '
+        '(optional)\n'
+        '\t-seed:NUM seed used when generating the strings. Defaults to 0 '
+        '(optional)\n'
+        '\t-bad_ratio:FLOAT share of words containing characters which must '
+        'be replaced. Defaults to 0.1 (optional)\n'
+    )
+    num = 1000000
+    seed = 0
+    bad_ratio = 0.1
+    try:
+        for arg in args:
+            option, sep, value = arg.partition(':')
+            if option == '-strings':
+                num = int(value)
+            elif option == '-seed':
+                seed = int(value)
+            elif option == '-bad_ratio':
+                bad_ratio = float(value)
+            else:
+                print(usage)
+                return
+    except ValueError:
+        print(usage)
+        return
+
+    # pywikibot, imported by batchupload, must neither use nor modify the
+    # user's own configuration
+    with pywikibot_sandbox('clean_string_benchmark_config_'):
+        run(num, seed, bad_ratio)
+
+
+def run(num, seed, bad_ratio):
+    """
+    Verify and time cleanString against the original implementation.
+
+    @param num: number of strings
+    @param seed: seed for the random generator
+    @param bad_ratio: share of the words which contain characters which
+        must be replaced
+    """
+    from batchupload.helpers import cleanString
+    from legacy import legacy_clean_string
+
+    strings = make_strings(num, seed, bad_ratio)
+    mismatches = [text for text in strings
+                  if cleanString(text) != legacy_clean_string(text)]
+    if mismatches:
+        print('Output differs for {0} strings, e.g. {1!r}'.format(
+            len(mismatches), mismatches[0]))
+
+    legacy_time = time_function(legacy_clean_string, strings)
+    compiled_time = time_function(cleanString, strings)
+    for name, seconds in (('legacy', legacy_time),
+                          ('compiled', compiled_time)):
+        print('{0:>8}: {1:.2f} s ({2:.2f} us/string)'.format(
+            name, seconds, seconds * 1e6 / num))
+    print(' speedup: {0:.2f}x'.format(legacy_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
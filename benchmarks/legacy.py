@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+The original implementations used as the baselines of the benchmarks.
+
+Imports batchupload, so must only be imported once pywikibot has been
+isolated from the user's own configuration, see pywikibot_sandbox.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+
+from batchupload.helpers import isoDate
+
+
+def legacy_clean_string(text):
+    """The original cleanString(), running every replacement in turn."""
+    # bad characters  - extend as more are identified
+    bad_char = {'\\': '-', '/': '-', '|': '-', '#': '-',
+                '[': '(', ']': ')', '{': '(', '}': ')',
+                ':s': 's', ': ': ', ',
+                'e´': 'é',
+                '”': ' ', '"': ' ', '“': ' '}
+
+    # whitespace characters not handled by .split()
+    unusual_whitespace = ['\x8f', ]
+    for w in unusual_whitespace:
+        bad_char[w] = ' '  # replace by normal space
+
+    # replace all normal white space characters by space
+    text = ' '.join(text.split())
+
+    for k, v in bad_char.items():
+        text = text.replace(k, v)
+
+    # replace any remaining colons
+    if ':' in text:
+        text = text.replace(':', '-')
+
+    # replace double space by single space
+    text = text.replace('  ', ' ')
+    return text.strip()
+
+
+def legacy_std_date(date):
+    """The original stdDate(), trying each rule in turn."""
+    date = date.strip('.  ')
+    if len(date) == 0 or date.lower() in ('n.d', 'odaterad'):
+        return ''
+    date = date.replace(' - ', '-')
+    endings = OrderedDict([
+        ('?', '?'), ('(?)', '?'), ('c', 'ca'), ('ca', 'ca'),
+        ('cirka', 'ca'), ('andra hälft', '2half'),
+        ('första hälft', '1half'), ('början', 'early'), ('slut', 'end'),
+        ('slutet', 'end'), ('mitt', 'mid'),
+        ('första fjärdedel', '1quarter'), ('andra fjärdedel', '2quarter'),
+        ('tredje fjärdedel', '3quarter'), ('fjärde fjärdedel', '4quarter'),
+        ('sista fjärdedel', '4quarter'), ('före', '<'), ('efter', '>'),
+        ('-', '>')])
+    starts = OrderedDict([
+        ('tidigt', 'early'), ('br av', 'early'), ('början av', 'early'),
+        ('tid ', 'early'), ('sent', 'late'), ('sl av', 'late'),
+        ('slutet av', 'end'), ('andra hälften av', '2half'),
+        ('första hälften av', '1half'), ('mitten av', 'mid'),
+        ('första fjärdedel av', '1quarter'),
+        ('andra fjärdedel av', '2quarter'),
+        ('tredje fjärdedel av', '3quarter'),
+        ('fjärde fjärdedel av', '4quarter'),
+        ('sista fjärdedel av', '4quarter'), ('ca', 'ca'),
+        ('våren', 'spring'), ('sommaren', 'summer'), ('hösten', 'fall'),
+        ('vintern', 'winter'), ('sekelskiftet', 'turn of the century'),
+        ('före', '<'), ('efter', '>'), ('-', '<')])
+    tal_endings = ('-talets', '-tal', '-talet', ' talets')
+    modality = ('troligen', 'sannolikt', 'trol.')
+    for k, v in starts.items():
+        if date.lower().startswith(k):
+            again = legacy_std_date(date[len(k):])
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    for k, v in endings.items():
+        if date.lower().endswith(k):
+            again = legacy_std_date(date[:-len(k)])
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    for k in modality:
+        found = False
+        if date.lower().endswith(k):
+            date = date[:-len(k)].strip('.,  ')
+            found = True
+        elif date.lower().startswith(k):
+            date = date[len(k):].strip('.,  ')
+            found = True
+        if found:
+            again = legacy_std_date(date)
+            if again:
+                return '%s {{Probably}}' % again
+            else:
+                return None
+    for k in tal_endings:
+        if date.lower().endswith(k):
+            date = date[:-len(k)].strip('.  ')
+            if date[-2:] == '00':
+                v = 'century'
+                if len(date) == 4:
+                    return '{{other date|%s|%r}}' % (v, int(date[:2]) + 1)
+                else:
+                    return None
+            else:
+                v = 'decade'
+            again = legacy_std_date(date)
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    return isoDate(date)
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Isolation of the benchmarks from the user's own pywikibot configuration.
+
+Importing batchupload imports pywikibot, which reads its configuration and
+writes e.g. its cookie file (pywikibot.lwp), throttle.ctrl and api cache to
+its base directory, by default the current directory. The benchmarks
+instead point it to a temporary directory, which must be done before
+batchupload is first imported.
+"""
+from __future__ import unicode_literals
+from builtins import open
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+
+
+@contextmanager
+def pywikibot_sandbox(prefix='benchmark_config_'):
+    """
+    Let pywikibot use an empty, temporary, base directory.
+
+    @param prefix: prefix of the name of the temporary directory
+    @return: context manager yielding the path to the directory
+    """
+    config_dir = tempfile.mkdtemp(prefix=prefix)
+    # PYWIKIBOT_DIR is only used if it contains a user-config.py, which is
+    # then not loaded as long as PYWIKIBOT2_NO_USER_CONFIG is set
+    open(os.path.join(config_dir, 'user-config.py'), 'w').close()
+    os.environ['PYWIKIBOT_DIR'] = config_dir
+    os.environ['PYWIKIBOT2_NO_USER_CONFIG'] = '1'
+    try:
+        yield config_dir
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
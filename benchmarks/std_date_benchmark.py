@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Micro-benchmark of helpers.stdDate.
+
+Compares the current stdDate (compiled rules and a memo of earlier results)
+against the original implementation, which tried each rule in turn, on a
+synthetic set of dates where, as in museum data, a limited number of
+distinct dates is repeated across the records. The output of the two is
+also verified to be identical.
+
+Usage:
+    python benchmarks/std_date_benchmark.py -dates:1000000 -distinct:5000
+"""
+from __future__ import unicode_literals
+import random
+import sys
+import time
+
+from pywikibot_sandbox import pywikibot_sandbox
+
+PREFIXES = ('', '', '', 'ca ', 'början av ', 'före ', 'sommaren ', 'trol. ')
+SUFFIXES = ('', '', '', '?', ' (?)', '-talet', ' troligen', ' - ')
+
+
+def make_dates(num, distinct, seed=0):
+    """
+    Create a list of synthetic dates to standardise.
+
+    @param num: number of dates
+    @param distinct: (maximum) number of distinct dates
+    @param seed: seed for the random generator
+    @return: list of str
+    """
+    rand = random.Random(seed)
+
+    def date():
+        value = str(rand.randint(1850, 1999))
+        if rand.random() < 0.5:
+            value += '-{0:02d}'.format(rand.randint(1, 12))
+            if rand.random() < 0.5:
+                value += '-{0:02d}'.format(rand.randint(1, 28))
+        return rand.choice(PREFIXES) + value + rand.choice(SUFFIXES)
+
+    pool = [date() for i in range(distinct)]
+    return [rand.choice(pool) for j in range(num)]
+
+
+def time_function(function, dates):
+    """Return the seconds taken to run function on each of the dates."""
+    start = time.time()
+    for date in dates:
+        function(date)
+    return time.time() - start
+
+
+def main(*args):
+    """Command line entry-point."""
+    usage = (
+        'Usage:'
+        '\tpython benchmarks/std_date_benchmark.py -dates:NUM\n'
+        '\t-dates:NUM number of dates to standardise. Defaults to 1000000 '
+        '(optional)\n'
+        '\t-distinct:NUM number of distinct dates. Defaults to 5000 '
+        '(optional)\n'
+        '\t-seed:NUM seed used when generating the dates. Defaults to 0 '
+        '(optional)\n'
+    )
+    num = 1000000
+    distinct = 5000
+    seed = 0
+    try:
+        for arg in args:
+            option, sep, value = arg.partition(':')
+            if option == '-dates':
+                num = int(value)
+            elif option == '-distinct':
+                distinct = int(value)
+            elif option == '-seed':
+                seed = int(value)
+            else:
+                print(usage)
+                return
+    except ValueError:
+        print(usage)
+        return
+
+    # pywikibot, imported by batchupload, must neither use nor modify the
+    # user's own configuration
+    with pywikibot_sandbox('std_date_benchmark_config_'):
+        run(num, distinct, seed)
+
+
+def run(num, distinct, seed):
+    """
+    Verify and time stdDate against the original implementation.
+
+    @param num: number of dates
+    @param distinct: (maximum) number of distinct dates
+    @param seed: seed for the random generator
+    """
+    from batchupload.helpers import date_memo, stdDate
+    from legacy import legacy_std_date
+
+    dates = make_dates(num, distinct, seed)
+    mismatches = [date for date in set(dates)
+                  if stdDate(date) != legacy_std_date(date)]
+    if mismatches:
+        print('Output differs for {0} dates, e.g. {1!r}'.format(
+            len(mismatches), mismatches[0]))
+
+    legacy_time = time_function(legacy_std_date, dates)
+    date_memo.clear()
+    compiled_time = time_function(stdDate, dates)
+    for name, seconds in (('legacy', legacy_time),
+                          ('compiled', compiled_time)):
+        print('{0:>8}: {1:.2f} s ({2:.2f} us/date)'.format(
+            name, seconds, seconds * 1e6 / num))
+    print(' speedup: {0:.2f}x'.format(legacy_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
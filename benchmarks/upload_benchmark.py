@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+End-to-end throughput benchmark of the upload pipeline.
+
+Generates a synthetic batch of media files and runs prepUpload.run followed
+by uploader.up_all (or, for url uploads, uploader.up_all_from_url on a
+make_info json file) against a local mock wiki (see batchupload.mock_api).
+This is done for each combination of the given worker counts and chunk
+sizes, reporting files/sec, MB/sec, the median and 95th percentile
+per-file upload latency and the peak memory use.
+
+Each configuration is run in a fresh process, against a freshly started
+mock wiki, so that the results (in particular the peak memory use) are
+independent of each other. Nothing is sent over the network.
+
+Usage:
+    python benchmarks/upload_benchmark.py -files:50 -size:2 -workers:1,4
+"""
+from __future__ import unicode_literals
+from builtins import open
+from multiprocessing import Process, Queue
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from batchupload.mock_api import FAMILY_NAME, MockServer, MockWiki, \
+    register_family
+from pywikibot_sandbox import pywikibot_sandbox
+
+USER = 'Benchmark user'
+DESCRIPTION = '{{Information\n|description=Benchmark file %s\n}}'
+
+
+def peak_rss():
+    """Return the peak resident memory of this process in MB (or None)."""
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes rather than kB
+        peak /= 1024.0
+    return peak / 1024.0
+
+
+def make_batch(work_dir, num_files, size, url=False):
+    """
+    Create a synthetic batch, as output by make_info, and its media files.
+
+    The media files are filled with random data so that they are never
+    duplicates of each other.
+
+    @param work_dir: directory in which to create the batch
+    @param num_files: number of media files in the batch
+    @param size: size of each media file (in MB)
+    @param url: whether the batch should be uploaded by url, in which case no
+        media files are created
+    @return: path to the make_info json file
+    """
+    in_path = os.path.join(work_dir, 'in')
+    os.mkdir(in_path)
+    data = {}
+    for i in range(num_files):
+        key = 'raw_{0:05d}'.format(i)
+        if url:
+            key = 'http://example.org/benchmark/{0}.jpg'.format(key)
+        data[key] = {
+            'filename': 'Benchmark file {0:05d}'.format(i),
+            'info': DESCRIPTION % i,
+            'cats': [], 'meta_cats': []}
+        if not url:
+            write_random_file(
+                os.path.join(in_path, '{0}.jpg'.format(key)), size)
+    data_path = os.path.join(work_dir, 'data.json')
+    with open(data_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, ensure_ascii=False))
+    return data_path
+
+
+def write_random_file(filename, size):
+    """Write a file of the given size (in MB) filled with random data."""
+    remaining = int(size * 1048576)
+    with open(filename, 'wb') as f:
+        while remaining > 0:
+            block = min(remaining, 1048576)
+            f.write(os.urandom(block))
+            remaining -= block
+
+
+def configure_pywikibot(work_dir, port):
+    """
+    Point pywikibot to the mock wiki, logging in without any prompts.
+
+    Must be called in each benchmark process before a Site is created.
+
+    @param work_dir: directory in which to store the password file
+    @param port: the port on localhost where the MockServer is listening
+    @return: the logged in pywikibot.Site
+    """
+    register_family(port)
+    import pywikibot
+    from pywikibot import config2 as config
+
+    password_file = os.path.join(work_dir, 'passwords')
+    with open(password_file, 'w', encoding='utf-8') as f:
+        f.write("('{0}', 'benchmark')\n".format(USER))
+    os.chmod(password_file, 0o600)
+    config.password_file = password_file
+    config.usernames[FAMILY_NAME][FAMILY_NAME] = USER
+    config.put_throttle = 0
+    config.maxlag = 0
+
+    site = pywikibot.Site(FAMILY_NAME, FAMILY_NAME)
+    site.login()
+    return site
+
+
+def run_configuration(config, port, queue):
+    """
+    Run a single benchmark configuration and put the results on a queue.
+
+    Intended as the target of a separate process.
+
+    @param config: dict describing the configuration (see benchmark())
+    @param port: the port on localhost where the MockServer is listening
+    @param queue: multiprocessing.Queue on which to put the results
+    """
+    work_dir = tempfile.mkdtemp(prefix='upload_benchmark_', dir=config['dir'])
+    try:
+        site = configure_pywikibot(work_dir, port)
+        from batchupload.common import percentile
+        import batchupload.prepUpload as prepUpload
+        import batchupload.uploader as uploader
+
+        data_path = make_batch(work_dir, config['files'], config['size'],
+                               url=config['mode'] == 'url')
+
+        # time each upload, including any retries
+        latencies = []
+        outcomes = {'success': 0, 'warning': 0, 'error': 0}
+        upload_single_file = uploader.upload_single_file
+
+        def timed_upload(*args, **kwargs):
+            start = time.time()
+            result = upload_single_file(*args, **kwargs)
+            latencies.append(time.time() - start)
+            if result.get('error'):
+                outcomes['error'] += 1
+            elif result.get('warning'):
+                outcomes['warning'] += 1
+            else:
+                outcomes['success'] += 1
+            return result
+
+        uploader.upload_single_file = timed_upload
+
+        prep_time = None
+        if config['mode'] == 'url':
+            start = time.time()
+            uploader.up_all_from_url(
+                data_path, target_site=site, workers=config['workers'])
+        else:
+            start = time.time()
+            out_path = os.path.join(work_dir, 'out')
+            prepUpload.run(os.path.join(work_dir, 'in'), out_path, data_path)
+            prep_time = time.time() - start
+            start = time.time()
+            uploader.up_all(
+                out_path, target_site=site, workers=config['workers'],
+                chunk_size=config['chunk_size'],
+                adaptive_chunks=config['adaptive_chunks'])
+        upload_time = time.time() - start
+
+        uploaded = 0 if config['mode'] == 'url' else \
+            config['files'] * config['size']
+        results = dict(config)
+        results.update({
+            'prep_seconds': prep_time,
+            'upload_seconds': upload_time,
+            'files_per_sec': config['files'] / upload_time,
+            'mb_per_sec': uploaded / upload_time if uploaded else None,
+            'p50_latency': percentile(latencies, 50),
+            'p95_latency': percentile(latencies, 95),
+            'peak_rss_mb': peak_rss(),
+        })
+        results.update(outcomes)
+        queue.put(results)
+    except Exception as e:
+        queue.put({'exception': repr(e)})
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark(config):
+    """
+    Run a single benchmark configuration against a fresh mock wiki.
+
+    @param config: dict with the keys {mode, files, size, workers,
+        chunk_size, adaptive_chunks, latency, failure_rate, dir}
+    @return: dict of the configuration and its results
+    """
+    server = MockServer(MockWiki(latency=config['latency'],
+                                 failure_rate=config['failure_rate'],
+                                 failure_code='ratelimited', seed=0))
+    server_process = Process(target=server.serve_forever)
+    server_process.daemon = True
+    server_process.start()
+    server.server_close()  # only needed in the server process
+
+    queue = Queue()
+    client_process = Process(target=run_configuration,
+                             args=(config, server.port, queue))
+    client_process.start()
+    try:
+        results = queue.get()
+    finally:
+        client_process.join()
+        server_process.terminate()
+        server_process.join()
+    if 'exception' in results:
+        raise RuntimeError('Benchmark failed: {0}'.format(
+            results['exception']))
+    return results
+
+
+def format_results(results):
+    """Return the benchmark results as a plain text table."""
+    columns = (
+        ('mode', '{0}'), ('workers', '{0:d}'), ('chunk_size', '{0:g}'),
+        ('files', '{0:d}'), ('size', '{0:g}'), ('error', '{0:d}'),
+        ('files_per_sec', '{0:.2f}'), ('mb_per_sec', '{0:.2f}'),
+        ('p50_latency', '{0:.3f}'), ('p95_latency', '{0:.3f}'),
+        ('peak_rss_mb', '{0:.1f}'))
+    rows = [[name for name, _ in columns]]
+    for result in results:
+        rows.append([
+            '-' if result.get(name) is None else fmt.format(result[name])
+            for name, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in rows)
+
+
+def parse_list(value, cast):
+    """Parse a comma separated list of values."""
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def main(*args):
+    """Command line entry-point."""
+    usage = (
+        'Usage:'
+        '\tpython benchmarks/upload_benchmark.py -files:NUM -size:MB\n'
+        '\t-files:NUM number of files in the synthetic batch. Defaults to 20 '
+        '(optional)\n'
+        '\t-size:MB size of each synthetic file. Defaults to 1 (optional)\n'
+        '\t-mode:STRING the type of upload to benchmark. Must be either '
+        '"files", "url" or "both". Defaults to files (optional)\n'
+        '\t-workers:NUM[,NUM...] worker counts to benchmark. Defaults to 1 '
+        '(optional)\n'
+        '\t-chunk_size:MB[,MB...] chunk sizes to benchmark. Defaults to 5 '
+        '(optional, mode:files only)\n'
+        '\t-adaptive_chunks Whether to let the uploader adapt the chunk '
+        'size, starting from the given ones (optional, mode:files only)\n'
+        '\t-latency:SECONDS latency added by the mock wiki to each request. '
+        'Defaults to 0 (optional)\n'
+        '\t-failure_rate:FLOAT probability that an upload request fails '
+        'with a transient error. Defaults to 0 (optional)\n'
+        '\t-dir:PATH directory in which to create the synthetic batches. '
+        'Defaults to the system temporary directory (optional)\n'
+        '\t-out:PATH file to which to also write the results as json '
+        '(optional)\n'
+        '\tExample:\n'
+        '\tpython benchmarks/upload_benchmark.py -files:50 -size:2 '
+        '-workers:1,2,4 -chunk_size:1,5 -latency:0.05\n'
+    )
+    options = {
+        'files': 20, 'size': 1, 'latency': 0, 'failure_rate': 0,
+        'adaptive_chunks': False, 'dir': None}
+    modes = ['files']
+    workers = [1]
+    chunk_sizes = [5]
+    out_path = None
+
+    try:
+        for arg in args:
+            option, sep, value = arg.partition(':')
+            if option == '-files':
+                options['files'] = int(value)
+            elif option == '-size':
+                options['size'] = float(value)
+            elif option == '-mode' and value in ('files', 'url', 'both'):
+                modes = ['files', 'url'] if value == 'both' else [value]
+            elif option == '-workers':
+                workers = parse_list(value, int)
+            elif option == '-chunk_size':
+                chunk_sizes = parse_list(value, float)
+            elif option == '-adaptive_chunks':
+                options['adaptive_chunks'] = True
+            elif option == '-latency':
+                options['latency'] = float(value)
+            elif option == '-failure_rate':
+                options['failure_rate'] = float(value)
+            elif option == '-dir':
+                options['dir'] = value
+            elif option == '-out':
+                out_path = value
+            else:
+                print(usage)
+                return
+    except ValueError:
+        print(usage)
+        return
+
+    # pywikibot must neither use nor modify the user's own configuration
+    results = []
+    with pywikibot_sandbox('upload_benchmark_config_'):
+        for mode in modes:
+            # the file and chunk sizes are irrelevant for uploads by url
+            for chunk_size in chunk_sizes if mode == 'files' else [None]:
+                for num_workers in workers:
+                    config = dict(options, mode=mode, workers=num_workers,
+                                  chunk_size=chunk_size)
+                    if mode == 'url':
+                        config['size'] = None
+                    results.append(benchmark(config))
+
+    print(format_results(results))
+    if out_path:
+        with open(out_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -9,13 +9,11 @@ import batchupload.common as common
 
 
 def run(filename):
-    data = common.open_and_read_file(filename, as_json=True)
-
     num_cats = Counter()
     num_meta_cats = Counter()
     meta_cats = Counter()
     cats = Counter()
-    for k, v in data.items():
+    for k, v in common.iter_json_entries(filename):
         c = v.get('cats') or []
         mc = v.get('meta_cats') or []
         num_cats.update([len(c)])
@@ -29,7 +29,7 @@ def run(data, selection, log_file, output, media_ext):
     if not output:
         output = os.path.join(selection_dir, DEFAULTS.get('output'))
 
-    data = common.open_and_read_file(data, as_json=True)
+    data = common.open_json_object(data)
     demo = common.open_and_read_file(selection, as_json=True)
 
     # load log
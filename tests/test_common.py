@@ -6,13 +6,37 @@ import unittest
 import tempfile
 import os
 import json
+import hashlib
+import pickle
+import shutil
+import sqlite3
+import mock
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 from batchupload.common import (
+    detect_compression,
+    file_sha1,
+    is_json_shards,
+    iter_batches,
+    iter_json_entries,
+    iter_json_object,
+    json_hash,
+    JsonObjectWriter,
+    JsonShards,
+    JsonShardsWriter,
+    open_json_object,
+    percentile,
+    PersistentCache,
     strip_dict_entries,
     strip_list_entries,
     is_int,
     is_pos_int,
+    is_pos_number,
     open_and_read_file,
     open_and_write_file,
+    write_json_shards,
     trim_list,
     MyError,
     deep_sort,
@@ -165,6 +189,20 @@ class TestIsPosInt(unittest.TestCase):
         self.assertEqual(result, True)
 
 
+class TestIsPosNumber(unittest.TestCase):
+
+    """Test the is_pos_number method."""
+
+    def test_is_pos_number_fail(self):
+        for value in ('', None, 'random_string', '0', '-1.5', 'nan', 'inf',
+                      '-inf'):
+            self.assertFalse(is_pos_number(value), value)
+
+    def test_is_pos_number_succeed(self):
+        for value in ('123', '0.5', '1e2', 2, 0.25):
+            self.assertTrue(is_pos_number(value), value)
+
+
 class TestOpenFileBase(unittest.TestCase):
 
     """Test base for open_and_read_file() and open_and_write_file()."""
@@ -217,6 +255,334 @@ class TestOpenWriteFile(TestOpenFileBase):
         self.assertEqual(deep_sort(json_out),
                          deep_sort(json_in))
 
+    def test_write_json_data_format(self):
+        to_write = {'b': {'list': [1, {'x': 'ä'}], 'a': None}, 'a': {}}
+        open_and_write_file(self.test_outfile.name, to_write, as_json=True)
+        self.assertEqual(
+            self.test_outfile.read().decode('utf-8'),
+            json.dumps(to_write, indent=4, ensure_ascii=False,
+                       sort_keys=True))
+
+    def test_write_json_data_non_dict(self):
+        for to_write in ({1: 'a', 2: 'b'}, ['a', {'b': 1}], {}):
+            open_and_write_file(self.test_outfile.name, to_write,
+                                as_json=True)
+            self.assertEqual(
+                open_and_read_file(self.test_outfile.name),
+                json.dumps(to_write, indent=4, ensure_ascii=False,
+                           sort_keys=True))
+
+    def test_write_json_data_compact(self):
+        to_write = {'list': ['a', 'b', 'c'], 'två': '2', 'ett': {'x': 1}}
+        open_and_write_file(self.test_outfile.name, to_write, as_json=True,
+                            compact=True)
+        self.assertEqual(
+            self.test_outfile.read().decode('utf-8'),
+            '{"ett":{"x":1},"list":["a","b","c"],"två":"2"}')
+
+    def test_write_gzip(self):
+        to_write = {'list': ['a', 'b', 'c'], 'två': '2', 'ett': 1}
+        open_and_write_file(self.test_outfile.name, to_write, as_json=True,
+                            compression='gzip')
+        self.assertEqual(detect_compression(self.test_outfile.name), 'gzip')
+        self.assertEqual(
+            open_and_read_file(self.test_outfile.name, as_json=True),
+            to_write)
+        self.assertEqual(
+            sorted(iter_json_object(self.test_outfile.name)),
+            sorted(to_write.items()))
+
+    def test_write_unknown_compression(self):
+        with self.assertRaises(MyError):
+            open_and_write_file(self.test_outfile.name, 'text',
+                                compression='rar')
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_write_zstd(self):
+        open_and_write_file(self.test_outfile.name, 'en två',
+                            compression='zstd')
+        self.assertEqual(detect_compression(self.test_outfile.name), 'zstd')
+        self.assertEqual(open_and_read_file(self.test_outfile.name),
+                         'en två')
+
+    @unittest.skipIf(zstandard is not None, 'zstandard is installed')
+    def test_write_zstd_not_installed(self):
+        with self.assertRaises(MyError):
+            open_and_write_file(self.test_outfile.name, 'text',
+                                compression='zstd')
+
+
+class TestIterJsonObject(TestOpenFileBase):
+
+    """Test iter_json_object()."""
+
+    def write(self, text):
+        with open(self.test_outfile.name, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        return self.test_outfile.name
+
+    def test_iter_json_object(self):
+        result = list(iter_json_object(self.test_infile.name))
+        self.assertEqual(
+            result,
+            [('list', ['a', 'b', 'c']), ('två', '2'), ('ett', 1)])
+
+    def test_iter_json_object_small_blocks(self):
+        data = {'k{}'.format(i): {'info': 'ä "{}" }}\n'.format(i),
+                                  'number': i * 1000003, 'float': i / 3.0,
+                                  'list': [None, True, False, {}]}
+                for i in range(50)}
+        name = self.write(json.dumps(data, indent=4, ensure_ascii=False))
+        for block_size in (1, 2, 7, 4096):
+            result = list(iter_json_object(name, block_size=block_size))
+            self.assertEqual(dict(result), data)
+            self.assertEqual(len(result), 50)
+
+    def test_iter_json_object_empty(self):
+        name = self.write(' { \n } ')
+        self.assertEqual(list(iter_json_object(name)), [])
+
+    def test_iter_json_object_duplicate_keys(self):
+        name = self.write('{"a": 1, "a": 2}')
+        self.assertEqual(list(iter_json_object(name)), [('a', 1), ('a', 2)])
+
+    def test_iter_json_object_lazy(self):
+        name = self.write('{"a": 1, "b": 2, broken')
+        entries = iter_json_object(name, block_size=2)
+        self.assertEqual(next(entries), ('a', 1))
+        self.assertEqual(next(entries), ('b', 2))
+        with self.assertRaises(ValueError):
+            next(entries)
+
+    def test_iter_json_object_invalid(self):
+        for text in ('', '[1, 2]', '{"a": 1', '{"a" 1}', '{"a": 1,}'):
+            name = self.write(text)
+            with self.assertRaises(ValueError):
+                list(iter_json_object(name, block_size=3))
+
+
+class TestJsonShards(unittest.TestCase):
+
+    """Test write_json_shards() and JsonShards."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.base_name = os.path.join(self.out_dir, 'data')
+        self.data = {'k{}'.format(i): {'info': 'ä\n{}\u2028'.format(i),
+                                       'cats': ['x'] * i}
+                     for i in range(5)}
+
+    def test_write_json_shards(self):
+        index_file = write_json_shards(self.base_name, self.data,
+                                       shard_size=2)
+        self.assertEqual(index_file, self.base_name + '.index.jsonl')
+        self.assertTrue(is_json_shards(index_file))
+        self.assertEqual(
+            sorted(os.listdir(self.out_dir)),
+            ['data.index.jsonl', 'data.shard-00000.jsonl',
+             'data.shard-00001.jsonl', 'data.shard-00002.jsonl'])
+
+    def test_write_json_shards_invalid_size(self):
+        with self.assertRaises(MyError):
+            write_json_shards(self.base_name, self.data, shard_size=0)
+
+    def test_json_shards_lookup(self):
+        index_file = write_json_shards(self.base_name, self.data,
+                                       shard_size=2)
+        with JsonShards(index_file) as shards:
+            self.assertEqual(len(shards), 5)
+            self.assertEqual(shards['k3'], self.data['k3'])
+            self.assertEqual(shards['k0'], self.data['k0'])
+            self.assertIn('k4', shards)
+            self.assertNotIn('k5', shards)
+            self.assertIsNone(shards.get('k5'))
+            self.assertEqual(list(shards), sorted(self.data.keys()))
+            with self.assertRaises(KeyError):
+                shards['k5']
+
+    def test_json_shards_items(self):
+        index_file = write_json_shards(self.base_name, self.data,
+                                       shard_size=3)
+        shards = JsonShards(index_file)
+        self.assertEqual(list(shards.items()), sorted(self.data.items()))
+        self.assertIsNone(shards.index)  # streaming needs no index
+
+    def test_json_shards_empty(self):
+        index_file = write_json_shards(self.base_name, {})
+        shards = JsonShards(index_file)
+        self.assertEqual(len(shards), 0)
+        self.assertEqual(list(shards.items()), [])
+
+    def test_open_json_object(self):
+        index_file = write_json_shards(self.base_name, self.data)
+        json_file = self.base_name + '.json'
+        open_and_write_file(json_file, self.data, as_json=True)
+        self.assertIsInstance(open_json_object(index_file), JsonShards)
+        self.assertEqual(open_json_object(json_file), self.data)
+
+    def test_iter_json_entries(self):
+        index_file = write_json_shards(self.base_name, self.data)
+        json_file = self.base_name + '.json'
+        open_and_write_file(json_file, self.data, as_json=True)
+        self.assertEqual(list(iter_json_entries(index_file)),
+                         list(iter_json_entries(json_file)))
+
+
+class TestJsonObjectWriter(unittest.TestCase):
+
+    """Test JsonObjectWriter."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.filename = os.path.join(self.out_dir, 'data.json')
+
+    def test_json_object_writer_format(self):
+        data = {'b': {'list': [1, {'x': 'ä'}], 'a': None}, 'a': 'text'}
+        writer = JsonObjectWriter(self.filename)
+        for key in sorted(data.keys()):
+            writer.write(key, data[key])
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(writer.close_and_confirm(),
+                         'Created {0}'.format(self.filename))
+
+        expected_file = os.path.join(self.out_dir, 'expected.json')
+        open_and_write_file(expected_file, data, as_json=True)
+        self.assertEqual(open_and_read_file(self.filename),
+                         open_and_read_file(expected_file))
+        self.assertEqual(os.listdir(self.out_dir).count('data.json.tmp'), 0)
+
+    def test_json_object_writer_order(self):
+        writer = JsonObjectWriter(self.filename)
+        writer.write('b', 1)
+        writer.write('a', 2)
+        writer.close_and_confirm()
+        self.assertEqual(list(iter_json_object(self.filename)),
+                         [('b', 1), ('a', 2)])
+
+    def test_json_object_writer_compact_gzip(self):
+        writer = JsonObjectWriter(self.filename, indent=None,
+                                  compression='gzip')
+        writer.write('b', {'x': [1, 2]})
+        writer.write('a', 'ä')
+        writer.close_and_confirm()
+        self.assertEqual(open_and_read_file(self.filename),
+                         '{"b":{"x":[1,2]},"a":"ä"}')
+
+    def test_json_object_writer_empty(self):
+        JsonObjectWriter(self.filename).close_and_confirm()
+        self.assertEqual(open_and_read_file(self.filename, as_json=True), {})
+
+
+class TestJsonShardsWriter(unittest.TestCase):
+
+    """Test JsonShardsWriter."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.base_name = os.path.join(self.out_dir, 'data')
+
+    def test_json_shards_writer(self):
+        writer = JsonShardsWriter(self.base_name, shard_size=2)
+        for key in ('c', 'a', 'b'):
+            writer.write(key, {'key': key})
+        writer.close_and_confirm()
+        self.assertEqual(
+            sorted(os.listdir(self.out_dir)),
+            ['data.index.jsonl', 'data.shard-00000.jsonl',
+             'data.shard-00001.jsonl'])
+        shards = JsonShards(writer.file_name)
+        self.assertEqual([k for k, v in shards.items()], ['c', 'a', 'b'])
+        self.assertEqual(shards['b'], {'key': 'b'})
+
+    def test_json_shards_writer_replace(self):
+        write_json_shards(self.base_name, {'a': 1, 'b': 2}, shard_size=1)
+        previous = JsonShards(self.base_name + '.index.jsonl')
+        self.assertEqual(previous['b'], 2)
+        writer = JsonShardsWriter(self.base_name, shard_size=1)
+        writer.write('b', previous['b'] + 1)
+        writer.write('a', previous['a'] + 1)
+        previous.close()
+        writer.close_and_confirm()
+        shards = JsonShards(writer.file_name)
+        self.assertEqual(list(shards.items()), [('b', 3), ('a', 2)])
+
+
+class TestJsonHash(unittest.TestCase):
+
+    """Test json_hash()."""
+
+    def test_json_hash_key_order(self):
+        self.assertEqual(json_hash({'a': 1, 'b': [1, 2]}),
+                         json_hash({'b': [1, 2], 'a': 1}))
+
+    def test_json_hash_changed(self):
+        self.assertNotEqual(json_hash({'a': 1}), json_hash({'a': 2}))
+        self.assertNotEqual(json_hash([1, 2]), json_hash([2, 1]))
+
+    def test_json_hash_set_and_object(self):
+        class Item(object):
+            def __init__(self, value):
+                self.value = value
+                self.tags = set(['b', 'a', 'c'])
+
+        self.assertEqual(json_hash(Item('x')), json_hash(Item('x')))
+        self.assertNotEqual(json_hash(Item('x')), json_hash(Item('y')))
+
+
+class TestIterBatches(unittest.TestCase):
+
+    """Test iter_batches()."""
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)),
+                         [[0, 1], [2, 3], [4]])
+
+    def test_iter_batches_no_size(self):
+        self.assertEqual(list(iter_batches(range(5), None)),
+                         [[0, 1, 2, 3, 4]])
+
+    def test_iter_batches_empty(self):
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+
+class TestFileSha1(TestOpenFileBase):
+
+    """Test file_sha1()."""
+
+    def test_file_sha1(self):
+        expected = hashlib.sha1(self.test_data.encode('utf-8')).hexdigest()
+        self.assertEqual(file_sha1(self.test_infile.name), expected)
+
+    def test_file_sha1_small_blocks(self):
+        expected = hashlib.sha1(self.test_data.encode('utf-8')).hexdigest()
+        self.assertEqual(
+            file_sha1(self.test_infile.name, block_size=3), expected)
+
+
+class TestPercentile(unittest.TestCase):
+
+    """Test percentile()."""
+
+    def test_percentile_empty(self):
+        self.assertIsNone(percentile([], 50))
+
+    def test_percentile_single(self):
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_percentile_unsorted(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 100), 5)
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 96), 20)
+
 
 class TestTrimList(unittest.TestCase):
 
@@ -499,3 +865,113 @@ class TestInvertDict(unittest.TestCase):
         obj = {'a': {'A': 1}, 'b': 'B'}
         with self.assertRaises(TypeError):
             invert_dict(obj)
+
+
+class TestPersistentCache(unittest.TestCase):
+
+    """Test the PersistentCache class."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.filename = os.path.join(self.out_dir, 'cache.sqlite')
+
+    def open_cache(self, namespace='test', ttl=None):
+        cache = PersistentCache(self.filename, namespace, ttl=ttl)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_persistent_cache_persists(self):
+        with self.open_cache() as cache:
+            cache['Category:Ä'] = True
+            cache['Q1'] = {'creator': 'Å', 'death_year': 1900}
+        cache = self.open_cache()
+        self.assertTrue(cache['Category:Ä'])
+        self.assertEqual(cache['Q1'], {'creator': 'Å', 'death_year': 1900})
+        self.assertEqual(sorted(cache), ['Category:Ä', 'Q1'])
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('Q2', cache)
+        with self.assertRaises(KeyError):
+            cache['Q2']
+
+    def test_persistent_cache_namespaces(self):
+        with self.open_cache('a') as cache:
+            cache['key'] = 1
+        self.assertNotIn('key', self.open_cache('b'))
+        self.assertIn('key', self.open_cache('a'))
+
+    def test_persistent_cache_invalidate(self):
+        cache = self.open_cache()
+        cache.update({'a': 1, 'b': 2, 'c': 3})
+        del cache['a']
+        self.assertEqual(sorted(cache), ['b', 'c'])
+        with self.assertRaises(KeyError):
+            del cache['a']
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_persistent_cache_ttl(self):
+        with mock.patch('batchupload.common.time.time', return_value=100):
+            with self.open_cache() as cache:
+                cache['old'] = 1
+        with mock.patch('batchupload.common.time.time', return_value=200):
+            with self.open_cache() as cache:
+                cache['new'] = 2
+        with mock.patch('batchupload.common.time.time', return_value=250):
+            self.assertEqual(len(self.open_cache()), 2)
+            cache = self.open_cache(ttl=100)
+            self.assertEqual(sorted(cache), ['new'])
+            self.assertEqual(cache.expire(10), 1)
+            self.assertEqual(len(cache), 0)
+
+    def test_persistent_cache_update_single_transaction(self):
+        cache = self.open_cache()
+        statements = []
+        cache.connection.set_trace_callback(statements.append)
+        cache.update({'a': 1, 'b': 2}, c=3)
+        cache.update([('d', 4)])
+        cache.update({})
+        self.assertEqual(statements.count('BEGIN'), 2)
+        self.assertEqual(statements.count('COMMIT'), 2)
+        self.assertEqual(
+            dict((key, cache[key]) for key in cache),
+            {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+
+    def test_persistent_cache_invalidate_many(self):
+        cache = self.open_cache()
+        cache.update({'a': 1, 'b': 2, 'c': 3})
+        statements = []
+        cache.connection.set_trace_callback(statements.append)
+        self.assertEqual(cache.invalidate(['a', 'c', 'x']), 2)
+        self.assertEqual(statements.count('BEGIN'), 1)
+        self.assertEqual(sorted(cache), ['b'])
+        self.assertEqual(cache.invalidate([]), 0)
+
+    def test_persistent_cache_update_rollback(self):
+        cache = self.open_cache()
+        cache['a'] = 1
+        with mock.patch.object(cache, '_connection') as mock_connection:
+            mock_connection.executemany.side_effect = sqlite3.Error
+            with self.assertRaises(sqlite3.Error):
+                cache.update({'a': 2, 'b': 3})
+        mock_connection.execute.assert_called_with('ROLLBACK')
+
+    def test_persistent_cache_concurrent_writers(self):
+        # a lock held by an uncommitted write would make this time out
+        first = PersistentCache(self.filename, 'test')
+        second = PersistentCache(self.filename, 'test')
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        first['a'] = 1
+        second['b'] = 2
+        first['c'] = 3
+        self.assertEqual(second['a'], 1)
+        self.assertEqual(first['b'], 2)
+        self.assertEqual(sorted(second), ['a', 'b', 'c'])
+
+    def test_persistent_cache_pickle(self):
+        cache = self.open_cache()
+        cache['a'] = 1
+        copy = pickle.loads(pickle.dumps(cache))
+        self.addCleanup(copy.close)
+        self.assertEqual(copy['a'], 1)
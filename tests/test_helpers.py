@@ -2,15 +2,34 @@
 # -*- coding: utf-8  -*-
 """Unit tests for helpers.py."""
 from __future__ import unicode_literals
+import random
 import unittest
+import mock
 from collections import OrderedDict
 
+from batchupload.common import MyError
 from batchupload.helpers import (
     flip_name,
     flip_names,
     get_all_template_entries,
     cleanString,
-    output_block_template
+    format_filename,
+    format_filenames,
+    normalise_filename,
+    shortenString,
+    GOODLENGTH,
+    MAXLENGTH,
+    std_date_range,
+    stdDate,
+    isoDate,
+    AffixRules,
+    LRUMemo,
+    StringCleaner,
+    output_block_template,
+    BlockTemplateRenderer,
+    pages_exist,
+    categories_exist,
+    category_title
 )
 
 
@@ -101,6 +120,329 @@ class TestCleanString(unittest.TestCase):
         expected = 's,a, ,-'
         self.assertEqual(cleanString(test_string), expected)
 
+    def test_clean_string_quotes(self):
+        test_string = 'a:"b e´ “c”  :\x8fd'
+        expected = 'a- b é c - d'
+        self.assertEqual(cleanString(test_string), expected)
+
+    def test_clean_string_same_as_sequential_replace(self):
+        alphabet = list('ase: \t\x8f\xa0´"“”\\/|#[]{}.')
+        rand = random.Random(0)
+        for i in range(5000):
+            test_string = ''.join(
+                rand.choice(alphabet) for j in range(rand.randint(0, 12)))
+            self.assertEqual(cleanString(test_string),
+                             sequential_clean_string(test_string),
+                             repr(test_string))
+
+
+def sequential_clean_string(text):
+    """The original cleanString(), using a sequence of str.replace()."""
+    bad_char = {'\\': '-', '/': '-', '|': '-', '#': '-',
+                '[': '(', ']': ')', '{': '(', '}': ')',
+                ':s': 's', ': ': ', ',
+                'e´': 'é',
+                '”': ' ', '"': ' ', '“': ' '}
+    unusual_whitespace = ['\x8f', ]
+    for w in unusual_whitespace:
+        bad_char[w] = ' '
+    text = ' '.join(text.split())
+    for k, v in bad_char.items():
+        text = text.replace(k, v)
+    if ':' in text:
+        text = text.replace(':', '-')
+    text = text.replace('  ', ' ')
+    return text.strip()
+
+
+class TestShortenString(unittest.TestCase):
+
+    """Test the shortenString method."""
+
+    def test_shorten_string_short(self):
+        text = 'a' * (GOODLENGTH - 1)
+        self.assertEqual(shortenString(text), text)
+
+    def test_shorten_string_hard_cut(self):
+        self.assertEqual(shortenString('<!>'.join(('ab', 'c' * 200))), 'ab')
+
+    def test_shorten_string_trailing_bracket(self):
+        text = '{0}, {1} ({2})'.format('a' * 50, 'b' * 45, 'c' * 10)
+        self.assertEqual(shortenString(text),
+                         '{0}, {1}'.format('a' * 50, 'b' * 45))
+
+    def test_shorten_string_cut_preference(self):
+        text = '{0}; {0}. {0} - {0}, {0}'.format('abcd' * 10)
+        self.assertEqual(shortenString(text), '{0}; {0}'.format('abcd' * 10))
+
+    def test_shorten_string_truncate(self):
+        text = 'a' * (MAXLENGTH + 10)
+        self.assertEqual(shortenString(text),
+                         '{0}...'.format('a' * (MAXLENGTH - 3)))
+
+    def test_shorten_string_same_as_recursive(self):
+        pieces = ['a', 'bcd', ' ', 'efghijkl', '.', ' - ', ';', ',', '-',
+                  '(', ')', ' (xy)', '<!>']
+        rand = random.Random(0)
+        for i in range(5000):
+            text = ''.join(
+                rand.choice(pieces) for j in range(rand.randint(0, 120)))
+            self.assertEqual(shortenString(text),
+                             recursive_shorten_string(text), repr(text))
+
+
+def recursive_shorten_string(text):
+    """The original, recursive, shortenString()."""
+    badchar = '-., '
+    if '<!>' in text:
+        text = text[:text.find('<!>')]
+    if len(text) < GOODLENGTH:
+        return text
+    if text.endswith(')'):
+        pos = text.rfind('(')
+        if pos > 0:
+            return recursive_shorten_string(text[:pos].strip(badchar))
+    pos = text.rfind('.')
+    if pos < 0:
+        pos = text.rfind(' - ')
+        if pos < 0:
+            pos = text.rfind(';')
+            if pos < 0:
+                pos = text.rfind(',')
+                if pos < 0:
+                    if len(text) > MAXLENGTH:
+                        text = '%s...' % text[:MAXLENGTH - 3]
+                    return text
+    return recursive_shorten_string(text[:pos].strip(badchar))
+
+
+class TestStringCleaner(unittest.TestCase):
+
+    """Test the StringCleaner class."""
+
+    def test_string_cleaner(self):
+        cleaner = StringCleaner([('ab', 'x'), ('a', 'b'), ('b', '')])
+        self.assertEqual(cleaner('abab-a-b'), 'xx--')
+
+    def test_string_cleaner_no_match(self):
+        cleaner = StringCleaner([('a', 'b')])
+        text = 'ccc'
+        self.assertIs(cleaner(text), text)
+
+
+class TestStdDate(unittest.TestCase):
+
+    """Test the stdDate, std_date_range and isoDate methods."""
+
+    cases = {
+        '': '',
+        'n.d.': '',
+        'Odaterad': '',
+        '1921': '1921',
+        '1921-09': '1921-09',
+        '1921-09-17': '1921-09-17',
+        '2014-07-11T08:14:46Z': '2014-07-11',
+        '1921-13': None,
+        'ca 1921': '{{other date|ca|1921}}',
+        '1921 (?)': '{{other date|?|1921}}',
+        '1921?': '{{other date|?|1921}}',
+        'Början av 1920-talet': (
+            '{{other date|early|{{other date|decade|1920}}}}'),
+        '1900-tal': '{{other date|century|20}}',
+        '1921 troligen': '1921 {{Probably}}',
+        'trol. 1921': '1921 {{Probably}}',
+        'före 1921-09': '{{other date|<|1921-09}}',
+        '1921 - ': '{{other date|>|1921}}',
+        'sommaren 1921': '{{other date|summer|1921}}',
+        'okänt': None,
+    }
+
+    def test_std_date(self):
+        for date, expected in self.cases.items():
+            self.assertEqual(stdDate(date), expected, date)
+
+    def test_std_date_same_as_legacy(self):
+        alphabet = [
+            '1', '9', '0', '2', '-', ' - ', ' ', '.', '?', '(?)', 'ca ', 'c',
+            'tal', '-talet', 'början av ', 'slutet', 'före ', 'Efter ',
+            'trol.', 'n.d', 'andra hälft', 'sekelskiftet ', 'T']
+        rand = random.Random(0)
+        for i in range(5000):
+            date = ''.join(
+                rand.choice(alphabet) for j in range(rand.randint(0, 8)))
+            self.assertEqual(stdDate(date), legacy_std_date(date), repr(date))
+        for date in self.cases:
+            self.assertEqual(stdDate(date), legacy_std_date(date), date)
+
+    def test_std_date_range(self):
+        self.assertEqual(std_date_range('1921 - 1922'),
+                         '{{other date|-|1921|1922}}')
+        self.assertEqual(std_date_range('1921 - 1921'), '1921')
+        self.assertEqual(std_date_range('1921 - okänt'), None)
+        self.assertEqual(std_date_range('ca 1921'), '{{other date|ca|1921}}')
+
+    def test_iso_date(self):
+        self.assertEqual(isoDate('1921-09-17Z'), '1921-09-17')
+        self.assertEqual(isoDate('1921-09-32'), None)
+        self.assertEqual(isoDate('1921'), '1921')
+
+
+def legacy_std_date(date):
+    """The original stdDate(), trying each rule in turn."""
+    date = date.strip('.  ')
+    if len(date) == 0 or date.lower() in ('n.d', 'odaterad'):
+        return ''
+    date = date.replace(' - ', '-')
+    endings = OrderedDict([
+        ('?', '?'), ('(?)', '?'), ('c', 'ca'), ('ca', 'ca'),
+        ('cirka', 'ca'), ('andra hälft', '2half'),
+        ('första hälft', '1half'), ('början', 'early'), ('slut', 'end'),
+        ('slutet', 'end'), ('mitt', 'mid'),
+        ('första fjärdedel', '1quarter'), ('andra fjärdedel', '2quarter'),
+        ('tredje fjärdedel', '3quarter'), ('fjärde fjärdedel', '4quarter'),
+        ('sista fjärdedel', '4quarter'), ('före', '<'), ('efter', '>'),
+        ('-', '>')])
+    starts = OrderedDict([
+        ('tidigt', 'early'), ('br av', 'early'), ('början av', 'early'),
+        ('tid ', 'early'), ('sent', 'late'), ('sl av', 'late'),
+        ('slutet av', 'end'), ('andra hälften av', '2half'),
+        ('första hälften av', '1half'), ('mitten av', 'mid'),
+        ('första fjärdedel av', '1quarter'),
+        ('andra fjärdedel av', '2quarter'),
+        ('tredje fjärdedel av', '3quarter'),
+        ('fjärde fjärdedel av', '4quarter'),
+        ('sista fjärdedel av', '4quarter'), ('ca', 'ca'),
+        ('våren', 'spring'), ('sommaren', 'summer'), ('hösten', 'fall'),
+        ('vintern', 'winter'), ('sekelskiftet', 'turn of the century'),
+        ('före', '<'), ('efter', '>'), ('-', '<')])
+    tal_endings = ('-talets', '-tal', '-talet', ' talets')
+    modality = ('troligen', 'sannolikt', 'trol.')
+    for k, v in starts.items():
+        if date.lower().startswith(k):
+            again = legacy_std_date(date[len(k):])
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    for k, v in endings.items():
+        if date.lower().endswith(k):
+            again = legacy_std_date(date[:-len(k)])
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    for k in modality:
+        found = False
+        if date.lower().endswith(k):
+            date = date[:-len(k)].strip('.,  ')
+            found = True
+        elif date.lower().startswith(k):
+            date = date[len(k):].strip('.,  ')
+            found = True
+        if found:
+            again = legacy_std_date(date)
+            if again:
+                return '%s {{Probably}}' % again
+            else:
+                return None
+    for k in tal_endings:
+        if date.lower().endswith(k):
+            date = date[:-len(k)].strip('.  ')
+            if date[-2:] == '00':
+                v = 'century'
+                if len(date) == 4:
+                    return '{{other date|%s|%r}}' % (v, int(date[:2]) + 1)
+                else:
+                    return None
+            else:
+                v = 'decade'
+            again = legacy_std_date(date)
+            if again:
+                return '{{other date|%s|%s}}' % (v, again)
+            else:
+                return None
+    return isoDate(date)
+
+
+class TestAffixRules(unittest.TestCase):
+
+    """Test the AffixRules class."""
+
+    def test_affix_rules_prefix_first_rule_wins(self):
+        rules = AffixRules([('a', 1), ('ab', 2), ('a.', 3)])
+        self.assertEqual(rules.match('abc'), ('a', 1))
+        self.assertEqual(rules.match('ba'), None)
+
+    def test_affix_rules_suffix_first_rule_wins(self):
+        rules = AffixRules([('a', 1), ('ca', 2), ('c', 3)], suffix=True)
+        self.assertEqual(rules.match('cirka'), ('a', 1))
+        self.assertEqual(rules.match('abc'), ('c', 3))
+        self.assertEqual(rules.match('cab'), None)
+
+
+class TestLRUMemo(unittest.TestCase):
+
+    """Test the LRUMemo class."""
+
+    def test_lru_memo(self):
+        function = mock.Mock(side_effect=lambda x: x * 2)
+        memo = LRUMemo(function, 2)
+        self.assertEqual([memo(1), memo(2), memo(1), memo(3)], [2, 4, 2, 6])
+        self.assertEqual(function.call_count, 3)
+        memo(1)  # still memoized, 2 was the least recently used
+        self.assertEqual(function.call_count, 3)
+        memo(2)
+        self.assertEqual(function.call_count, 4)
+        memo.clear()
+        memo(1)
+        self.assertEqual(function.call_count, 5)
+
+
+class TestFormatFilenames(unittest.TestCase):
+
+    """Test the format_filenames method."""
+
+    def setUp(self):
+        self.descrs = ['Porträtt av man.', 'Skepp: "Vasa"', 'Porträtt av man.']
+        self.idnos = ['SMM 1', 'SMM 2', 'SMM 3']
+
+    def test_format_filenames_same_as_format_filename(self):
+        filenames, collisions = format_filenames(
+            self.descrs, 'SMM', self.idnos, delimiter=' _ ')
+        self.assertEqual(
+            filenames,
+            [format_filename(descr, 'SMM', idno, delimiter=' _ ')
+             for descr, idno in zip(self.descrs, self.idnos)])
+        self.assertEqual(collisions, {})
+
+    def test_format_filenames_cleans_once(self):
+        with mock.patch('batchupload.helpers.cleanString',
+                        wraps=cleanString) as mock_clean:
+            format_filenames(self.descrs, ['SMM'] * 3, self.idnos)
+        # institution once, idnos thrice and the two distinct descriptions
+        self.assertEqual(mock_clean.call_count, 6)
+
+    def test_format_filenames_collisions(self):
+        filenames, collisions = format_filenames(
+            self.descrs, 'SMM', ['SMM 1', 'smm_1', 'SMM 1'])
+        self.assertEqual(
+            collisions, {'Porträtt_av_man_-_SMM_-_SMM_1': [0, 2]})
+
+    def test_format_filenames_different_lengths(self):
+        with self.assertRaises(MyError):
+            format_filenames(self.descrs, 'SMM', self.idnos[:2])
+
+
+class TestNormaliseFilename(unittest.TestCase):
+
+    """Test the normalise_filename method."""
+
+    def test_normalise_filename(self):
+        self.assertEqual(normalise_filename('A_File -  Name'),
+                         normalise_filename('a file_-_name'))
+        self.assertNotEqual(normalise_filename('A file 1'),
+                            normalise_filename('A file 2'))
+
 
 class TestOutputBlockTemplate(unittest.TestCase):
 
@@ -178,3 +520,153 @@ class TestOutputBlockTemplate(unittest.TestCase):
         self.assertEqual(
             output_block_template(self.name, self.data, None),
             expected)
+
+
+class TestBlockTemplateRenderer(unittest.TestCase):
+
+    """Test the BlockTemplateRenderer class."""
+
+    def test_block_template_renderer(self):
+        renderer = BlockTemplateRenderer('Name', ['param1', 'param100'])
+        expected = "{{Name\n" \
+                   "| param1   = text1\n" \
+                   "| param100 = \n" \
+                   "}}"
+        self.assertEqual(
+            renderer.render({'param100': '', 'param1': 'text1', 'b': 'c'}),
+            expected)
+        self.assertEqual(renderer.render({'param1': None}), "{{Name\n}}")
+
+    def test_block_template_renderer_repeated_key(self):
+        renderer = BlockTemplateRenderer('t', ('a', 'b', 'a'), 0)
+        self.assertEqual(renderer.keys, ('a', 'b'))
+        self.assertEqual(renderer.render({'a': 1, 'b': 2}),
+                         "{{t\n| a = 1\n| b = 2\n}}")
+
+    def test_block_template_renderer_braces(self):
+        renderer = BlockTemplateRenderer('Name', ['{a}'], 0)
+        self.assertEqual(renderer.render({'{a}': '{b}'}),
+                         "{{Name\n| {a} = {b}\n}}")
+
+
+class TestPagesExist(unittest.TestCase):
+
+    """Test the pages_exist method."""
+
+    def setUp(self):
+        request_patcher = mock.patch(
+            'batchupload.helpers.pywikibot.data.api.Request')
+        self.mock_request = request_patcher.start()
+        self.mock_request.return_value.submit.side_effect = self.fake_query
+        self.addCleanup(request_patcher.stop)
+        self.existing = ('File:A b.jpg', 'File:Target.jpg', 'File:C.jpg')
+        self.redirects = {'File:Redirect.jpg': 'File:Target.jpg',
+                          'File:Broken.jpg': 'File:Missing.jpg'}
+
+    def fake_query(self):
+        parameters = self.mock_request.call_args[1]['parameters']
+        query = {'normalized': [], 'redirects': [], 'pages': {}}
+        for i, title in enumerate(parameters['titles']):
+            if '_' in title:
+                query['normalized'].append(
+                    {'from': title, 'to': title.replace('_', ' ')})
+                title = title.replace('_', ' ')
+            if parameters.get('redirects') and title in self.redirects:
+                query['redirects'].append(
+                    {'from': title, 'to': self.redirects[title]})
+                title = self.redirects[title]
+            page = {'title': title}
+            if title not in self.existing + tuple(self.redirects.keys()):
+                page['missing'] = ''
+            query['pages'][str(-i)] = page
+        return {'query': query}
+
+    def test_pages_exist_empty(self):
+        self.assertEqual(pages_exist([], site='site'), {})
+        self.mock_request.assert_not_called()
+
+    def test_pages_exist_normalized(self):
+        result = pages_exist(['File:A_b.jpg', 'File:D.jpg'], site='site')
+        self.assertEqual(result, {'File:A_b.jpg': True, 'File:D.jpg': False})
+
+    def test_pages_exist_batched(self):
+        titles = ['File:{}.jpg'.format(i) for i in range(120)]
+        titles.append('File:C.jpg')
+        result = pages_exist(titles, site='site', batch_size=50)
+        self.assertEqual(self.mock_request.call_count, 3)
+        self.assertEqual(len(result), 121)
+        self.assertEqual([k for k, v in result.items() if v], ['File:C.jpg'])
+
+    def test_pages_exist_redirects(self):
+        titles = ['File:Redirect.jpg', 'File:Broken.jpg']
+        self.assertEqual(
+            pages_exist(titles, site='site'),
+            {'File:Redirect.jpg': True, 'File:Broken.jpg': True})
+        self.assertEqual(
+            pages_exist(titles, site='site', follow_redirects=True),
+            {'File:Redirect.jpg': True, 'File:Broken.jpg': False})
+
+
+class TestCategoryTitle(unittest.TestCase):
+
+    """Test the category_title method."""
+
+    def test_category_title(self):
+        for cat in ('Foo bar', 'foo_bar', ' Foo  bar ', 'Category:Foo bar',
+                    'category:foo_bar', 'Category_:_foo bar'):
+            self.assertEqual(category_title(cat), 'Category:Foo bar', cat)
+
+    def test_category_title_other_colon(self):
+        self.assertEqual(category_title('Foo: bar'), 'Category:Foo: bar')
+
+
+class TestCategoriesExist(unittest.TestCase):
+
+    """Test the categories_exist method."""
+
+    def setUp(self):
+        pages_exist_patcher = mock.patch(
+            'batchupload.helpers.pages_exist')
+        self.mock_pages_exist = pages_exist_patcher.start()
+        self.mock_pages_exist.side_effect = lambda titles, **kwargs: dict(
+            (title, title == 'Category:A') for title in titles)
+        self.addCleanup(pages_exist_patcher.stop)
+
+    def test_categories_exist(self):
+        cache = {'Category:C|redirect': True}
+        result = categories_exist(
+            ['A', 'category:B', 'C', 'Category:A'], site='site', cache=cache)
+        self.assertEqual(
+            result,
+            {'A': True, 'category:B': False, 'C': True, 'Category:A': True})
+        self.mock_pages_exist.assert_called_once_with(
+            ['Category:A', 'Category:B'], site='site', follow_redirects=True)
+        self.assertEqual(
+            cache,
+            {'Category:A|redirect': True, 'Category:B|redirect': False,
+             'Category:C|redirect': True})
+
+    def test_categories_exist_normalised(self):
+        cache = {}
+        result = categories_exist(
+            ['Foo_bar', ' category:foo  bar', 'Category:Foo bar'],
+            cache=cache)
+        self.assertEqual(len(result), 3)
+        self.mock_pages_exist.assert_called_once_with(
+            ['Category:Foo bar'], site=None, follow_redirects=True)
+        self.assertEqual(list(cache), ['Category:Foo bar|redirect'])
+
+    def test_categories_exist_all_cached(self):
+        cache = {'Category:A|redirect': False}
+        self.assertEqual(categories_exist(['A'], cache=cache), {'A': False})
+        self.mock_pages_exist.assert_not_called()
+
+    def test_categories_exist_shared_with_category_exists(self):
+        # category_exists() does not follow redirects
+        cache = {'Category:A': False}
+        self.assertEqual(categories_exist(['A'], cache=cache), {'A': True})
+        self.assertEqual(
+            categories_exist(['A'], cache=cache, follow_redirects=False),
+            {'A': False})
+        self.mock_pages_exist.assert_called_once_with(
+            ['Category:A'], site=None, follow_redirects=True)
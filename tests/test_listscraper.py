@@ -115,11 +115,19 @@ class TestMakeListRow(TestMappingListBaseWithList):
         self.expected_output = 'block_template'
         self.default_template = 'row_t'
 
-        output_template_patcher = mock.patch(
-            'batchupload.listscraper.helpers.output_block_template')
-        self.mock_output_template = output_template_patcher.start()
-        self.mock_output_template.return_value = self.expected_output
-        self.addCleanup(output_template_patcher.stop)
+        renderer_patcher = mock.patch(
+            'batchupload.listscraper.helpers.BlockTemplateRenderer')
+        self.mock_renderer = renderer_patcher.start()
+        self.mock_render = self.mock_renderer.return_value.render
+        self.mock_render.return_value = self.expected_output
+        self.mock_renderer.side_effect = self.fake_renderer
+        self.addCleanup(renderer_patcher.stop)
+
+    def fake_renderer(self, name, keys, padding):
+        renderer = self.mock_renderer.return_value
+        renderer.name = name
+        renderer.keys = keys
+        return renderer
 
     def test_make_list_row_no_data(self):
         self.mapping_list.parameters = OrderedDict()
@@ -127,8 +135,9 @@ class TestMakeListRow(TestMappingListBaseWithList):
         self.assertEquals(
             self.mapping_list.make_list_row({}),
             self.expected_output)
-        self.mock_output_template.assert_called_once_with(
-            self.default_template, {}, 0)
+        self.mock_renderer.assert_called_once_with(
+            self.default_template, (), 0)
+        self.mock_render.assert_called_once_with({})
 
     def test_make_list_row_parameter_dict(self):
         self.mapping_list.parameters = OrderedDict([
@@ -141,8 +150,9 @@ class TestMakeListRow(TestMappingListBaseWithList):
         self.assertEquals(
             self.mapping_list.make_list_row(self.data),
             self.expected_output)
-        self.mock_output_template.assert_called_once_with(
-            self.default_template, self.expected_data, 0)
+        self.mock_renderer.assert_called_once_with(
+            self.default_template, ('E', 'C', 'D', 'A'), 0)
+        self.mock_render.assert_called_once_with(self.expected_data)
 
     def test_make_list_row_row_template(self):
         self.mapping_list.parameters = OrderedDict()
@@ -150,8 +160,8 @@ class TestMakeListRow(TestMappingListBaseWithList):
         self.assertEquals(
             self.mapping_list.make_list_row({}, template='foo'),
             self.expected_output)
-        self.mock_output_template.assert_called_once_with(
-            'foo', {}, 0)
+        self.mock_renderer.assert_called_once_with('foo', (), 0)
+        self.mock_render.assert_called_once_with({})
 
     def test_make_list_row_delimiter(self):
         self.mapping_list.parameters = OrderedDict([('B', 'B')])
@@ -160,8 +170,29 @@ class TestMakeListRow(TestMappingListBaseWithList):
         self.assertEquals(
             self.mapping_list.make_list_row(self.data, delimiter=';'),
             self.expected_output)
-        self.mock_output_template.assert_called_once_with(
-            self.default_template, self.expected_data, 0)
+        self.mock_renderer.assert_called_once_with(
+            self.default_template, ('B', ), 0)
+        self.mock_render.assert_called_once_with(self.expected_data)
+
+    def test_make_list_row_shared_parameter(self):
+        self.mapping_list.parameters = OrderedDict([
+            ('A', 'X'), ('B', 'Y'), ('E', 'X')])
+        self.mapping_list.make_list_row(self.data)
+        self.mock_renderer.assert_called_once_with(
+            self.default_template, ('X', 'Y'), 0)
+        self.mock_render.assert_called_once_with(
+            OrderedDict([('X', 'E value'), ('Y', 'B/b')]))
+
+    def test_make_list_row_reuse_renderer(self):
+        self.mapping_list.parameters = OrderedDict([('B', 'B')])
+        self.mapping_list.make_list_row(self.data)
+        self.mapping_list.make_list_row({})
+        self.mock_renderer.assert_called_once_with(
+            self.default_template, ('B', ), 0)
+        self.assertEqual(self.mock_render.call_count, 2)
+
+        self.mapping_list.make_list_row({}, template='foo')
+        self.assertEqual(self.mock_renderer.call_count, 2)
 
 
 class TestMappingToTable(TestMappingListBaseWithList):
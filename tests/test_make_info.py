@@ -2,8 +2,49 @@
 # -*- coding: utf-8  -*-
 """Unit tests for make_info.py."""
 from __future__ import unicode_literals
+import multiprocessing
+import os
+import shutil
+import tempfile
 import unittest
-from batchupload.make_info import make_info_page
+
+import mock
+
+import batchupload.common as common
+from batchupload.make_info import (
+    MakeBaseInfo,
+    _init_worker,
+    make_info_page
+)
+
+
+class DummyInfo(MakeBaseInfo):
+
+    """Minimal MakeBaseInfo implementation (picklable for worker tests)."""
+
+    def load_data(self, in_file):
+        return common.open_and_read_file(in_file, as_json=True)
+
+    def load_mappings(self, update_mappings):
+        self.mappings = {'type': {'a': 'Type A', 'b': 'Type B'}}
+
+    def process_data(self, raw_data):
+        self.data = raw_data
+
+    def make_info_template(self, item):
+        return '{{Information|description=%s}}' % item['descr']
+
+    def generate_filename(self, item):
+        return '%s - %s' % (item['descr'], item['id'])
+
+    def generate_content_cats(self, item):
+        return [self.mappings['type'][item['type']]]
+
+    def generate_meta_cats(self, item, content_cats):
+        return [self.make_maintenance_cat('batch'), self.batch_cat]
+
+    def get_original_filename(self, item):
+        return item['file']
 
 
 class TestMakeInfoPage(unittest.TestCase):
@@ -78,3 +119,480 @@ class TestMakeInfoPage(unittest.TestCase):
         self.assertEqual(
             make_info_page(self.data),
             expected)
+
+
+class DummyCacheInfo(DummyInfo):
+
+    """DummyInfo using a persistent cache, noting if it had to be opened."""
+
+    def load_mappings(self, update_mappings):
+        DummyInfo.load_mappings(self, update_mappings)
+        self.cache = self.open_cache('test')
+        self.cache['descr'] = 'Cached'
+
+    def make_info_template(self, item):
+        opened = self.cache._connection is None
+        return '%s|%s|%s' % (os.getpid(), opened, self.cache['descr'])
+
+
+class DummyStreamInfo(DummyInfo):
+
+    """DummyInfo loading and processing its data lazily."""
+
+    def load_data(self, in_file):
+        for key, item in sorted(
+                common.open_and_read_file(in_file, as_json=True).items()):
+            yield key, item
+
+    def iter_process_data(self, raw_data):
+        for key, item in raw_data:
+            yield key, dict(item, descr=item['descr'].upper())
+
+
+class TestMakeInfo(unittest.TestCase):
+
+    """Test the MakeBaseInfo.make_info method."""
+
+    def setUp(self):
+        self.info = DummyInfo('Base', 'label')
+        self.info.load_mappings(False)
+        raw_data = {}
+        for i in range(50):
+            raw_data['id_{}'.format(49 - i)] = {
+                'id': i, 'descr': 'Föremål {}'.format(i),
+                'type': 'ab'[i % 2], 'file': 'file_{}'.format(i % 45)}
+        self.info.process_data(raw_data)
+
+    def test_make_info(self):
+        out_data = self.info.make_info()
+        self.assertEqual(len(out_data), 45)  # 5 duplicate original filenames
+        self.assertEqual(out_data['file_1'], {
+            'info': '{{Information|description=Föremål 46}}',
+            'filename': 'Föremål 46 - 46',
+            'cats': ['Type A'],
+            'meta_cats': ['Base: batch', 'Base: label']})
+
+    def test_make_info_processes(self):
+        expected = self.info.make_info()
+        for chunk_size in (None, 1, 7):
+            out_data = self.info.make_info(processes=2, chunk_size=chunk_size)
+            self.assertEqual(out_data, expected)
+            self.assertEqual(list(out_data.keys()), list(expected.keys()))
+
+    def test_make_info_processes_own_cache_connection(self):
+        info = DummyCacheInfo('Base', 'label')
+        info.cwd_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, info.cwd_path)
+        self.addCleanup(info.close_caches)
+        info.load_mappings(False)
+        info.process_data(self.info.data)
+        entries = info.process_items(
+            list(info.data.values()), processes=2, chunk_size=5)
+        first_per_process = dict()
+        for original_filename, entry in entries:
+            pid, opened, descr = entry['info'].split('|')
+            first_per_process.setdefault(pid, opened)
+            self.assertEqual(descr, 'Cached')
+        self.assertNotIn(str(os.getpid()), first_per_process)
+        self.assertEqual(set(first_per_process.values()), {'True'})
+        self.assertEqual(info.cache['descr'], 'Cached')
+
+    def test_init_worker_closes_caches(self):
+        with mock.patch('batchupload.make_info.multiprocessing.util.'
+                        'Finalize') as mock_finalize:
+            _init_worker(self.info)
+        mock_finalize.assert_called_once_with(
+            None, self.info.close_caches, exitpriority=10)
+
+    def test_make_info_fingerprints(self):
+        with mock.patch.object(self.info, 'fingerprint') as mock_fingerprint:
+            self.info.make_info()
+        mock_fingerprint.assert_not_called()
+        self.assertEqual(self.info.fingerprints, {})
+        self.info.make_info(fingerprint=True)
+        self.assertEqual(len(self.info.fingerprints), 50)
+        self.assertEqual(self.info.fingerprints['id_3']['original_filename'],
+                         'file_1')
+
+    def test_make_info_previous(self):
+        previous = (self.info.make_info(fingerprint=True),
+                    self.info.fingerprints)
+        self.info.data['id_0']['descr'] = 'Changed'
+        self.info.data['id_new'] = {
+            'id': 50, 'descr': 'New', 'type': 'a', 'file': 'file_new'}
+        entry_patcher = mock.patch.object(
+            self.info, 'make_info_entry', wraps=self.info.make_info_entry)
+        with entry_patcher as mock_entry, \
+                mock.patch('batchupload.make_info.pywikibot.output'):
+            out_data = self.info.make_info(previous=previous)
+        self.assertEqual(mock_entry.call_count, 2)
+        self.assertEqual(out_data['file_4']['filename'], 'Changed - 49')
+        self.assertEqual(out_data['file_new']['filename'], 'New - 50')
+        self.assertEqual(out_data, self.info.make_info())
+
+    def test_make_info_previous_mappings_changed(self):
+        previous = (self.info.make_info(fingerprint=True),
+                    self.info.fingerprints)
+        self.info.mappings['type']['a'] = 'Changed type'
+        with mock.patch('batchupload.make_info.pywikibot.output'):
+            out_data = self.info.make_info(previous=previous)
+        self.assertEqual(out_data['file_1']['cats'], ['Changed type'])
+
+    def test_make_info_previous_not_serialisable(self):
+        previous = (self.info.make_info(fingerprint=True),
+                    self.info.fingerprints)
+        circular = dict()
+        circular['self'] = circular
+        self.info.data['id_0']['circular'] = circular
+        entry_patcher = mock.patch.object(
+            self.info, 'make_info_entry', wraps=self.info.make_info_entry)
+        with entry_patcher as mock_entry, \
+                mock.patch('batchupload.make_info.pywikibot.output'):
+            out_data = self.info.make_info(previous=previous)
+            self.assertEqual(mock_entry.call_count, 1)
+            self.assertIsNone(self.info.fingerprints['id_0']['fingerprint'])
+            self.info.make_info(previous=(out_data, self.info.fingerprints))
+            self.assertEqual(mock_entry.call_count, 2)
+
+    def test_make_info_mappings_not_serialisable(self):
+        self.info.mappings['self'] = self.info.mappings
+        expected = self.info.make_info()
+        with mock.patch('batchupload.make_info.pywikibot.warning') as warn:
+            self.assertEqual(self.info.make_info(fingerprint=True), expected)
+        warn.assert_called_once()
+        self.assertIsNone(self.info.fingerprints['id_0']['fingerprint'])
+
+
+class TestCheckFilenameCollisions(unittest.TestCase):
+
+    """Test the MakeBaseInfo.check_filename_collisions method."""
+
+    def setUp(self):
+        self.info = DummyInfo('Base', 'label')
+        self.out_data = {
+            '1': {'filename': 'A_file'},
+            '2': {'filename': 'B_file'},
+            '3': {'filename': 'a file'},
+            '4': {'filename': 'A_file'},
+            '5': {'filename': 'A_file_(4)'},
+            '6': {'filename': 'B_file_(7)'},
+            '7': {'filename': 'B_file'}}
+
+        warning_patcher = mock.patch('batchupload.make_info.pywikibot.warning')
+        self.mock_warning = warning_patcher.start()
+        self.addCleanup(warning_patcher.stop)
+
+    def test_check_filename_collisions_none(self):
+        out_data = {'1': {'filename': 'A'}, '2': {'filename': 'B'}}
+        self.assertEqual(self.info.check_filename_collisions(out_data), {})
+        self.mock_warning.assert_not_called()
+
+    def test_check_filename_collisions_report(self):
+        collisions = self.info.check_filename_collisions(self.out_data)
+        self.assertEqual(collisions, {'A_file': ['1', '3', '4'],
+                                      'B_file': ['2', '7']})
+        self.mock_warning.assert_called_once()
+        self.assertEqual(self.out_data['4']['filename'], 'A_file')
+
+    def test_check_filename_collisions_fail(self):
+        with self.assertRaises(common.MyError):
+            self.info.check_filename_collisions(self.out_data, policy='fail')
+
+    def test_check_filename_collisions_disambiguate(self):
+        self.info.check_filename_collisions(
+            self.out_data, policy='disambiguate')
+        self.assertEqual(
+            [v['filename'] for k, v in sorted(self.out_data.items())],
+            ['A_file', 'B_file', 'a file_(3)', 'A_file_(4)', 'A_file_(4)_(5)',
+             'B_file_(7)', 'B_file_(7)_2'])
+
+    def test_check_filename_collisions_unknown_policy(self):
+        with self.assertRaises(common.MyError):
+            self.info.check_filename_collisions(self.out_data, policy='x')
+
+    def test_make_info_collisions(self):
+        self.info.data = {
+            'id_1': {'id': 1, 'descr': 'A', 'type': 'a', 'file': 'f1'},
+            'id_2': {'id': 1, 'descr': 'A', 'type': 'a', 'file': 'f2'}}
+        self.info.load_mappings(False)
+        out_data = self.info.make_info(collisions='disambiguate')
+        self.assertEqual(out_data['f2']['filename'], 'A - 1_(id_2)')
+
+
+class TestMakeInfoRun(unittest.TestCase):
+
+    """Test the MakeBaseInfo.run method."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.in_file = os.path.join(self.out_dir, 'raw.json')
+        self.base_name = os.path.join(self.out_dir, 'data')
+        self.raw_data = {
+            'id_1': {'id': 1, 'descr': 'A', 'type': 'a', 'file': 'f1'},
+            'id_2': {'id': 2, 'descr': 'B', 'type': 'b', 'file': 'f2'}}
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+
+        for patched in ('output', 'warning'):
+            patcher = mock.patch(
+                'batchupload.make_info.pywikibot.{}'.format(patched))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cached = []
+        self.label = 'label'
+
+    def run_info(self, **kwargs):
+        info = DummyInfo('Base', self.label)
+        with mock.patch.object(info, 'make_info_entry',
+                               wraps=info.make_info_entry) as mock_entry:
+            info.run(self.in_file, self.base_name, False, **kwargs)
+        return mock_entry.call_count
+
+    def test_run_incremental(self):
+        fingerprint_file = os.path.join(self.out_dir, 'data.fingerprints.json')
+        self.assertEqual(self.run_info(), 2)
+        self.assertFalse(os.path.isfile(fingerprint_file))
+        self.assertEqual(self.run_info(incremental=True), 2)
+        self.assertTrue(os.path.isfile(fingerprint_file))
+        self.assertEqual(self.run_info(incremental=True), 0)
+
+        self.raw_data['id_2']['descr'] = 'C'
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+        self.assertEqual(self.run_info(incremental=True), 1)
+        out_data = common.open_and_read_file(
+            os.path.join(self.out_dir, 'data.json'), as_json=True)
+        self.assertEqual(out_data['f2']['filename'], 'C - 2')
+        self.assertEqual(out_data['f1']['filename'], 'A - 1')
+
+    def test_run_incremental_new_batch_label(self):
+        self.run_info(incremental=True)
+        self.label = 'other label'
+        self.assertEqual(self.run_info(incremental=True), 2)
+        out_data = common.open_and_read_file(
+            os.path.join(self.out_dir, 'data.json'), as_json=True)
+        self.assertEqual(out_data['f1']['meta_cats'],
+                         ['Base: batch', 'Base: other label'])
+
+    def test_run_incremental_compressed(self):
+        self.run_info(incremental=True, compact=True, compression='gzip')
+        out_file = os.path.join(self.out_dir, 'data.json.gz')
+        self.assertEqual(common.detect_compression(out_file), 'gzip')
+        self.assertEqual(
+            common.open_and_read_file(out_file, as_json=True)['f1']['cats'],
+            ['Type A'])
+        self.assertEqual(
+            self.run_info(incremental=True, compact=True, compression='gzip'),
+            0)
+
+    def test_run_incremental_sharded(self):
+        self.run_info(incremental=True, shard_size=1)
+        self.assertEqual(self.run_info(incremental=True, shard_size=1), 0)
+
+    def test_run_persistent_cache(self):
+        with mock.patch.object(DummyInfo, 'load_mappings',
+                               side_effect=self.cache_mappings, autospec=True):
+            self.run_info()
+            self.assertEqual(self.cached, [None])
+            self.run_info()
+            self.assertEqual(self.cached, [None, 'value'])
+            self.run_info(refresh_caches=True)
+            self.assertEqual(self.cached, [None, 'value', None])
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.out_dir, 'lookup_cache.sqlite')))
+
+    def cache_mappings(self, info, update_mappings):
+        cache = info.open_cache('test')
+        self.assertIs(info.open_cache('test'), cache)
+        self.cached.append(cache.get('key'))
+        cache['key'] = 'value'
+        info.mappings = {'type': {'a': 'Type A', 'b': 'Type B'}}
+
+    def test_run_incremental_collision_gone(self):
+        self.raw_data['id_2']['descr'] = 'A'
+        self.raw_data['id_2']['id'] = 1
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+        self.run_info(incremental=True, collisions='disambiguate')
+        self.assertEqual(self.read_out()['f2']['filename'], 'A - 1_(id_2)')
+
+        self.raw_data['id_1']['descr'] = 'C'
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+        self.assertEqual(
+            self.run_info(incremental=True, collisions='disambiguate'), 2)
+        self.assertEqual(self.read_out()['f2']['filename'], 'A - 1')
+
+    def read_out(self):
+        return common.open_and_read_file(
+            os.path.join(self.out_dir, 'data.json'), as_json=True)
+
+    def test_run_incremental_no_previous(self):
+        with mock.patch('batchupload.make_info.pywikibot.warning') as warn:
+            self.assertEqual(self.run_info(incremental=True), 2)
+        warn.assert_called_once()
+
+
+class TestMakeInfoStream(unittest.TestCase):
+
+    """Test the MakeBaseInfo.run method in streaming mode."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.in_file = os.path.join(self.out_dir, 'raw.json')
+        self.base_name = os.path.join(self.out_dir, 'data')
+        self.raw_data = {}
+        for i in range(25):
+            self.raw_data['id_{:02d}'.format(i)] = {
+                'id': i, 'descr': 'Item', 'type': 'ab'[i % 2],
+                'file': 'f{:02d}'.format(24 - i)}
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+
+        for patched in ('output', 'warning'):
+            patcher = mock.patch(
+                'batchupload.make_info.pywikibot.{}'.format(patched))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        batch_patcher = mock.patch('batchupload.make_info.STREAM_BATCH', 10)
+        batch_patcher.start()
+        self.addCleanup(batch_patcher.stop)
+
+    def run_info(self, cls=DummyInfo, **kwargs):
+        info = cls('Base', 'label')
+        info.run(self.in_file, self.base_name, False, **kwargs)
+        return info
+
+    def read(self, suffix, **kwargs):
+        return common.open_and_read_file(self.base_name + suffix, **kwargs)
+
+    def test_run_stream(self):
+        self.run_info(incremental=True)
+        expected = [self.read(suffix, as_json=True)
+                    for suffix in ('.json', '.fingerprints.json')]
+        expected_filenames = self.read('.filenames.txt')
+
+        # without fingerprints there is no previous output to reuse
+        os.remove(self.base_name + '.fingerprints.json')
+        self.run_info(stream=True, incremental=True)
+        self.assertEqual(self.read('.json', as_json=True), expected[0])
+        self.assertEqual(self.read('.fingerprints.json', as_json=True),
+                         expected[1])
+        # entries are kept in the order of the data
+        self.assertEqual(list(common.iter_json_object(
+            self.base_name + '.json'))[0][0], 'f24')
+        self.assertEqual(
+            sorted(self.read('.filenames.txt').splitlines()),
+            expected_filenames.splitlines())
+        self.assertFalse(any(
+            name.endswith('.tmp') for name in os.listdir(self.out_dir)))
+
+    def test_run_stream_duplicate_original_filenames(self):
+        for i in range(0, 25, 3):
+            self.raw_data['id_{:02d}'.format(i)]['file'] = 'f_same'
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+        self.run_info()
+        expected = self.read('.json', as_json=True)
+        expected_filenames = self.read('.filenames.txt')
+
+        self.run_info(stream=True)
+        self.assertEqual(self.read('.json', as_json=True), expected)
+        self.assertEqual(len(list(common.iter_json_object(
+            self.base_name + '.json'))), len(expected))
+        self.assertEqual(
+            sorted(self.read('.filenames.txt').splitlines()),
+            expected_filenames.splitlines())
+        self.run_info(stream=True, shard_size=4)
+        shards = common.JsonShards(self.base_name + '.index.jsonl')
+        self.assertEqual(len(shards), len(expected))
+        self.assertEqual(dict(shards.items()), expected)
+
+    def test_run_stream_processes(self):
+        self.run_info()
+        expected = self.read('.json', as_json=True)
+        pool_patcher = mock.patch(
+            'batchupload.make_info.multiprocessing.Pool',
+            wraps=multiprocessing.Pool)
+        with pool_patcher as mock_pool:
+            self.run_info(stream=True, processes=2)
+        mock_pool.assert_called_once()
+        self.assertEqual(self.read('.json', as_json=True), expected)
+
+    def test_run_stream_lazy(self):
+        self.run_info(cls=DummyStreamInfo, stream=True)
+        out_data = self.read('.json', as_json=True)
+        self.assertEqual(len(out_data), 25)
+        self.assertEqual(out_data['f00']['filename'], 'ITEM - 24')
+
+    def test_run_stream_incremental_sharded(self):
+        self.run_info(stream=True, shard_size=4, incremental=True)
+        self.raw_data['id_03']['descr'] = 'Changed'
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+
+        info = DummyInfo('Base', 'label')
+        with mock.patch.object(info, 'make_info_entry',
+                               wraps=info.make_info_entry) as mock_entry:
+            info.run(self.in_file, self.base_name, False, stream=True,
+                     shard_size=4, incremental=True)
+        self.assertEqual(mock_entry.call_count, 1)
+        shards = common.JsonShards(self.base_name + '.index.jsonl')
+        self.assertEqual(len(shards), 25)
+        self.assertEqual(shards['f21']['filename'], 'Changed - 3')
+        self.assertEqual(shards['f20']['filename'], 'Item - 4')
+
+    def test_run_stream_collisions(self):
+        self.raw_data['id_00']['id'] = 1
+        common.open_and_write_file(self.in_file, self.raw_data, as_json=True)
+        with self.assertRaises(common.MyError):
+            self.run_info(stream=True, collisions='fail')
+        self.run_info(stream=True, collisions='disambiguate')
+        self.assertEqual(self.read('.json', as_json=True)['f23']['filename'],
+                         'Item - 1_(id_01)')
+
+
+class TestMain(unittest.TestCase):
+
+    """Test the MakeBaseInfo.main method."""
+
+    def setUp(self):
+        output_patcher = mock.patch('batchupload.make_info.pywikibot.output')
+        self.mock_output = output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+        warning_patcher = mock.patch(
+            'batchupload.make_info.pywikibot.warning')
+        self.mock_warning = warning_patcher.start()
+        self.addCleanup(warning_patcher.stop)
+        run_patcher = mock.patch.object(DummyInfo, 'run')
+        self.mock_run = run_patcher.start()
+        self.addCleanup(run_patcher.stop)
+
+    def test_main_invalid_shard_size(self):
+        for value in ('abc', '0'):
+            self.assertIsNone(DummyInfo.main(
+                None, '-in_file:raw.json', '-shard_size:' + value))
+        self.mock_run.assert_not_called()
+        self.assertEqual(self.mock_output.call_count, 2)
+
+    def test_main_invalid_collisions(self):
+        self.assertIsNone(DummyInfo.main(
+            None, '-in_file:raw.json', '-collisions:ignore'))
+        self.mock_run.assert_not_called()
+        self.mock_output.assert_called_once()
+
+    def test_main_invalid_compress(self):
+        for value in ('', 'bz2'):
+            self.assertIsNone(DummyInfo.main(
+                None, '-in_file:raw.json', '-compress:' + value))
+        self.mock_run.assert_not_called()
+        self.assertEqual(self.mock_output.call_count, 2)
+
+    def test_main_compress(self):
+        DummyInfo.main(None, '-in_file:raw.json', '-compress:gzip')
+        self.assertEqual(self.mock_run.call_args[1]['compression'], 'gzip')
+
+    def test_main_invalid_processes(self):
+        self.assertIsNone(DummyInfo.main(
+            None, '-in_file:raw.json', '-processes:x'))
+        self.mock_run.assert_not_called()
+        self.mock_output.assert_called_once()
+
+    def test_main_valid(self):
+        DummyInfo.main(None, '-in_file:raw.json', '-shard_size:10')
+        self.assertEqual(self.mock_run.call_args[1]['shard_size'], 10)
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""Unit tests for mock_api.py."""
+from __future__ import unicode_literals
+import hashlib
+import json
+import unittest
+
+import mock
+
+from batchupload.mock_api import (
+    main,
+    MockServer,
+    MockWiki,
+    parse_multipart
+)
+
+try:
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+except ImportError:  # python 2
+    from urllib import urlencode
+    from urllib2 import urlopen
+
+
+class TestMockWikiUpload(unittest.TestCase):
+
+    """Test the upload action of MockWiki."""
+
+    def setUp(self):
+        self.wiki = MockWiki()
+        self.params = {'action': 'upload', 'token': 'csrf+\\',
+                       'filename': 'Test_file.jpg'}
+
+    def upload(self, files=None, **params):
+        request = dict(self.params)
+        request.update(params)
+        return self.wiki.handle(request, files or {})
+
+    def test_upload_missing_token(self):
+        del self.params['token']
+        result = self.upload(url='http://x.org/a.jpg')
+        self.assertEqual(result['error']['code'], 'missingparam')
+
+    def test_upload_file(self):
+        result = self.upload(files={'file': b'data'})
+        self.assertEqual(result['upload']['result'], 'Success')
+        self.assertEqual(result['upload']['filename'], 'Test file.jpg')
+        self.assertEqual(self.wiki.files['Test file.jpg']['sha1'],
+                         hashlib.sha1(b'data').hexdigest())
+        self.assertIn('File:Test file.jpg', self.wiki.pages)
+
+    def test_upload_url(self):
+        self.upload(url='http://x.org/a.jpg')
+        self.assertEqual(self.wiki.files['Test file.jpg']['size'],
+                         len('http://x.org/a.jpg'))
+
+    def test_upload_warnings(self):
+        self.wiki.add_file('Test file.jpg', b'data')
+        self.wiki.add_file('Other.jpg', b'other')
+        result = self.upload(files={'file': b'other'})
+        self.assertEqual(result['upload']['result'], 'Warning')
+        self.assertEqual(
+            result['upload']['warnings'],
+            {'exists': 'Test_file.jpg', 'duplicate': ['Other.jpg']})
+
+        # commit the stashed file ignoring the warnings
+        result = self.upload(filekey=result['upload']['filekey'],
+                             ignorewarnings='1')
+        self.assertEqual(result['upload']['result'], 'Success')
+        self.assertEqual(self.wiki.files['Test file.jpg']['size'], 5)
+        self.assertEqual(self.wiki.stash, {})
+
+    def test_upload_bad_prefix(self):
+        self.params['filename'] = 'DSC_0001.jpg'
+        result = self.upload(url='http://x.org/a.jpg')
+        self.assertEqual(result['upload']['warnings'],
+                         {'bad-prefix': 'DSC'})
+
+    def test_upload_chunks(self):
+        result = self.upload(files={'chunk': b'abc'}, offset='0',
+                             filesize='5', stash='1')
+        self.assertEqual(result['upload']['result'], 'Continue')
+        self.assertEqual(result['upload']['offset'], 3)
+        filekey = result['upload']['filekey']
+
+        result = self.upload(files={'chunk': b'de'}, offset='3',
+                             filesize='5', stash='1', filekey=filekey)
+        self.assertEqual(result['upload']['result'], 'Success')
+
+        result = self.upload(filekey=filekey)
+        self.assertEqual(result['upload']['result'], 'Success')
+        self.assertEqual(self.wiki.files['Test file.jpg']['sha1'],
+                         hashlib.sha1(b'abcde').hexdigest())
+
+    def test_upload_chunk_offset_mismatch(self):
+        result = self.upload(files={'chunk': b'abc'}, offset='0',
+                             filesize='6', stash='1')
+        filekey = result['upload']['filekey']
+        result = self.upload(files={'chunk': b'def'}, offset='1',
+                             filesize='6', stash='1', filekey=filekey)
+        self.assertEqual(result['error'],
+                         {'code': 'stashfailed', 'info': 'Offset mismatch.',
+                          'offset': 3})
+
+    def test_upload_unknown_filekey(self):
+        result = self.upload(filekey='missing.stash')
+        self.assertEqual(result['error']['code'], 'stashedfilenotfound')
+
+    def test_upload_inject_failure(self):
+        self.wiki.inject_failure('internal_api_error_DBQueryError', count=2)
+        for i in range(2):
+            result = self.upload(url='http://x.org/a.jpg')
+            self.assertEqual(result['error']['code'],
+                             'internal_api_error_DBQueryError')
+        result = self.upload(url='http://x.org/a.jpg')
+        self.assertEqual(result['upload']['result'], 'Success')
+        self.assertEqual(self.wiki.request_counts, {'upload': 3})
+
+    def test_upload_failure_rate(self):
+        self.wiki = MockWiki(failure_rate=1, failure_code='ratelimited')
+        result = self.upload(url='http://x.org/a.jpg')
+        self.assertEqual(result['error']['code'], 'ratelimited')
+
+
+class TestMockWikiLogin(unittest.TestCase):
+
+    """Test the login actions of MockWiki."""
+
+    def setUp(self):
+        self.wiki = MockWiki()
+
+    def get_user(self):
+        result = self.wiki.handle({'action': 'query', 'meta': 'userinfo'}, {})
+        return result['query']['userinfo']['name']
+
+    def test_login(self):
+        result = self.wiki.handle(
+            {'action': 'login', 'lgname': 'Bot@test', 'lgpassword': 'x',
+             'lgtoken': 'logintoken'}, {})
+        self.assertEqual(result['login']['result'], 'Success')
+        self.assertEqual(self.get_user(), 'Bot@test')
+
+    def test_clientlogin(self):
+        result = self.wiki.handle(
+            {'action': 'clientlogin', 'username': 'Other user',
+             'password': 'x', 'logintoken': 'logintoken'}, {})
+        self.assertEqual(result['clientlogin']['status'], 'PASS')
+        self.assertEqual(self.get_user(), 'Other user')
+
+    def test_clientlogin_missing_token(self):
+        result = self.wiki.handle(
+            {'action': 'clientlogin', 'username': 'Other user'}, {})
+        self.assertEqual(result['error']['code'], 'missingparam')
+        self.assertEqual(self.get_user(), 'Mock user')
+
+
+class TestMockWikiQuery(unittest.TestCase):
+
+    """Test the query action of MockWiki."""
+
+    def setUp(self):
+        self.wiki = MockWiki()
+        self.wiki.add_file('A b.jpg', b'data')
+
+    def test_query_titles(self):
+        result = self.wiki.handle(
+            {'action': 'query', 'titles': 'File:A_b.jpg|file:c.jpg'}, {})
+        pages = sorted(result['query']['pages'].values(),
+                       key=lambda page: page['title'])
+        self.assertEqual(
+            [(page['title'], 'missing' in page) for page in pages],
+            [('File:A b.jpg', False), ('File:C.jpg', True)])
+        self.assertEqual(len(result['query']['normalized']), 2)
+
+    def test_query_allimages_sha1(self):
+        result = self.wiki.handle(
+            {'action': 'query', 'list': 'allimages',
+             'aisha1': hashlib.sha1(b'data').hexdigest()}, {})
+        self.assertEqual([image['name'] for image in
+                          result['query']['allimages']], ['A_b.jpg'])
+
+        result = self.wiki.handle(
+            {'action': 'query', 'list': 'allimages', 'aisha1': '0' * 40}, {})
+        self.assertEqual(result['query']['allimages'], [])
+
+    def test_unknown_action(self):
+        result = self.wiki.handle({'action': 'edit'}, {})
+        self.assertEqual(result['error']['code'], 'badvalue')
+
+
+class TestParseMultipart(unittest.TestCase):
+
+    """Test the parse_multipart method."""
+
+    def test_parse_multipart(self):
+        body = (b'--XyZ\r\n'
+                b'Content-Disposition: form-data; name="action"\r\n'
+                b'\r\n'
+                b'upload\r\n'
+                b'--XyZ\r\n'
+                b'Content-Type: application/octet-stream\r\n'
+                b'Content-Disposition: form-data; name="chunk"; '
+                b'filename="a.jpg"\r\n'
+                b'\r\n'
+                b'\x00\r\n\xff\r\n'
+                b'--XyZ--\r\n')
+        fields, files = parse_multipart(
+            body, 'multipart/form-data; boundary="XyZ"')
+        self.assertEqual(fields, {'action': 'upload'})
+        self.assertEqual(files, {'chunk': b'\x00\r\n\xff'})
+
+    def test_parse_multipart_lf(self):
+        body = (b'--XyZ\n'
+                b'Content-Disposition: form-data; name="action"\n'
+                b'\n'
+                b'query\n'
+                b'--XyZ--\n')
+        fields, files = parse_multipart(
+            body, 'multipart/form-data; boundary=XyZ')
+        self.assertEqual(fields, {'action': 'query'})
+        self.assertEqual(files, {})
+
+
+class TestMockServer(unittest.TestCase):
+
+    """Test requests made to a running MockServer."""
+
+    def setUp(self):
+        self.server = MockServer().start()
+        self.addCleanup(self.server.stop)
+
+    def request(self, params, post=False):
+        query = urlencode(params)
+        if post:
+            response = urlopen(self.server.api_url, query.encode('utf-8'))
+        else:
+            response = urlopen('{0}?{1}'.format(self.server.api_url, query))
+        return json.loads(response.read().decode('utf-8'))
+
+    def test_get_siteinfo(self):
+        result = self.request({'action': 'query', 'meta': 'siteinfo',
+                               'format': 'json'})
+        self.assertEqual(result['query']['general']['server'],
+                         'http://localhost:{0}'.format(self.server.port))
+
+    def test_post_upload(self):
+        result = self.request({'action': 'upload', 'token': 'csrf+\\',
+                               'filename': 'A.jpg', 'url': 'http://x.org/a',
+                               'format': 'json'}, post=True)
+        self.assertEqual(result['upload']['result'], 'Success')
+        self.assertIn('A.jpg', self.server.wiki.files)
+
+
+class TestMain(unittest.TestCase):
+
+    """Test the main method."""
+
+    def setUp(self):
+        server_patcher = mock.patch('batchupload.mock_api.MockServer')
+        self.mock_server = server_patcher.start()
+        self.addCleanup(server_patcher.stop)
+        print_patcher = mock.patch('batchupload.mock_api.print',
+                                   create=True)
+        self.mock_print = print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def test_main_options(self):
+        main('-latency:0.5', '-failure_rate:1')
+        wiki = self.mock_server.call_args[0][0]
+        self.assertEqual((wiki.latency, wiki.failure_rate), (0.5, 1.0))
+
+    def test_main_invalid_options(self):
+        for arg in ('-latency:x', '-latency:-1', '-failure_rate:x',
+                    '-failure_rate:1.5'):
+            main(arg)
+        self.mock_server.assert_not_called()
+        self.assertEqual(self.mock_print.call_count, 4)
@@ -2,10 +2,34 @@
 # -*- coding: utf-8  -*-
 """Unit tests for uploader.py."""
 from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import mock
+import requests
+from pywikibot.data.api import APIError
 
+import batchupload.common as common
 from batchupload.common import MyError
-from batchupload.uploader import verify_url_file_extension
+from batchupload.uploader import (
+    AdaptiveChunkSize,
+    find_duplicates,
+    is_network_error,
+    is_transient_error,
+    main,
+    RateLimiter,
+    retry_delay,
+    run_jobs,
+    up_all,
+    up_all_from_url,
+    upload_single_file,
+    UploadJournal,
+    UploadMetrics,
+    verify_url_file_extension
+)
 
 
 class TestVerifyUrlFileExtension(unittest.TestCase):
@@ -51,3 +75,764 @@ class TestVerifyUrlFileExtension(unittest.TestCase):
         url = 'https://github.com/lokal-profil/BatchUploadTools.jpg'
         ext = verify_url_file_extension(url, self.file_exts, self.protocols)
         self.assertEqual(ext, '.jpg')
+
+
+class TestRunJobs(unittest.TestCase):
+
+    """Test the run_jobs method."""
+
+    def test_run_jobs_serial(self):
+        result = list(run_jobs(lambda x: x * 2, [1, 2, 3]))
+        self.assertEqual(result, [(1, 2), (2, 4), (3, 6)])
+
+    def test_run_jobs_threaded_keeps_order(self):
+        def slow_first(x):
+            if x == 0:
+                time.sleep(0.05)
+            return x * 2
+
+        result = list(run_jobs(slow_first, range(10), workers=4))
+        self.assertEqual(result, [(x, x * 2) for x in range(10)])
+
+    def test_run_jobs_threaded_consumes_lazily(self):
+        consumed = []
+
+        def jobs():
+            for x in range(100):
+                consumed.append(x)
+                yield x
+
+        gen = run_jobs(lambda x: x, jobs(), workers=2)
+        next(gen)
+        self.assertLessEqual(len(consumed), 4)
+        gen.close()
+
+    def test_run_jobs_threaded_raises(self):
+        def fail(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            list(run_jobs(fail, [1, 2], workers=2))
+
+
+class TestUpAll(unittest.TestCase):
+
+    """Test the up_all method."""
+
+    def setUp(self):
+        self.in_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.in_path)
+        for name in ('a', 'b', 'c'):
+            for ext in ('.jpg', '.info'):
+                common.open_and_write_file(
+                    os.path.join(self.in_path, name + ext), name)
+        common.open_and_write_file(
+            os.path.join(self.in_path, 'no_info.jpg'), '')
+
+        upload_patcher = mock.patch(
+            'batchupload.uploader.upload_single_file')
+        self.mock_upload = upload_patcher.start()
+        self.mock_upload.side_effect = self.fake_upload
+        self.addCleanup(upload_patcher.stop)
+
+        worker_site_patcher = mock.patch(
+            'batchupload.uploader.make_worker_site')
+        self.mock_worker_site = worker_site_patcher.start()
+        self.addCleanup(worker_site_patcher.stop)
+
+        output_patcher = mock.patch('batchupload.uploader.pywikibot.output')
+        output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+
+    @staticmethod
+    def fake_upload(file_name, media_file, text, target_site, **kwargs):
+        result = {'warning': None, 'error': None,
+                  'log': '{}: success'.format(file_name)}
+        if text == 'b':
+            result['error'] = 'failed'
+        elif text == 'c':
+            result['warning'] = 'warned'
+        return result
+
+    def assert_sorted_files(self):
+        def listing(sub_dir):
+            return sorted(os.listdir(os.path.join(self.in_path, sub_dir)))
+
+        self.assertEqual(listing('Uploaded'), ['a.info', 'a.jpg'])
+        self.assertEqual(listing('Uploaded_errors'), ['b.info', 'b.jpg'])
+        self.assertEqual(listing('Uploaded_warnings'), ['c.info', 'c.jpg'])
+        self.assertIn('no_info.jpg', os.listdir(self.in_path))
+
+    def test_up_all_serial(self):
+        up_all(self.in_path, target_site=mock.MagicMock())
+        self.assert_sorted_files()
+        self.mock_worker_site.assert_not_called()
+
+    def test_up_all_skip_duplicates(self):
+        a_file = os.path.join(self.in_path, 'a.jpg')
+        with mock.patch('batchupload.uploader.find_duplicates') as mock_dupes:
+            mock_dupes.return_value = {a_file: ['File:A.jpg']}
+            up_all(self.in_path, target_site=mock.MagicMock(),
+                   skip_duplicates=True)
+            self.assertEqual(len(mock_dupes.call_args[0][0]), 3)
+        self.assertEqual(self.mock_upload.call_count, 2)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.in_path, 'Uploaded'))), [])
+        self.assertIn(
+            'a.jpg',
+            os.listdir(os.path.join(self.in_path, 'Uploaded_warnings')))
+
+    def test_up_all_adaptive_chunks(self):
+        up_all(self.in_path, target_site=mock.MagicMock(),
+               adaptive_chunks=True)
+        self.assert_sorted_files()
+        self.assertEqual(
+            self.mock_upload.call_args_list[0][1]['chunk_size'], 5)
+        log = common.open_and_read_file(
+            os.path.join(self.in_path, '¤uploader.log'))
+        self.assertEqual(log.count(' MB)\n'), 3)
+
+    def test_up_all_adaptive_chunks_shrink_on_network_error(self):
+        with mock.patch('batchupload.uploader.AdaptiveChunkSize.update') \
+                as mock_update:
+            up_all(self.in_path, target_site=mock.MagicMock(),
+                   adaptive_chunks=True)
+            mock_update.assert_not_called()  # "b" fails permanently
+
+            self.mock_upload.side_effect = self.fake_network_error
+            up_all(os.path.join(self.in_path, 'Uploaded_errors'),
+                   target_site=mock.MagicMock(), adaptive_chunks=True)
+            mock_update.assert_called_once_with(1, mock.ANY, False)
+
+    def test_up_all_adaptive_chunks_upload_time(self):
+        self.mock_upload.side_effect = self.fake_timed_upload
+        with mock.patch('batchupload.uploader.AdaptiveChunkSize.update') \
+                as mock_update:
+            up_all(self.in_path, target_site=mock.MagicMock(),
+                   adaptive_chunks=True)
+        mock_update.assert_called_once_with(1, 2.5, True)
+
+    def fake_timed_upload(self, *args, **kwargs):
+        result = self.fake_upload(*args, **kwargs)
+        if not result['error'] and not result['warning']:
+            result['attempts'] = 1
+            result['metrics'] = {'upload': 2.5, 'wait': 60.0}
+        return result
+
+    def fake_network_error(self, *args, **kwargs):
+        result = self.fake_upload(*args, **kwargs)
+        result['network_error'] = True
+        return result
+
+    def test_up_all_metrics(self):
+        up_all(self.in_path, target_site=mock.MagicMock())
+        lines = [json.loads(line) for line in common.open_and_read_file(
+            os.path.join(self.in_path, '¤metrics.jsonl')).splitlines()]
+        self.assertEqual([line['type'] for line in lines],
+                         ['upload', 'upload', 'upload', 'summary'])
+        self.assertEqual(sorted(line['outcome'] for line in lines[:3]),
+                         ['error', 'success', 'warning'])
+        self.assertTrue(all('read' in line for line in lines[:3]))
+        self.assertEqual(lines[3]['files'], 3)
+
+    def test_up_all_workers(self):
+        up_all(self.in_path, target_site=mock.MagicMock(), workers=2)
+        self.assert_sorted_files()
+        self.assertEqual(self.mock_upload.call_count, 3)
+        log = common.open_and_read_file(
+            os.path.join(self.in_path, '¤uploader.log'))
+        self.assertEqual(len(log.strip().split('\n')), 4)
+
+
+class TestFindDuplicates(unittest.TestCase):
+
+    """Test the find_duplicates method."""
+
+    def setUp(self):
+        self.in_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.in_path)
+        self.files = []
+        for name in ('a', 'b'):
+            path = os.path.join(self.in_path, name + '.jpg')
+            common.open_and_write_file(path, name)
+            self.files.append(path)
+
+    def test_find_duplicates(self):
+        a_sha1 = common.file_sha1(self.files[0])
+        existing = mock.MagicMock()
+        existing.title.return_value = 'File:Old a.jpg'
+        site = mock.MagicMock()
+        site.allimages.side_effect = (
+            lambda sha1: [existing] if sha1 == a_sha1 else [])
+
+        result = find_duplicates(self.files, site, processes=2, workers=2)
+        self.assertEqual(result, {self.files[0]: ['File:Old a.jpg']})
+        self.assertEqual(site.allimages.call_count, 2)
+
+
+class TestUpAllFromUrl(unittest.TestCase):
+
+    """Test the up_all_from_url method."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.info_path = os.path.join(self.out_dir, 'info.json')
+        data = {}
+        for name in ('a', 'b', 'c', 'd'):
+            data['http://x.org/{}.jpg'.format(name)] = {
+                'info': name, 'filename': name, 'cats': [], 'meta_cats': []}
+        data['http://x.org/e.txt'] = data['http://x.org/a.jpg']
+        common.open_and_write_file(self.info_path, data, as_json=True)
+
+        upload_patcher = mock.patch(
+            'batchupload.uploader.upload_single_file')
+        self.mock_upload = upload_patcher.start()
+        self.mock_upload.side_effect = self.fake_upload
+        self.addCleanup(upload_patcher.stop)
+
+        worker_site_patcher = mock.patch(
+            'batchupload.uploader.make_worker_site')
+        self.mock_worker_site = worker_site_patcher.start()
+        self.addCleanup(worker_site_patcher.stop)
+
+        output_patcher = mock.patch('batchupload.uploader.pywikibot.output')
+        output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+
+    @staticmethod
+    def fake_upload(file_name, media_file, text, target_site, **kwargs):
+        result = {'warning': None, 'error': None,
+                  'log': '{}: success'.format(file_name)}
+        if text == 'b':
+            result['error'] = 'failed'
+        elif text == 'c':
+            result['warning'] = 'warned'
+        return result
+
+    def read_log(self, name):
+        return sorted(common.trim_list(common.open_and_read_file(
+            os.path.join(self.out_dir, 'upload_logs', name)).split('\n')))
+
+    def test_up_all_from_url_workers(self):
+        up_all_from_url(
+            self.info_path, target_site=mock.MagicMock(), workers=3)
+        self.assertEqual(self.mock_upload.call_count, 4)
+        self.assertEqual(
+            self.read_log('success.log'),
+            ['http://x.org/a.jpg', 'http://x.org/d.jpg'])
+        self.assertEqual(self.read_log('errors.log'), ['http://x.org/b.jpg'])
+        self.assertEqual(
+            self.read_log('warnings.log'), ['http://x.org/c.jpg'])
+        self.assertEqual(len(self.read_log('uploader.log')), 6)
+
+    def test_up_all_from_url_check_existing(self):
+        with mock.patch('batchupload.uploader.helpers.pages_exist') as exist:
+            exist.side_effect = lambda titles, site: {
+                title: title == 'File:a.jpg' for title in titles}
+            up_all_from_url(self.info_path, target_site=mock.MagicMock(),
+                            check_existing='skip')
+            self.assertEqual(len(exist.call_args[0][0]), 4)
+        self.assertEqual(self.mock_upload.call_count, 3)
+        self.assertEqual(
+            self.read_log('warnings.log'),
+            ['http://x.org/a.jpg', 'http://x.org/c.jpg'])
+
+    def test_up_all_from_url_stream(self):
+        up_all_from_url(self.info_path, target_site=mock.MagicMock(),
+                        workers=2, stream=True)
+        self.assertEqual(self.mock_upload.call_count, 4)
+        self.assertEqual(
+            self.read_log('success.log'),
+            ['http://x.org/a.jpg', 'http://x.org/d.jpg'])
+        self.assertEqual(self.read_log('errors.log'), ['http://x.org/b.jpg'])
+
+    def test_up_all_from_url_sharded(self):
+        data = common.open_and_read_file(self.info_path, as_json=True)
+        index_file = common.write_json_shards(
+            os.path.join(self.out_dir, 'info'), data, shard_size=2)
+        for stream in (False, True):
+            up_all_from_url(index_file, target_site=mock.MagicMock(),
+                            stream=stream)
+        self.assertEqual(self.mock_upload.call_count, 8)
+        self.assertEqual(
+            self.read_log('success.log'),
+            ['http://x.org/a.jpg'] * 2 + ['http://x.org/d.jpg'] * 2)
+
+    def test_up_all_from_url_stream_filter(self):
+        with mock.patch('batchupload.uploader.common.open_and_read_file') \
+                as mock_read:
+            up_all_from_url(
+                self.info_path, target_site=mock.MagicMock(), stream=True,
+                only=['http://x.org/a.jpg', 'http://x.org/b.jpg',
+                      'http://x.org/c.jpg'],
+                skip=['http://x.org/b.jpg'], cutoff=1)
+            mock_read.assert_not_called()
+        self.mock_upload.assert_called_once()
+        self.assertEqual(self.mock_upload.call_args[0][1],
+                         'http://x.org/a.jpg')
+
+    def test_up_all_from_url_stream_check_existing(self):
+        with mock.patch('batchupload.uploader.helpers.pages_exist') as exist, \
+                mock.patch('batchupload.uploader.PREFLIGHT_BATCH', 3):
+            exist.side_effect = lambda titles, site: {
+                title: title == 'File:a.jpg' for title in titles}
+            up_all_from_url(self.info_path, target_site=mock.MagicMock(),
+                            check_existing='skip', stream=True)
+            self.assertEqual(
+                [len(call[0][0]) for call in exist.call_args_list], [3, 1])
+        self.assertEqual(self.mock_upload.call_count, 3)
+        self.assertEqual(
+            self.read_log('warnings.log'),
+            ['http://x.org/a.jpg', 'http://x.org/c.jpg'])
+
+    def test_up_all_from_url_resume(self):
+        up_all_from_url(self.info_path, target_site=mock.MagicMock())
+        self.mock_upload.reset_mock()
+        up_all_from_url(
+            self.info_path, target_site=mock.MagicMock(), resume=True)
+        self.mock_upload.assert_called_once()
+        self.assertEqual(self.mock_upload.call_args[0][1],
+                         'http://x.org/b.jpg')
+
+
+class TestUploadJournal(unittest.TestCase):
+
+    """Test the UploadJournal class."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+
+    def test_upload_journal_last_state_wins(self):
+        journal = UploadJournal(self.out_dir)
+        journal.record('a', 'pending')
+        journal.record('a', 'done')
+        journal.record('b', 'pending')
+        journal.record('c', 'warning')
+        journal.record('d', 'error')
+        journal.close_and_confirm()
+
+        journal = UploadJournal(self.out_dir)
+        self.assertEqual(
+            journal.states,
+            {'a': 'done', 'b': 'pending', 'c': 'warning', 'd': 'error'})
+        self.assertTrue(journal.is_completed('a'))
+        self.assertFalse(journal.is_completed('b'))
+        self.assertTrue(journal.is_completed('c'))
+        self.assertFalse(journal.is_completed('d'))
+        self.assertFalse(journal.is_completed('e'))
+        journal.close_and_confirm()
+
+    def test_upload_journal_ignore_partial_line(self):
+        journal = UploadJournal(self.out_dir)
+        journal.record('a', 'done')
+        journal.file.write('{"key": "b", "sta')
+        journal.close_and_confirm()
+
+        journal = UploadJournal(self.out_dir)
+        self.assertEqual(journal.states, {'a': 'done'})
+        journal.record('c', 'done')
+        journal.close_and_confirm()
+
+        journal = UploadJournal(self.out_dir)
+        self.assertEqual(journal.states, {'a': 'done', 'c': 'done'})
+        journal.close_and_confirm()
+
+    def test_upload_journal_unknown_state(self):
+        journal = UploadJournal(self.out_dir)
+        with self.assertRaises(MyError):
+            journal.record('a', 'uploaded')
+        journal.close_and_confirm()
+
+
+class TestUploadMetrics(unittest.TestCase):
+
+    """Test the UploadMetrics class."""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.metrics = UploadMetrics(self.out_dir)
+
+    @staticmethod
+    def result(error=None, warning=None, **metrics):
+        return {'error': error, 'warning': warning, 'metrics': metrics}
+
+    def read_lines(self):
+        return [json.loads(line) for line in common.open_and_read_file(
+            self.metrics.file_name).splitlines()]
+
+    def test_upload_metrics_record(self):
+        self.metrics.record(self.result(file='A.jpg', total=1.5))
+        self.metrics.record({'error': 'failed', 'warning': None, 'log': ''})
+        lines = self.read_lines()
+        self.assertEqual(lines[0]['file'], 'A.jpg')
+        self.assertEqual(lines[0]['outcome'], 'success')
+        self.assertEqual(lines[0]['type'], 'upload')
+        self.assertIn('timestamp', lines[0])
+        self.assertEqual(lines[1]['outcome'], 'error')
+
+    def test_upload_metrics_summary(self):
+        for i in range(1, 20):
+            self.metrics.record(self.result(
+                total=float(i), bytes=1048576, attempts=1))
+        self.metrics.record(self.result(
+            error='failed', total=20.0, bytes=5, attempts=3,
+            code='stashedfilenotfound'))
+        self.metrics.record(self.result(
+            warning='warned', total=0.5, bytes=5, attempts=1,
+            code='duplicate'))
+        self.metrics.record(self.result(
+            warning='skipped', skipped=True, attempts=0, code='exists'))
+        summary = self.metrics.summary()
+        self.assertEqual(summary['files'], 22)
+        self.assertEqual(
+            (summary['success'], summary['warning'], summary['error'],
+             summary['skipped']),
+            (19, 1, 1, 1))
+        self.assertEqual(summary['bytes'], 19 * 1048576)
+        self.assertEqual(summary['retries'], 2)
+        self.assertEqual(summary['latency_p50'], 10.0)
+        self.assertEqual(summary['latency_p95'], 19.0)
+        self.assertEqual(summary['latency_max'], 20.0)
+        self.assertEqual(
+            summary['codes'],
+            {'stashedfilenotfound': 1, 'duplicate': 1, 'exists': 1})
+
+    def test_upload_metrics_close_and_confirm(self):
+        self.metrics.record(self.result(total=1.0, bytes=10, attempts=1))
+        confirmation = self.metrics.close_and_confirm()
+        self.assertTrue(confirmation.startswith(
+            '1 files processed in '))
+        self.assertTrue(confirmation.endswith(
+            'Created {0}'.format(self.metrics.file_name)))
+        lines = self.read_lines()
+        self.assertEqual(lines[-1]['type'], 'summary')
+        self.assertEqual(lines[-1]['success'], 1)
+
+    def test_upload_metrics_empty_summary(self):
+        summary = self.metrics.summary()
+        self.assertEqual(summary['files'], 0)
+        self.assertIsNone(summary['latency_p50'])
+        self.assertIn('0 files processed',
+                      UploadMetrics.format_summary(summary))
+
+
+class TestUploadSingleFile(unittest.TestCase):
+
+    """Test the upload_single_file method."""
+
+    def setUp(self):
+        file_page_patcher = mock.patch(
+            'batchupload.uploader.pywikibot.FilePage')
+        self.mock_file_page = file_page_patcher.start()
+        self.mock_file_page.return_value.title.return_value = 'File:A.jpg'
+        self.addCleanup(file_page_patcher.stop)
+
+        sleep_patcher = mock.patch('batchupload.uploader.time.sleep')
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        warning_patcher = mock.patch(
+            'batchupload.uploader.pywikibot.warning')
+        warning_patcher.start()
+        self.addCleanup(warning_patcher.stop)
+
+        self.site = mock.MagicMock()
+
+    def test_upload_single_file_success(self):
+        self.site.upload.return_value = True
+        result = upload_single_file('A.jpg', 'a.jpg', 'text', self.site)
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['attempts'], 1)
+        self.assertEqual(result['log'], 'File:A.jpg: success')
+        self.mock_sleep.assert_not_called()
+
+    def test_upload_single_file_retry_transient(self):
+        self.site.upload.side_effect = [
+            APIError('stashedfilenotfound', 'not in stash'), True]
+        result = upload_single_file('A.jpg', 'a.jpg', 'text', self.site)
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['attempts'], 2)
+        self.assertEqual(result['log'], 'File:A.jpg: success')
+        self.mock_sleep.assert_called_once()
+
+    def test_upload_single_file_no_retry_permanent(self):
+        self.site.upload.side_effect = APIError('filetype-banned', 'banned')
+        result = upload_single_file('A.jpg', 'a.jpg', 'text', self.site)
+        self.assertEqual(result['error'].code, 'filetype-banned')
+        self.assertEqual(result['attempts'], 1)
+        self.mock_sleep.assert_not_called()
+
+    def test_upload_single_file_give_up(self):
+        self.site.upload.side_effect = APIError('ratelimited', 'slow down')
+        result = upload_single_file(
+            'A.jpg', 'a.jpg', 'text', self.site, max_retries=2)
+        self.assertEqual(result['error'].code, 'ratelimited')
+        self.assertEqual(result['attempts'], 3)
+        self.assertEqual(self.mock_sleep.call_count, 2)
+
+    def test_upload_single_file_rate_limiter(self):
+        error = APIError('ratelimited', 'slow down')
+        self.site.upload.side_effect = [error, True]
+        rate_limiter = mock.MagicMock()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'12345')
+            f.flush()
+            result = upload_single_file(
+                'A.jpg', f.name, 'text', self.site, rate_limiter=rate_limiter)
+        self.assertEqual(result['attempts'], 2)
+        self.assertEqual(rate_limiter.acquire.call_args_list,
+                         [mock.call(5), mock.call(5)])
+        self.assertEqual(rate_limiter.update.call_args_list,
+                         [mock.call(error), mock.call(None)])
+
+    def test_upload_single_file_metrics(self):
+        self.site.upload.side_effect = [
+            APIError('stashedfilenotfound', 'not in stash'), True]
+        rate_limiter = mock.MagicMock()
+        rate_limiter.acquire.return_value = 0.5
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'12345')
+            f.flush()
+            result = upload_single_file(
+                'A.jpg', f.name, 'text', self.site, chunk_size=2,
+                rate_limiter=rate_limiter)
+        metrics = result['metrics']
+        self.assertEqual(metrics['file'], 'A.jpg')
+        self.assertEqual(metrics['bytes'], 5)
+        self.assertEqual(metrics['chunk_size'], 2)
+        self.assertEqual(metrics['attempts'], 2)
+        self.assertIsNone(metrics['code'])
+        self.assertEqual(metrics['wait'], 1.0)
+        self.assertEqual(metrics['retry_wait'],
+                         self.mock_sleep.call_args[0][0])
+        self.assertGreaterEqual(metrics['total'], metrics['upload'])
+
+    def test_upload_single_file_metrics_code(self):
+        self.site.upload.side_effect = APIError('filetype-banned', 'banned')
+        result = upload_single_file('A.jpg', 'http://x.org/a.jpg', 'text',
+                                    self.site)
+        self.assertEqual(result['metrics']['code'], 'filetype-banned')
+        self.assertEqual(result['metrics']['bytes'], 0)
+        self.assertIsNone(result['metrics']['chunk_size'])
+
+        self.site.upload.side_effect = ValueError('oops')
+        result = upload_single_file('A.jpg', 'a.jpg', 'text', self.site)
+        self.assertEqual(result['metrics']['code'], 'ValueError')
+
+    def test_upload_single_file_rate_limiter_url(self):
+        self.site.upload.return_value = True
+        rate_limiter = mock.MagicMock()
+        upload_single_file('A.jpg', 'http://x.org/a.jpg', 'text', self.site,
+                           rate_limiter=rate_limiter)
+        rate_limiter.acquire.assert_called_once_with(0)
+
+    def test_upload_single_file_keyboard_interrupt(self):
+        self.site.upload.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            upload_single_file('A.jpg', 'a.jpg', 'text', self.site)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    """Test the RateLimiter class."""
+
+    def setUp(self):
+        self.now = 1000.0
+        time_patcher = mock.patch('batchupload.uploader.time.time',
+                                  side_effect=lambda: self.now)
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+        sleep_patcher = mock.patch('batchupload.uploader.time.sleep',
+                                   side_effect=self.fake_sleep)
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def fake_sleep(self, seconds):
+        self.now += seconds
+
+    def test_rate_limiter_unlimited(self):
+        limiter = RateLimiter()
+        for i in range(5):
+            self.assertEqual(limiter.acquire(10 ** 9), 0)
+        self.mock_sleep.assert_not_called()
+
+    def test_rate_limiter_uploads_per_minute(self):
+        limiter = RateLimiter(uploads_per_minute=60)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 1.0)
+        self.assertAlmostEqual(limiter.acquire(), 1.0)
+        self.now += 5
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_rate_limiter_burst(self):
+        limiter = RateLimiter(uploads_per_minute=60, burst=3)
+        for i in range(3):
+            self.assertEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 1.0)
+
+    def test_rate_limiter_bytes_per_second(self):
+        limiter = RateLimiter(bytes_per_second=100)
+        self.assertEqual(limiter.acquire(50), 0)
+        self.assertAlmostEqual(limiter.acquire(100), 0.5)
+        # larger than the capacity, waits for a full bucket then goes in debt
+        self.assertAlmostEqual(limiter.acquire(300), 1.0)
+        self.assertAlmostEqual(limiter.acquire(0), 2.0)
+
+    def test_rate_limiter_penalize(self):
+        limiter = RateLimiter(uploads_per_minute=60)
+        limiter.acquire()
+        limiter.penalize(10)
+        self.assertAlmostEqual(limiter.acquire(), 10.0)
+        self.assertEqual(limiter.factor, 0.5)
+        self.assertAlmostEqual(limiter.acquire(), 2.0)
+
+    def test_rate_limiter_penalize_unlimited(self):
+        limiter = RateLimiter(pause=7)
+        limiter.penalize()
+        self.assertAlmostEqual(limiter.acquire(), 7.0)
+        self.assertEqual(limiter.acquire(), 0)
+
+    def test_rate_limiter_penalize_min_factor(self):
+        limiter = RateLimiter(min_factor=0.25)
+        for i in range(5):
+            limiter.penalize()
+        self.assertEqual(limiter.factor, 0.25)
+
+    def test_rate_limiter_reward(self):
+        limiter = RateLimiter(recovery=0.25)
+        limiter.penalize()
+        limiter.reward()
+        self.assertEqual(limiter.factor, 0.75)
+        limiter.reward()
+        limiter.reward()
+        self.assertEqual(limiter.factor, 1.0)
+
+    def test_rate_limiter_update_maxlag(self):
+        limiter = RateLimiter()
+        limiter.update(APIError('maxlag', 'lagged', lag=3.5))
+        self.assertEqual(limiter.factor, 0.5)
+        self.assertAlmostEqual(limiter.acquire(), 3.5)
+
+    def test_rate_limiter_update_other_errors(self):
+        limiter = RateLimiter()
+        limiter.update(APIError('stashedfilenotfound', 'not in stash'))
+        limiter.update('Unhandled error')
+        self.assertEqual(limiter.factor, 1.0)
+        self.assertEqual(limiter.acquire(), 0)
+
+
+class TestIsTransientError(unittest.TestCase):
+
+    """Test the is_transient_error method."""
+
+    def test_is_transient_error_api_transient(self):
+        self.assertTrue(is_transient_error(APIError('maxlag', 'lag')))
+
+    def test_is_transient_error_api_permanent(self):
+        self.assertFalse(
+            is_transient_error(APIError('verification-error', '')))
+
+    def test_is_transient_error_connection(self):
+        self.assertTrue(is_transient_error(
+            requests.exceptions.ConnectionError()))
+
+    def test_is_transient_error_other(self):
+        self.assertFalse(is_transient_error(ValueError()))
+
+
+class TestIsNetworkError(unittest.TestCase):
+
+    """Test the is_network_error method."""
+
+    def test_is_network_error_api(self):
+        self.assertTrue(is_network_error(APIError('http-timed-out', '')))
+        self.assertFalse(is_network_error(APIError('maxlag', 'lag')))
+
+    def test_is_network_error_connection(self):
+        self.assertTrue(is_network_error(
+            requests.exceptions.ConnectionError()))
+        self.assertTrue(is_network_error(requests.exceptions.ReadTimeout()))
+
+    def test_is_network_error_other(self):
+        self.assertFalse(is_network_error(ValueError()))
+
+
+class TestRetryDelay(unittest.TestCase):
+
+    """Test the retry_delay method."""
+
+    def test_retry_delay_grows(self):
+        self.assertTrue(2.5 <= retry_delay(1, base=5) <= 5)
+        self.assertTrue(10 <= retry_delay(3, base=5) <= 20)
+
+    def test_retry_delay_capped(self):
+        self.assertTrue(50 <= retry_delay(10, base=5, cap=100) <= 100)
+
+
+class TestAdaptiveChunkSize(unittest.TestCase):
+
+    """Test the AdaptiveChunkSize class."""
+
+    def setUp(self):
+        self.mb = 1048576
+        self.sizer = AdaptiveChunkSize(
+            initial=5, minimum=1, maximum=50, target_time=10)
+
+    def test_adaptive_chunk_size_initial(self):
+        self.assertEqual(self.sizer.for_file(100 * self.mb), 5)
+
+    def test_adaptive_chunk_size_initial_bounded(self):
+        sizer = AdaptiveChunkSize(initial=500, maximum=50)
+        self.assertEqual(sizer.for_file(self.mb), 50)
+
+    def test_adaptive_chunk_size_large_file(self):
+        self.assertEqual(self.sizer.for_file(1000 * self.mb), 10)
+        self.assertEqual(self.sizer.for_file(100000 * self.mb), 50)
+
+    def test_adaptive_chunk_size_grow_on_fast_link(self):
+        # 4 MB/s should give 40 MB chunks, but growth is limited to doubling
+        self.sizer.update(40 * self.mb, 10, True)
+        self.assertEqual(self.sizer.for_file(self.mb), 10)
+        self.sizer.update(40 * self.mb, 10, True)
+        self.assertEqual(self.sizer.for_file(self.mb), 20)
+        self.sizer.update(40 * self.mb, 10, True)
+        self.assertEqual(self.sizer.for_file(self.mb), 40)
+
+    def test_adaptive_chunk_size_shrink_on_slow_link(self):
+        # 0.2 MB/s should give 2 MB chunks
+        self.sizer.update(2 * self.mb, 10, True)
+        self.assertAlmostEqual(self.sizer.for_file(self.mb), 2)
+
+    def test_adaptive_chunk_size_shrink_on_failure(self):
+        self.sizer.update(self.mb, 10, False)
+        self.assertEqual(self.sizer.for_file(self.mb), 2.5)
+        self.sizer.update(self.mb, 10, False)
+        self.sizer.update(self.mb, 10, False)
+        self.assertEqual(self.sizer.for_file(self.mb), 1)
+
+
+class TestMain(unittest.TestCase):
+
+    """Test the main method."""
+
+    def setUp(self):
+        output_patcher = mock.patch('batchupload.uploader.pywikibot.output')
+        self.mock_output = output_patcher.start()
+        self.addCleanup(output_patcher.stop)
+        up_all_patcher = mock.patch('batchupload.uploader.up_all')
+        self.mock_up_all = up_all_patcher.start()
+        self.addCleanup(up_all_patcher.stop)
+
+    def test_main_chunk_size(self):
+        main('-in_path:files', '-chunk_size:2.5')
+        self.assertEqual(self.mock_up_all.call_args[1]['chunk_size'], 2.5)
+
+    def test_main_invalid_chunk_size(self):
+        for value in ('abc', '0', '-1', 'nan', 'inf'):
+            main('-in_path:files', '-chunk_size:' + value)
+        self.mock_up_all.assert_not_called()
+        self.assertEqual(self.mock_output.call_count, 5)